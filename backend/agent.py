@@ -8,26 +8,128 @@ from physics.physic_functions import (
     make_and_run_feff,
     load_paths,
     transform_paths,
+    DEFAULT_PARAMS,
 )
+from physics.path_index import FeffPathIndex
 from function_calling import fit_ffef
+from executor import run_in_pool, current_job, current_priority, current_user, PRIORITIES, FEFF_TIMEOUT
+from singleflight import AsyncSingleFlight
 import asyncio
+from pathlib import Path
 
 
 load_dotenv()
 
+feff_flight = AsyncSingleFlight()
+_feff_runs = {}  # run key -> _SharedRun of the run in flight
+
+
+class _SharedRun:
+    """
+    Scheduling of one shared FEFF run: the highest priority among its waiters.
+    """
+
+    def __init__(self, priority):
+        self.priority = priority
+        self.raised = asyncio.Event()
+        self.active = False
+
+    def want(self, priority):
+        if PRIORITIES.index(priority) < PRIORITIES.index(self.priority):
+            self.priority = priority
+            self.raised.set()
+
+
+async def _run_feff_shared(key, run):
+    # shared by every job waiting for this run: cancelling one must not kill
+    # it, and its pool slot counts for no single user
+    current_job.set(None)
+    current_user.set("shared-feff")
+    cif_file, absorber, radius, edge, profile = key
+    started = False
+
+    def on_start():
+        nonlocal started
+        started = True
+
+    run.active = True
+    try:
+        while True:
+            run.raised.clear()
+            call = asyncio.ensure_future(
+                run_in_pool(
+                    make_and_run_feff,
+                    cif_file,
+                    absorber,
+                    radius=radius,
+                    edge=edge,
+                    timeout=FEFF_TIMEOUT,
+                    profile=profile,
+                    priority=run.priority,
+                    on_start=on_start,
+                )
+            )
+            raised = asyncio.ensure_future(run.raised.wait())
+            try:
+                await asyncio.wait({call, raised}, return_when=asyncio.FIRST_COMPLETED)
+            except BaseException:
+                call.cancel()
+                raise
+            finally:
+                raised.cancel()
+            if call.done() or started:
+                return await call
+            # a more urgent caller joined while the run was still queued:
+            # queue it again in that caller's class
+            call.cancel()
+            try:
+                # finished after all, just before the cancel
+                return await call
+            except asyncio.CancelledError:
+                pass
+    finally:
+        run.active = False
+        if _feff_runs.get(key) is run:
+            del _feff_runs[key]
+
+
+async def run_feff(cif_file: str, absorber: str, radius=5.0, edge="K", profile="exafs"):
+    """
+    make_and_run_feff in the pool; concurrent requests for the same run
+    (same CIF name, absorber, radius, edge and profile) share one FEFF run,
+    queued at the priority of the most urgent of them.
+    """
+    absorber = absorber.strip()
+    absorber = absorber[:1].upper() + absorber[1:]
+    key = (str(cif_file), absorber, float(radius), edge.upper(), profile)
+    run = _feff_runs.get(key)
+    if run is None:
+        run = _feff_runs[key] = _SharedRun(current_priority.get())
+    else:
+        run.want(current_priority.get())
+    try:
+        return await feff_flight.do(key, _run_feff_shared, key, run)
+    finally:
+        # joined a run that had just finished: nobody else cleans this up
+        if not run.active and _feff_runs.get(key) is run:
+            del _feff_runs[key]
+
 
 async def prepocessing(
-    absorber: str, cif_file: str
+    absorber: str, cif_file: str, on_stage=None
 ) -> list:  # only need the name, if we fix the location of the file.
     """
     Preprocessing function to clean and prepare the input text.
     """
+    on_stage = on_stage or (lambda stage: None)
     print("Preprocessing...")
     print(f"cif_file: {cif_file}")
     print(f"absorber: {absorber}")
     # absorber = get_absorber_from_cif(cif_file)
-    dat_paths = make_and_run_feff(cif_file,absorber)
-    dat_paths_str = load_paths(dat_paths)
+    on_stage("feff")
+    dat_paths = await run_feff(cif_file, absorber)
+    on_stage("path_parse")
+    dat_paths_str = await asyncio.to_thread(load_paths, dat_paths)
     # path_list=transform_paths(dat_paths_str)
     print(dat_paths_str)
 
@@ -41,11 +143,12 @@ async def create_agent(name: str, cif_file: str) -> Agent:
     # name is the chemical formula in the frontend. 
 
     paths_str = await prepocessing(name, cif_file)
+    run_key, summary = feff_summary(paths_str)
     try:
 
         agent = Agent(
             name="Assistant",
-            instructions=f"You are a helpful assistant. You will be provided with a list parameters, please fit XAFS data with name {name} using the provided parameters to FEFF paths {paths_str}",
+            instructions=f"You are a helpful assistant. You will be provided with a list parameters, please fit XAFS data with name {name} using the provided parameters to the paths of FEFF run {run_key} (pass feff_run={run_key} and path ids to fit_ffef):\n{summary}",
             tools=[fit_ffef],
         )
 
@@ -54,35 +157,43 @@ async def create_agent(name: str, cif_file: str) -> Agent:
         print(f"Error creating agent: {e}")
         raise e
 
-async def create_agent_2(material_id: str, material:str, xas_path:str) -> Agent:
+async def create_agent_2(material_id: str, material:str, xas_path:str, on_stage=None, xas_paths=None) -> Agent:
     """
     Create an agent that can perform the fitting task.
     """
     # name is the chemical formula in the frontend. 
-    paths_str = await prepocessing(material, material_id)
-
-    amp = 0.8  # initial guess for the amplitude
-    e0 = 0.0  # initial guess for the energy shift
-    alpha = 0  # initial guess for the Debye-Waller factor
-    # t = 300.0  # initial guess for the temperature (if needed)
-    # theta = 400.0  # initial guess for the Debye temperature (if needed)
-    sigma2 = 0.001  # initial guess for the mean square displacement
-    sigma2_2 = 0.001  # initial guess for the second moment
-    sigma2_4 = 0.001  # initial guess for the fourth moment
-
-    params = {
-        "amp": amp,
-        "e0": e0,
-        "alpha": alpha,
-        "sigma2": sigma2,
-        "sigma2_2": sigma2_2,
-        "sigma2_4": sigma2_4,
-    }
+    paths_str = await prepocessing(material, material_id, on_stage=on_stage)
+    return build_agent(material, paths_str, xas_path, xas_paths)
+
+
+def feff_summary(paths_str) -> tuple:
+    """
+    (run key, shell summary) of the FEFF run the paths belong to.
+    """
+    if not paths_str:
+        return None, "No FEFF paths are available."
+    run_dir = Path(next(iter(paths_str.values()))).parent
+    return run_dir.name, FeffPathIndex.load(run_dir).summary()
+
+
+def build_agent(material: str, paths_str, xas_path: str, xas_paths=None) -> Agent:
+    """
+    The fitting agent for already preprocessed FEFF paths. The prompt gets a
+    short shell table and the run key, not the path files.
+    """
+    params = dict(DEFAULT_PARAMS)
+    run_key, summary = feff_summary(paths_str)
+    xas_note = f"The XAS paths is {xas_path}."
+    if xas_paths and len(xas_paths) > 1:
+        xas_note += f" The user selected these XAS datasets to compare: {xas_paths}; fit each one with its own call when asked to compare them."
     try:
 
         agent = Agent(
             name="Assistant",
-            instructions=f"You are a helpful assistant. You should answer the user queries regarding XAS. If the user wants you to do fitting, please fit XAFS data with name {material} using the provided parameters {params} to FEFF paths {paths_str}. The XAS paths is {xas_path}.",
+            instructions=(
+                f"You are a helpful assistant. You should answer the user queries regarding XAS. If the user wants you to do fitting, please fit XAFS data with name {material} using the provided parameters {params} to the paths of FEFF run {run_key}: call fit_ffef with feff_run={run_key} and the ids of the paths to use (an empty list uses all paths below). {xas_note}\n"
+                f"FEFF shells:\n{summary}"
+            ),
             tools=[fit_ffef],
         )
 
@@ -93,6 +204,55 @@ async def create_agent_2(material_id: str, material:str, xas_path:str) -> Agent:
         print(f"Error creating agent: {e}")
         raise e
 
+
+def _paths_exist(paths_str) -> bool:
+    # a FEFF run dir that was removed or replaced invalidates cached paths
+    return all(os.path.exists(f) for f in paths_str.values())
+
+
+async def get_or_create_agent(
+    store,
+    material_id: str,
+    material: str,
+    xas_path: str,
+    on_stage=None,
+    xas_paths=None,
+) -> Agent:
+    """
+    The agent for this material and these spectra, reused across turns and
+    shared by every conversation with the same inputs.
+
+    ``store`` keeps two kinds of entries:
+      paths:<material_id>:<absorber>            preprocessed FEFF paths
+      agent:<material_id>:<absorber>:<xas ids>  the agent built on them
+    A conversation whose material or spectra change simply asks for another
+    key; agents no longer used are left to the store's LRU eviction. FEFF
+    runs only if the path set itself is not cached.
+    """
+    xas_ids = ",".join(xas_paths or [xas_path])
+    paths_key = f"paths:{material_id}:{material}"
+    agent_key = f"agent:{material_id}:{material}:{xas_ids}"
+
+    entry = store.get(agent_key)
+    if entry is not None and not _paths_exist(entry["paths"]):
+        store.delete(agent_key)
+        store.delete(paths_key)
+        entry = None
+    if entry is None:
+        cached_paths = store.get(paths_key)
+        if cached_paths is not None and _paths_exist(cached_paths["paths"]):
+            paths_str = cached_paths["paths"]
+        else:
+            paths_str = await prepocessing(material, material_id, on_stage=on_stage)
+            store.save(paths_key, {"paths": paths_str})
+        entry = {
+            "agent": build_agent(material, paths_str, xas_path, xas_paths),
+            "paths": paths_str,
+        }
+        store.save(agent_key, entry)
+    return entry["agent"]
+
+
 async def main():
     # name = "Ni_foil"  # user input file
     # cif_file = "physics/cif_files/Ni_foil.cif"  # user input file
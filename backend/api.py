@@ -1,5 +1,6 @@
 import logging
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Request, Response
+from fastapi.responses import JSONResponse, FileResponse
 from fastapi.middleware.cors import CORSMiddleware
 from agents import (
     Runner,
@@ -16,13 +17,17 @@ from aws import create_bucket
 from pydantic import BaseModel
 from typing import Optional, List, Dict, Any
 from uuid import uuid4
-from agent import create_agent, create_agent_2
+from agent import create_agent, create_agent_2, get_or_create_agent, run_feff
 from aws import (
     upload_file,
+    upload_file_async,
     download_file,
     delete_file,
     create_s3_client,
-    create_bucket)
+    create_bucket,
+    ensure_bucket,
+    S3_BUCKET)
+from artifacts import put_artifact_async
 from dotenv import load_dotenv
 import os
 
@@ -32,12 +37,42 @@ import os
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 from pathlib import Path
-from physics.physic_functions import _make_and_run_feff, make_and_run_feff,get_absorber_from_cif, load_paths, transform_paths,_fit_ffef
-
-from spectrum_database import get_datasets, get_data_by_id
-from material_database import search_materials,get_material_by_id
-from chemical_formula import get_chemical_formula
+from physics.physic_functions import _make_and_run_feff, make_and_run_feff,get_absorber_from_cif, load_paths, transform_paths,_fit_ffef, run_fit, DEFAULT_PARAMS
+from store import (
+    ConversationStore,
+    InMemoryConversationStore,
+    InMemoryAgentStore,
+    LRUAgentStore,
+    SQLiteConversationStore,
+    TieredConversationStore,
+)
+from jobs import create_job, get_job, finish_job, fail_job, cancel_job_record, record, StageReporter, FIT_STAGES, CHAT_STAGES, BATCH_FIT_STAGES
+from function_calling import Param, _fit_ffef_report, render_and_upload
+from physics.render import figure_file, curves_file
+from executor import (
+    run_in_pool,
+    shutdown_executor,
+    pool_status,
+    PoolBusyError,
+    JobCancelled,
+    cancel_job as cancel_pool_job,
+    current_priority,
+    current_user,
+    current_job,
+    FEFF_TIMEOUT,
+    MAX_WORKERS,
+)
+from physics.batch_fit import fit_spectrum_in_pool, sequential_fit_in_pool, spectrum_files, TABLE_COLUMNS
+
+from spectrum_database import get_datasets, get_data_by_id, xafs_catalog, title_map
+from downloads import download_manager
+from warmer import track, flush_forever, warm_forever, WARM_INTERVAL
+from disk_cache import prune_forever, register_store, PRUNE_INTERVAL as CACHE_PRUNE_INTERVAL
+from material_database import search_materials,search_materials_batch,get_material_by_id
+from chemical_formula import get_chemical_formula, absorbing_element
 import glob
+import asyncio
+import re
 
 load_dotenv()
 app = FastAPI()
@@ -66,13 +101,14 @@ app.add_middleware(
         "User-Agent",
         "Cache-Control",
         "Pragma"
-    ]
+    ],
+    expose_headers=["X-Total-Count"],
 )
 
 #============
 # AWS setup
 #============
-#create_bucket("test-dr-xas")  # Create a bucket for storing data
+# the bucket is checked once at startup, not on every upload
 
 
 
@@ -94,48 +130,110 @@ class ChatRequest(BaseModel):
     xasIDs: Optional[list[str]] = None
     files: Optional[list[FileItem]] = None
 
+class FitJobRequest(BaseModel):
+    material: str
+    xas_id: str
+    absorber: Optional[str] = None  # default: the heaviest element of material
+    params: Param = Param(**DEFAULT_PARAMS)
+    amp_ratio: Optional[float] = None
+    r_max: Optional[float] = 5.0
+    radius: float = 5.0  # FEFF cluster radius
+    # exafs, or radius-extension to reuse the potentials of an earlier radius
+    feff_profile: str = "exafs"
+
+class SequentialFitJobRequest(FitJobRequest):
+    passes: str = "forward"  # forward, backward or both
+
 
 # =========================
-# In-memory store for conversation state
+# Stores for conversation and agent state
 # =========================
 
-class ConversationStore:
-    def get(self, conversation_id: str) -> Optional[Dict[str, Any]]:
-        pass
+CONVERSATION_DB_PATH = os.getenv("XAS_CONVERSATION_DB", "conversations.sqlite3")
+MAX_HISTORY_TURNS = int(os.getenv("XAS_MAX_HISTORY_TURNS", 20))
+
+# history, selections and fit results per conversation: recent ones in
+# memory, all of them in SQLite so they survive restarts
+conversation_store = TieredConversationStore(
+    SQLiteConversationStore(CONVERSATION_DB_PATH, compress=True),
+    max_items=int(os.getenv("XAS_CONVERSATION_CACHE_SIZE", 256)),
+    ttl=float(os.getenv("XAS_CONVERSATION_CACHE_TTL", 3600)),
+)
+# conversations idle for long, or the oldest beyond the row cap, are deleted
+# with the on-disk caches (XAS_CONVERSATIONS_MAX_DAYS / _MAX_ROWS)
+register_store("conversations", conversation_store, max_rows=10000, max_days=90)
 
-    def save(self, conversation_id: str, state: Dict[str, Any]):
-        pass
+# ids this server hands out (uuid4 hex); anything else was never issued
+CONVERSATION_ID_PATTERN = re.compile(r"[0-9a-f]{32}")
 
-class InMemoryConversationStore(ConversationStore):
-    _conversations: Dict[str, Dict[str, Any]] = {}
 
-    def get(self, conversation_id: str) -> Optional[Dict[str, Any]]:
-        return self._conversations.get(conversation_id)
+def check_conversation(conversation_id: Optional[str]):
+    """
+    Reject conversation ids the server did not issue. None starts a new
+    conversation; its id is returned with the first response.
+    """
+    if conversation_id is None:
+        return
+    if (
+        not CONVERSATION_ID_PATTERN.fullmatch(conversation_id)
+        or conversation_store.get(conversation_id) is None
+    ):
+        raise HTTPException(
+            status_code=404,
+            detail="Unknown conversation; omit conversation_id to start a new one",
+        )
 
-    def save(self, conversation_id: str, state: Dict[str, Any]):
-        self._conversations[conversation_id] = state
 
-# TODO: when deploying this app in scale, switch thisto normal database 
-conversation_store = InMemoryConversationStore()
+# agents and their FEFF path sets, keyed by their inputs; LRU-bounded
+agent_store = LRUAgentStore(max_items=int(os.getenv("XAS_AGENT_CACHE_SIZE", 64)))
 
-class InMemoryAgentStore(ConversationStore):
-    _agents: Dict[str, Dict[str, Any]] = {}
+_warm_task = None
+_flush_task = None
+_prune_task = None
 
-    def get(self, agent_id: str) -> Optional[Dict[str, Any]]:
-        return self._agents.get(agent_id)
 
-    def save(self, agent_id: str, state: Dict[str, Any]):
-        self._agents[agent_id] = state
+@app.on_event("startup")
+async def startup():
+    try:
+        await asyncio.to_thread(ensure_bucket, S3_BUCKET)
+    except Exception as e:
+        # uploads retry the check; the API itself still works without S3
+        logger.warning(f"S3 bucket {S3_BUCKET} not available at startup: {e}")
+    try:
+        # so the first dataset picker request is served from the local catalog
+        await asyncio.to_thread(xafs_catalog.ensure_loaded)
+    except Exception as e:
+        logger.warning(f"XAFS catalog not available at startup: {e}")
+    global _warm_task, _flush_task, _prune_task
+    # request counts for the warmer are written from here, off the request path
+    _flush_task = asyncio.create_task(flush_forever())
+    if WARM_INTERVAL > 0:
+        # precomputes the most requested materials and datasets while idle
+        _warm_task = asyncio.create_task(warm_forever(WARM_INTERVAL))
+    if CACHE_PRUNE_INTERVAL > 0:
+        # keeps the FEFF runs, other on-disk caches and the stores within their limits
+        _prune_task = asyncio.create_task(prune_forever(CACHE_PRUNE_INTERVAL))
+
+
+@app.on_event("shutdown")
+async def shutdown():
+    if _warm_task is not None:
+        _warm_task.cancel()
+    if _prune_task is not None:
+        _prune_task.cancel()
+    if _flush_task is not None:
+        _flush_task.cancel()
+        await asyncio.gather(_flush_task, return_exceptions=True)
+    shutdown_executor()
+    download_manager.shutdown()
 
-# TODO: when deploying this app in scale, switch this to a normal database 
-agent_store = InMemoryAgentStore()
 
 @app.get("/health")
 async def health_check():
     """
     Health check endpoint to verify the service is running.
     """
-    return {"status": "ok", "message": "Service is running"}    
+    return {"status": "ok", "message": "Service is running", "pool": pool_status()}
 @app.get("/file_content")
 async def get_file_content():
     """
@@ -162,14 +260,13 @@ async def make_feff_endpoint():
     Endpoint to create a FEFF calculation.
     """
     try:
-        file_name = "Ni_foil"  
-       
-        origin = Path.cwd() / "physics/cif_files"
-        cif_file = origin / f"{file_name}.cif"
-        output_dir = Path.cwd() / "physics/FEFF_paths" / file_name
-        path=make_and_run_feff(cif_file_name="Ni_foil", absorber="Ni")
+        path = await run_feff("Ni_foil", "Ni")
 
-        return {"message": "FEFF calculation created successfully. {str(path)}" }
+        return {"message": f"FEFF calculation created successfully. {str(path)}" }
+    except PoolBusyError as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    except asyncio.TimeoutError:
+        raise HTTPException(status_code=504, detail="FEFF calculation timed out")
     except Exception as e:
         logger.error(f"Error creating FEFF calculation: {e}")
         raise HTTPException(status_code=500, detail=str(e))
@@ -180,25 +277,29 @@ async def get_feff_paths():
     Endpoint to get the FEFF paths.
     """
     try:
-        dat_paths=make_and_run_feff(cif_file_name="Ni_foil", absorber="Ni")
+        dat_paths = await run_feff("Ni_foil", "Ni")
         r_max = 5.0
         verbose = True
 
         # user feedback is needed here, what are the parameters that the user wants to set? We can provide some initial guesses
 
         amp = 0.8  # initial guess for the amplitude
-        paths=load_paths(
-        dat_paths, amp, r_max, verbose=True
-    )  # of verbose == True, prints a table with the paths
-        result= transform_paths(paths)
+        paths = await asyncio.to_thread(
+            load_paths, dat_paths, amp, r_max, verbose=True
+        )  # of verbose == True, prints a table with the paths
+        result = await asyncio.to_thread(transform_paths, paths)
         return {"message": "FEFF paths retrieved successfully", "paths": str(result)}
+    except PoolBusyError as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    except asyncio.TimeoutError:
+        raise HTTPException(status_code=504, detail="FEFF calculation timed out")
     except Exception as e:
         logger.error(f"Error getting FEFF paths: {e}")
         raise HTTPException(status_code=500, detail=str(e))
     
 
 @app.get("/fit")
-async def fit_feff():
+async def fit_feff(xas_path: str = ""):
     try:
         name = "Ni_foil"  # user input file
 
@@ -209,34 +310,23 @@ async def fit_feff():
 
         # user feedback is needed here, what are the parameters that the user wants to set? We can provide some initial guesses
 
-        amp = 0.8  # initial guess for the amplitude
-        e0 = 0.0  # initial guess for the energy shift
-        alpha = 0  # initial guess for the Debye-Waller factor
-        # t = 300.0  # initial guess for the temperature (if needed)
-        # theta = 400.0  # initial guess for the Debye temperature (if needed)
-        sigma2 = 0.001  # initial guess for the mean square displacement
-        sigma2_2 = 0.001  # initial guess for the second moment
-        sigma2_4 = 0.001  # initial guess for the fourth moment
-
-        params = {
-            "amp": amp,
-            "e0": e0,
-            "alpha": alpha,
-            "sigma2": sigma2,
-            "sigma2_2": sigma2_2,
-            "sigma2_4": sigma2_4,
-        }  # dict of parameter initial values
-
-        dat_paths = make_and_run_feff(name, absorber)
-        dat_paths_str = load_paths(
-            dat_paths, amp_ratio, r_max, verbose=True
-        )  # of verbose == True, prints a table with the paths
-        path_list = transform_paths(dat_paths_str)  # type?
-
-        result = _fit_ffef(
-        name, params, path_list
-    )   
+        params = dict(DEFAULT_PARAMS)  # dict of parameter initial values
+
+        result = await run_in_pool(
+            run_fit,
+            name,
+            absorber,
+            params,
+            xas_path,
+            amp_ratio=amp_ratio,
+            r_max=r_max,
+            timeout=FEFF_TIMEOUT,
+        )
         return {"message": "FEFF fitting completed successfully", "result": str(result)}
+    except PoolBusyError as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    except asyncio.TimeoutError:
+        raise HTTPException(status_code=504, detail="FEFF fitting timed out")
     except Exception as e:
         logger.error(f"Error fitting FEFF: {e}")
         raise HTTPException(status_code=500, detail=str(e))
@@ -246,10 +336,30 @@ async def fit_feff():
 
 
 @app.post("/chat")# need conversation ifd 
-async def chat_endpoint(req: ChatRequest):
+async def chat_endpoint(req: ChatRequest, request: Request):
         """
         Endpoint to handle chat messages.
         """
+        check_conversation(req.conversation_id)
+        # the turn's pool work shares the interactive class fairly per client
+        current_user.set(client_id(request))
+        try:
+            return await run_chat_turn(req)
+        except PoolBusyError as e:
+            raise HTTPException(status_code=503, detail=str(e))
+        except asyncio.TimeoutError:
+            raise HTTPException(status_code=504, detail="Chat request timed out")
+        except Exception as e:
+            logger.error(f"Error processing chat request: {e}")
+            raise HTTPException(status_code=500, detail=str(e)) 
+
+
+async def run_chat_turn(req: ChatRequest, on_stage=None) -> Dict[str, Any]:
+        """
+        One chat turn: material lookup, uploads, agent preprocessing and the agent run.
+        ``on_stage(stage)`` is called as each stage starts.
+        """
+        on_stage = on_stage or (lambda stage: None)
  
     # is_new = not req.conversation_id or conversation_store.get(req.conversation_id) is None
     # if is_new:
@@ -268,38 +378,18 @@ async def chat_endpoint(req: ChatRequest):
     # else:
         #todo : add conversation id to the request
 
-        #####place holder start######
-        amp = 0.8  # initial guess for the amplitude
-        e0 = 0.0  # initial guess for the energy shift
-        alpha = 0  # initial guess for the Debye-Waller factor
-        # t = 300.0  # initial guess for the temperature (if needed)
-        # theta = 400.0  # initial guess for the Debye temperature (if needed)
-        sigma2 = 0.001  # initial guess for the mean square displacement
-        sigma2_2 = 0.001  # initial guess for the second moment
-        sigma2_4 = 0.001  # initial guess for the fourth moment
-
-        params = {
-            "amp": amp,
-            "e0": e0,
-            "alpha": alpha,
-            "sigma2": sigma2,
-            "sigma2_2": sigma2_2,
-            "sigma2_4": sigma2_4,
-        }
-        content = f""" 
-        params: {params}"""
-        #####place holer end######
 
 
-        try:
-            # print(req)
+        # print(req)
 
 
-            conversation_id = req.conversation_id if req.conversation_id is not None else uuid4().hex
-            message = req.message
-            materials = req.materials
-            xasIDs = req.xasIDs
-            files = req.files
+        check_conversation(req.conversation_id)
+        # history is only ever loaded for ids this server issued
+        conversation_id = req.conversation_id if req.conversation_id is not None else uuid4().hex
+        message = req.message
+        materials = req.materials
+        xasIDs = req.xasIDs
+        files = req.files
 
         #     # Create a new runner instance
         #     req.message = req.message.strip()
@@ -312,97 +402,429 @@ async def chat_endpoint(req: ChatRequest):
            # if materials is provided, it is now a string
            # (no need to index as a list)
 
-            # name="team"
-            # cif_file = "physics/cif_files/" + name + ".cif"  #
+        # name="team"
+        # cif_file = "physics/cif_files/" + name + ".cif"  #
           #  agent = await create_agent(name, cif_file)
-            print("Line 320")
-
-
-            material = materials[0] if materials else ''
-            if material:
-                material_path = search_materials(material)
-            else:
-                material_path = ''
-
-          #  xas_path = get_data_by_id(id)[0] if get_data_by_id(id) else ""
-            xas_path=xasIDs[0] if xasIDs else ''
-            print()
-            print("Line 323")
-            print(material_path)
-            print("Line 323")
-            print(material)
-            print("Line 324")
-            print(xas_path)
-            print("Line 324")
-            # return "this a a test result"
-
-            if material_path != '':
-                # Construct the full path to the material CIF file
-                material_cif_dir = Path.cwd() /"material_cif"
-                material_path_str = str(material_cif_dir / f"{material_path}.cif")
-                print(material_path_str)
-
-                # Upload the CIF file to S3 (result not used)
-                upload_file(
-                    material_path_str,
-                    "test-dr-xas",
-                    f'{material_path}_{conversation_id}.cif'
+        print("Line 320")
+
+
+        on_stage("structure_lookup")
+        material = materials[0] if materials else ''
+        if material:
+            # one lookup for all selected materials; the first one is used
+            material_ids = await asyncio.to_thread(search_materials_batch, materials)
+            # counted for the cache warmer once resolved, for /chat and /jobs/chat alike
+            track("material", *(m for m in materials if material_ids[m]))
+            material_path = material_ids[material] or ''
+            if material_path:
+                # writes material_cif/<id>.cif unless it is already there
+                await asyncio.to_thread(get_material_by_id, material_path)
+        else:
+            material_path = ''
+
+        # all selected datasets download concurrently; the first one is fitted
+        xas_files = await download_manager.fetch_all(xasIDs or [])
+        track("dataset", *(i for i, f in xas_files.items() if f))
+        xas_path=xasIDs[0] if xasIDs else ''
+        print()
+        print("Line 323")
+        print(material_path)
+        print("Line 323")
+        print(material)
+        print("Line 324")
+        print(xas_path)
+        print("Line 324")
+        # return "this a a test result"
+
+        on_stage("upload")
+        material_key = ''
+        if material_path != '':
+            # Construct the full path to the material CIF file
+            material_cif_dir = Path.cwd() /"material_cif"
+            material_path_str = str(material_cif_dir / f"{material_path}.cif")
+            print(material_path_str)
+
+            # Stored once per distinct CIF; the conversation name maps to it
+            material_key = await put_artifact_async(
+                material_path_str, f'{material_path}_{conversation_id}.cif'
+            )
+        xas_keys = []
+        for xas_id, xas_txt_files in xas_files.items():
+            # Find the first TXT file of each dataset
+            xas_txt_files = sorted(xas_txt_files or [])
+            xas_file_str = xas_txt_files[0] if xas_txt_files else ""
+            print(xas_file_str)
+            # Use only the last part of the file name (without extension) as the S3 object name
+            if xas_file_str:
+                base_name = Path(xas_file_str).name  # e.g. Ni-K_NiMoO4_Si111_10ms_131127.txt
+                base_name_no_ext = Path(base_name).stem  # e.g. Ni-K_NiMoO4_Si111_10ms_131127
+                xas_keys.append(
+                    await put_artifact_async(xas_file_str, f'{base_name_no_ext}_{conversation_id}')
                 )
-            base_name_no_ext = ''
-            if  xas_path != '':
-                xas_dir = Path.cwd() / "online_xas_data"
-                # Find the first TXT file in the xas_path directory
-                xas_txt_files = glob.glob(str(xas_dir / f"{xas_path}" / "*.txt"))
-                xas_file_str = xas_txt_files[0] if xas_txt_files else ""
-                print('line357')
-                print(xas_file_str)
-                # Use only the last part of the file name (without extension) as the S3 object name
-                if xas_file_str:
-                    base_name = Path(xas_file_str).name  # e.g. Ni-K_NiMoO4_Si111_10ms_131127.txt
-                    base_name_no_ext = Path(base_name).stem  # e.g. Ni-K_NiMoO4_Si111_10ms_131127
-                    upload_file(xas_file_str, "test-dr-xas", base_name_no_ext)
-            
+        xas_key = xas_keys[0] if xas_keys else ''
         
-            # use aws to upload the cif & xas file to the s3, and give the link to the agent
-            # then the agent can download the file from the s3
+        
+        # use aws to upload the cif & xas file to the s3, and give the link to the agent
+        # then the agent can download the file from the s3
 
 
-            agent = await create_agent_2(material_path, material=material, xas_path=xas_path)
+        agent = await get_or_create_agent(
+            agent_store,
+            material_path,
+            material=material,
+            xas_path=xas_path,
+            on_stage=on_stage,
+            xas_paths=[i for i, f in xas_files.items() if f],
+        )
 
         # # #    # agent_id store for reuse?
         # # # also give the figs : xas & cif & fittingfig
 
     
 
-            result = await Runner.run(agent, message)
+        on_stage("fit")
+        state = conversation_store.get(conversation_id) or {"messages": [], "fits": []}
+        result = await Runner.run(
+            agent, state["messages"] + [{"role": "user", "content": message}]
+        )
          #   print(result.final_output)
-            return {
-                "message":result.final_output,#"this is a test",# 
-                "material_url": f'{material_path}_{conversation_id}.cif',
-                "xas_url": f'{base_name_no_ext}',
-                "fitting_result_url": f'viz/{xas_path}.jpg'
-            }
+        response = {
+            "conversation_id": conversation_id,
+            "message":result.final_output,#"this is a test",# 
+            "material_url": material_key,
+            "xas_url": xas_key,
+            "xas_urls": xas_keys,
+            "fitting_result_url": f'viz/{xas_path}.jpg',
+            "figure_url": f'/viz/{xas_path}' if xas_path else '',
+        }
+        fits = [
+            item.output.model_dump()
+            for item in result.new_items
+            if isinstance(getattr(item, "output", None), BaseModel)
+        ]
+        conversation_store.save(
+            conversation_id,
+            {
+                "messages": trim_history(result.to_input_list(), MAX_HISTORY_TURNS),
+                "materials": materials or [],
+                "material_id": material_path,
+                "xas_ids": xasIDs or [],
+                "fits": (state["fits"] + fits)[-MAX_HISTORY_TURNS:],
+                "last_response": response,
+            },
+        )
+        return response
+
+
+def trim_history(items: List[Dict[str, Any]], max_turns: int) -> List[Dict[str, Any]]:
+    """
+    The last ``max_turns`` turns of an input list. Cuts only at user messages,
+    so a tool call is never kept without its output.
+    """
+    starts = [i for i, item in enumerate(items) if item.get("role") == "user"]
+    if len(starts) <= max_turns:
+        return items
+    return items[starts[-max_turns]:]
+
+
+#============
+# Jobs: submit, poll status, fetch result
+#============
+
+def client_id(request: Request) -> str:
+    """
+    Who a request counts as for fair sharing of the pool: the client address
+    as the server sees it (behind a proxy, run uvicorn with --proxy-headers
+    and --forwarded-allow-ips). Never a name taken from the request body.
+    """
+    return request.client.host if request.client else "unknown"
+
+
+_running_jobs = {}
 
+
+def _start_job(job_id: str, pipeline, priority: str = "interactive", user: Optional[str] = None):
+    """
+    Run ``pipeline`` (a coroutine) in the background and record its outcome.
+    Its pool work runs at ``priority`` and counts towards ``user``'s share.
+    """
+    async def run():
+        current_priority.set(priority)
+        current_user.set(user)
+        current_job.set(job_id)
+        try:
+            result = await pipeline
+        except (asyncio.CancelledError, JobCancelled):
+            await record(cancel_job_record, job_id)
         except Exception as e:
-            logger.error(f"Error processing chat request: {e}")
-            raise HTTPException(status_code=500, detail=str(e)) 
+            logger.error(f"Job {job_id} failed: {e}")
+            await record(fail_job, job_id, str(e) or type(e).__name__)
+        else:
+            await record(finish_job, job_id, result)
+
+    task = asyncio.create_task(run())
+    # keep a reference, the event loop only holds weak ones
+    _running_jobs[job_id] = task
+    task.add_done_callback(lambda t: _running_jobs.pop(job_id, None))
+
+
+def _job_links(job_id: str) -> Dict[str, str]:
+    return {
+        "job_id": job_id,
+        "status_url": f"/jobs/{job_id}",
+        "result_url": f"/jobs/{job_id}/result",
+    }
+
+
+async def _prepare_fit_paths(req: FitJobRequest, on_stage):
+    """
+    Structure lookup → FEFF → path parsing; returns (material_id, {pathN: file}).
+    """
+    if req.feff_profile not in ("exafs", "radius-extension"):
+        raise ValueError(f"Fits need FEFF paths; profile {req.feff_profile} computes none")
+    absorber = absorbing_element(req.material, req.absorber)
+    on_stage("structure_lookup")
+    material_id = await asyncio.to_thread(search_materials, req.material)
+    if material_id is None:
+        raise ValueError(f"No material found for {req.material}")
+    # writes material_cif/<material_id>.cif for FEFF
+    await asyncio.to_thread(get_material_by_id, material_id)
+
+    on_stage("feff")
+    dat_paths = await run_feff(
+        material_id, absorber, radius=req.radius, profile=req.feff_profile
+    )
+
+    on_stage("path_parse")
+    dat_paths_str = await asyncio.to_thread(
+        load_paths, dat_paths, req.amp_ratio, req.r_max
+    )
+    return material_id, dat_paths_str
+
+
+async def run_fit_pipeline(req: FitJobRequest, on_stage) -> Dict[str, Any]:
+    """
+    Structure lookup → FEFF → path parsing → fit → render → upload.
+    """
+    material_id, dat_paths_str = await _prepare_fit_paths(req, on_stage)
+
+    # the workers report the fit, render and upload stages themselves
+    report = await run_in_pool(
+        _fit_ffef_report,
+        material_id,
+        req.params.model_dump(),
+        list(dat_paths_str.items()),
+        req.xas_id,
+        on_stage=on_stage,
+    )
+    await run_in_pool(render_and_upload, req.xas_id, on_stage=on_stage)
+    return {
+        "material_id": material_id,
+        "report": report.model_dump(),
+        "fitting_result_url": f"viz/{req.xas_id}.jpg",
+        "figure_url": report.figure_url,
+    }
+
+
+async def run_batch_fit_pipeline(req: FitJobRequest, on_stage) -> Dict[str, Any]:
+    """
+    Fit every spectrum of the dataset ``req.xas_id`` against one FEFF path set,
+    one pool job per spectrum. Returns the table of fitted parameters.
+    """
+    material_id, dat_paths_str = await _prepare_fit_paths(req, on_stage)
+
+    on_stage("fit")
+    files = await asyncio.to_thread(spectrum_files, req.xas_id)
+    params = req.params.model_dump()
+    path_items = tuple(dat_paths_str.items())
+    # never queue more than the pool runs at once, the rest waits here;
+    # a busy pool (other jobs) or a timed-out fit costs one spectrum, not the job
+    slots = asyncio.Semaphore(MAX_WORKERS)
+
+    async def fit_one(filename):
+        async with slots:
+            return await fit_spectrum_in_pool(filename, params, path_items)
+
+    rows = await asyncio.gather(*(fit_one(f) for f in files))
+    return {
+        "material_id": material_id,
+        "columns": TABLE_COLUMNS,
+        "rows": [[row[col] for col in TABLE_COLUMNS] for row in rows],
+    }
+
+
+async def run_sequential_fit_pipeline(req: SequentialFitJobRequest, on_stage) -> Dict[str, Any]:
+    """
+    Like run_batch_fit_pipeline, but fits the series in order, one pool
+    call per spectrum, seeding each fit with the previous converged parameters.
+    """
+    material_id, dat_paths_str = await _prepare_fit_paths(req, on_stage)
+
+    on_stage("fit")
+    rows = await sequential_fit_in_pool(
+        req.xas_id,
+        req.params.model_dump(),
+        tuple(dat_paths_str.items()),
+        passes=req.passes,
+    )
+    return {
+        "material_id": material_id,
+        "columns": TABLE_COLUMNS,
+        "rows": [[row[col] for col in TABLE_COLUMNS] for row in rows],
+    }
+
+
+@app.post("/jobs/fit", status_code=202)
+async def submit_fit_job(req: FitJobRequest, request: Request):
+    """
+    Submit a FEFF + fit pipeline; poll /jobs/{job_id} for progress.
+    """
+    job_id = await asyncio.to_thread(create_job, "fit", FIT_STAGES)
+    on_stage = StageReporter(job_id)
+    _start_job(job_id, run_fit_pipeline(req, on_stage), "interactive", client_id(request))
+    return _job_links(job_id)
+
+
+@app.post("/jobs/batch_fit", status_code=202)
+async def submit_batch_fit_job(req: FitJobRequest, request: Request):
+    """
+    Fit all spectra of a dataset against one FEFF path set; poll /jobs/{job_id}.
+    """
+    job_id = await asyncio.to_thread(create_job, "batch_fit", BATCH_FIT_STAGES)
+    on_stage = StageReporter(job_id)
+    _start_job(job_id, run_batch_fit_pipeline(req, on_stage), "batch", client_id(request))
+    return _job_links(job_id)
+
+
+@app.post("/jobs/sequential_fit", status_code=202)
+async def submit_sequential_fit_job(req: SequentialFitJobRequest, request: Request):
+    """
+    Warm-started fit of a time-resolved series, spectrum by spectrum in file
+    order; poll /jobs/{job_id}.
+    """
+    job_id = await asyncio.to_thread(create_job, "sequential_fit", BATCH_FIT_STAGES)
+    on_stage = StageReporter(job_id)
+    _start_job(job_id, run_sequential_fit_pipeline(req, on_stage), "batch", client_id(request))
+    return _job_links(job_id)
+
+
+@app.post("/jobs/chat", status_code=202)
+async def submit_chat_job(req: ChatRequest, request: Request):
+    """
+    Submit a chat turn as a job; poll /jobs/{job_id} for progress.
+    """
+    check_conversation(req.conversation_id)
+    job_id = await asyncio.to_thread(create_job, "chat", CHAT_STAGES)
+    on_stage = StageReporter(job_id)
+    _start_job(job_id, run_chat_turn(req, on_stage=on_stage), "interactive", client_id(request))
+    return _job_links(job_id)
+
+
+@app.get("/jobs/{job_id}")
+def job_status_endpoint(job_id: str):
+    """
+    Status of a job: current stage, completed stages and progress.
+    """
+    job = get_job(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    job.pop("result", None)
+    return job
+
+
+@app.post("/jobs/{job_id}/cancel")
+def cancel_job_endpoint(job_id: str):
+    """
+    Cancel a queued or running job; a running FEFF calculation is killed.
+    """
+    job = get_job(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    if job["status"] in ("done", "failed", "cancelled"):
+        return {"job_id": job_id, "status": job["status"]}
+    pool = cancel_pool_job(job_id)
+    task = _running_jobs.get(job_id)
+    if task is not None:
+        task.cancel()
+    cancel_job_record(job_id)
+    return {"job_id": job_id, "status": "cancelled", **pool}
+
+
+@app.get("/jobs/{job_id}/result")
+def job_result_endpoint(job_id: str):
+    """
+    Result of a finished job; 202 while it is still running.
+    """
+    job = get_job(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    if job["status"] == "failed":
+        raise HTTPException(status_code=500, detail=job["error"])
+    if job["status"] == "cancelled":
+        raise HTTPException(status_code=409, detail="Job was cancelled")
+    if job["status"] != "done":
+        return JSONResponse(
+            status_code=202,
+            content={"status": job["status"], "stage": job["stage"], "progress": job["progress"]},
+        )
+    return job["result"]
+
+
+@app.get("/viz/{name}")
+def fit_figure_endpoint(name: str):
+    """
+    Figure of the latest fit of ``name``; 202 while it is still being rendered.
+    """
+    figure = figure_file(name)
+    if figure.is_file():
+        return FileResponse(figure, media_type="image/jpeg")
+    if curves_file(name).is_file():
+        return JSONResponse(status_code=202, content={"status": "rendering"})
+    raise HTTPException(status_code=404, detail="No fit figure for this spectrum")
 
 
 @app.get("/xafs_database")# 
-def xafs_database_endpoint():
+def xafs_database_endpoint(
+    response: Response,
+    q: Optional[str] = None,
+    element: Optional[str] = None,
+    offset: int = 0,
+    limit: Optional[int] = None,
+):
     """
     Endpoint to handle XAFS database requests.
+    Served from the local catalog; filter by title words (``q``) or specimen
+    ``element`` and page with ``offset``/``limit``. The number of matches is
+    in the X-Total-Count header.
     """
+    total, entries = xafs_catalog.query(q=q, element=element, offset=offset, limit=limit)
+    response.headers["X-Total-Count"] = str(total)
+    return title_map(entries)
+
+class PrefetchRequest(BaseModel):
+    ids: List[str]
+
+
+@app.post("/xafs/prefetch")
+def xafs_prefetch_endpoint(req: PrefetchRequest):
+    """
+    Start downloading the selected datasets in the background; returns at once.
+    """
+    return {"queued": download_manager.prefetch(req.ids)}
 
-    return get_datasets()
 
 @app.get("/xafs/{id}")
-def xafs_item_endpoint(id: str):
+async def xafs_item_endpoint(id: str):
     """
     Endpoint to handle XAFS item requests.
+    Shares the download with a prefetch or chat turn already fetching ``id``.
     """
-    file_paths = get_data_by_id(id)
+    try:
+        file_paths = await download_manager.fetch(id)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     if file_paths:
+        track("dataset", id)
         return file_paths
     else:
         raise HTTPException(status_code=404, detail="Item not found")
@@ -422,6 +844,7 @@ def search_material_database(chemsys: str):
     material_id=search_materials(chemsys)
     if material_id is None:
         raise HTTPException(status_code=404, detail="No material found")
+    track("material", chemsys)
     result=get_material_by_id(material_id)
     if result is None:
         raise HTTPException(status_code=404, detail="No CIF related to the material id found")
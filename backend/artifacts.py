@@ -0,0 +1,135 @@
+"""
+Content-addressed artifacts on S3.
+
+Files are stored under a key derived from their sha256
+(artifacts/<aa>/<sha256><suffix>), so the same CIF or spectrum uploaded for
+many conversations is one object, uploaded once. Conversation-scoped names
+such as "<material>_<conversation>.cif" are kept as a name -> key mapping.
+
+An upload is skipped when the object already exists with the same hash: the
+sha256 recorded in its metadata or, for objects uploaded before this module,
+an ETag equal to the file's md5.
+"""
+
+import asyncio
+import hashlib
+import os
+import threading
+import time
+from pathlib import Path
+from typing import Optional, Dict, Any
+
+from botocore.exceptions import ClientError
+
+from aws import get_s3_client, upload_file, S3_BUCKET
+from store import SQLiteConversationStore
+
+ARTIFACT_PREFIX = "artifacts"
+ARTIFACT_DB_PATH = os.getenv("XAS_ARTIFACT_DB", "artifacts.sqlite3")
+
+# (bucket, key, sha256) already known to be on S3 in this process
+_present = set()
+_present_lock = threading.Lock()
+_name_store = None
+
+
+def file_digests(file_name):
+    """
+    (sha256, md5) hex digests of a file, read once.
+    """
+    sha256, md5 = hashlib.sha256(), hashlib.md5()
+    with open(file_name, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            sha256.update(chunk)
+            md5.update(chunk)
+    return sha256.hexdigest(), md5.hexdigest()
+
+
+def artifact_key(sha256: str, suffix: str = "") -> str:
+    return f"{ARTIFACT_PREFIX}/{sha256[:2]}/{sha256}{suffix}"
+
+
+def get_name_store() -> SQLiteConversationStore:
+    global _name_store
+    if _name_store is None:
+        _name_store = SQLiteConversationStore(ARTIFACT_DB_PATH, table="artifact_names")
+    return _name_store
+
+
+def _has_object(bucket, key, sha256, md5) -> bool:
+    """
+    True if ``key`` exists in ``bucket`` with the content hashed as given.
+    """
+    with _present_lock:
+        if (bucket, key, sha256) in _present:
+            return True
+    try:
+        head = get_s3_client().head_object(Bucket=bucket, Key=key)
+    except ClientError as e:
+        # a missing bucket too: the upload creates it (see aws.ensure_bucket)
+        if e.response["Error"]["Code"] in ("404", "NoSuchKey", "NotFound", "NoSuchBucket"):
+            return False
+        raise
+    stored = head.get("Metadata", {}).get("sha256")
+    etag = head.get("ETag", "").strip('"')
+    # multipart ETags ("<hash>-<parts>") are not an md5 of the content
+    same = stored == sha256 if stored else etag == md5
+    if same:
+        with _present_lock:
+            _present.add((bucket, key, sha256))
+    return same
+
+
+def _upload(file_name, bucket, key, sha256) -> bool:
+    uploaded = upload_file(
+        str(file_name), bucket, key, extra_args={"Metadata": {"sha256": sha256}}
+    )
+    if uploaded:
+        with _present_lock:
+            _present.add((bucket, key, sha256))
+    return uploaded
+
+
+def put_artifact(file_name, name: Optional[str] = None, bucket: str = S3_BUCKET) -> str:
+    """
+    Store ``file_name`` under its content-hash key, uploading only if that
+    object is not there yet, and map ``name`` to it. Returns the key.
+    """
+    sha256, md5 = file_digests(file_name)
+    key = artifact_key(sha256, Path(file_name).suffix)
+    if not _has_object(bucket, key, sha256, md5):
+        print(f"Uploading artifact {key}")
+        if not _upload(file_name, bucket, key, sha256):
+            raise RuntimeError(f"Upload of {file_name} to {bucket}/{key} failed")
+    if name:
+        get_name_store().save(
+            name,
+            {"key": key, "bucket": bucket, "sha256": sha256, "updated_at": time.time()},
+        )
+    return key
+
+
+def publish_file(file_name, object_name: str, bucket: str = S3_BUCKET) -> bool:
+    """
+    Upload ``file_name`` to a fixed key (e.g. viz/<xas>.jpg) unless the object
+    there already has the same content. Returns True if it uploaded.
+    """
+    sha256, md5 = file_digests(file_name)
+    if _has_object(bucket, object_name, sha256, md5):
+        return False
+    with _present_lock:
+        # the content under this key changes; forget its old hash
+        for entry in [e for e in _present if e[:2] == (bucket, object_name)]:
+            _present.discard(entry)
+    return _upload(file_name, bucket, object_name, sha256)
+
+
+def resolve_artifact(name: str) -> Optional[Dict[str, Any]]:
+    """
+    { key, bucket, sha256, updated_at } recorded for a conversation-scoped name.
+    """
+    return get_name_store().get(name)
+
+
+async def put_artifact_async(file_name, name: Optional[str] = None, bucket: str = S3_BUCKET) -> str:
+    return await asyncio.to_thread(put_artifact, file_name, name, bucket)
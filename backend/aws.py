@@ -1,9 +1,12 @@
+import asyncio
 import io
 import os
+import threading
 import uuid
 
 import boto3
 from boto3.s3.transfer import S3UploadFailedError
+from botocore.config import Config
 from botocore.exceptions import ClientError
 
 from dotenv import load_dotenv
@@ -21,6 +24,17 @@ load_dotenv()
 #TODO 
 # add cif_files. FEFF_path . viz to the bucket
 
+S3_REGION = os.getenv("AWS_REGION", "eu-north-1")
+S3_BUCKET = os.getenv("S3_BUCKET", "test-dr-xas")
+# point at a local S3 stand-in (moto server, minio) for tests and development
+S3_ENDPOINT_URL = os.getenv("S3_ENDPOINT_URL") or None
+S3_MAX_POOL_CONNECTIONS = int(os.getenv("S3_MAX_POOL_CONNECTIONS", 32))
+
+_s3_client = None
+_s3_client_lock = threading.Lock()
+_known_buckets = set()
+
+
 def create_s3_client():
     """
     Create an S3 client using boto3.
@@ -28,19 +42,49 @@ def create_s3_client():
 
     print("Creating S3 client...")
     try:
-        s3_client = boto3.client('s3',region_name='eu-north-1')
+        s3_client = boto3.session.Session().client(
+            "s3",
+            region_name=S3_REGION,
+            endpoint_url=S3_ENDPOINT_URL,
+            config=Config(
+                max_pool_connections=S3_MAX_POOL_CONNECTIONS,
+                retries={"max_attempts": 5, "mode": "adaptive"},
+                tcp_keepalive=True,
+            ),
+        )
         print("S3 client created successfully.")
         return s3_client
     except Exception as e:
         print(f"Error creating S3 client: {e}")
         return None 
-  
 
 
+def get_s3_client():
+    """
+    The process-wide S3 client. boto3 clients are thread-safe, so every
+    upload, download and delete shares this one and its connection pool.
+    """
+    global _s3_client
+    if _s3_client is None:
+        with _s3_client_lock:
+            if _s3_client is None:
+                _s3_client = create_s3_client()
+    return _s3_client
+
+
+def set_s3_client(s3_client):
+    """
+    Replace the shared client, e.g. with one created under moto's mock_aws.
+    """
+    global _s3_client
+    with _s3_client_lock:
+        _s3_client = s3_client
+        _known_buckets.clear()
+
 
 def create_bucket( bucket_name, keep_bucket=True):
 
-    s3_client=create_s3_client()
+    s3_client=get_s3_client()
 
     try:
         bucket=s3_client.head_bucket(Bucket=bucket_name)
@@ -51,7 +95,7 @@ def create_bucket( bucket_name, keep_bucket=True):
                 bucket = s3_client.create_bucket(
                     Bucket=bucket_name,
                     CreateBucketConfiguration={
-                        "LocationConstraint": 'eu-north-1'},
+                        "LocationConstraint": S3_REGION},
                 )
                 print(f"Bucket {bucket_name} created successfully.")
 
@@ -63,16 +107,27 @@ def create_bucket( bucket_name, keep_bucket=True):
                 raise
 
 
-def upload_file(file_name, bucket, object_name=None):
+def ensure_bucket(bucket_name=S3_BUCKET):
+    """
+    Check (or create) the bucket once per process; later calls are free.
+    """
+    if bucket_name in _known_buckets:
+        return
+    create_bucket(bucket_name)
+    _known_buckets.add(bucket_name)
+
+
+def upload_file(file_name, bucket, object_name=None, extra_args=None):
     """Upload a file to an S3 bucket
 
     :param file_name: File to upload
     :param bucket: Bucket to upload to
     :param object_name: S3 object name. If not specified then file_name is used
+    :param extra_args: ExtraArgs for upload_fileobj, e.g. {"Metadata": {...}}
     :return: True if file was uploaded, else False
     """
-    s3_client=create_s3_client()
-    create_bucket(bucket_name='test-dr-xas')
+    s3_client=get_s3_client()
+    ensure_bucket(bucket)
 
 
     # If S3 object_name was not specified, use file_name
@@ -81,10 +136,7 @@ def upload_file(file_name, bucket, object_name=None):
     try:
     # Upload the file
         with open(file_name, "rb") as f:
-         response = s3_client.upload_fileobj(f,bucket, object_name)
-
-        print(response)
-        print('linr 87')
+         s3_client.upload_fileobj(f,bucket, object_name, ExtraArgs=extra_args)
     except ClientError as e:
         logging.error(e)
         return False
@@ -98,7 +150,7 @@ def download_file(bucket, object_name, file_name=None):
     :param file_name: File to download to. If not specified then object_name is used
     :return: True if file was downloaded, else False
     """
-    s3_client=create_s3_client()
+    s3_client=get_s3_client()
 
     if file_name is None:
         file_name = object_name
@@ -118,7 +170,7 @@ def delete_file(bucket, object_name):
     :param object_name: S3 object name
     :return: True if file was deleted, else False
     """
-    s3_client=create_s3_client()
+    s3_client=get_s3_client()
 
     try:
         s3_client.delete_object(Bucket=bucket, Key=object_name)
@@ -129,6 +181,17 @@ def delete_file(bucket, object_name):
     return True
 
 
+
+async def upload_file_async(file_name, bucket, object_name=None, extra_args=None):
+    """
+    upload_file in a worker thread, for callers on the event loop.
+    """
+    return await asyncio.to_thread(upload_file, file_name, bucket, object_name, extra_args)
+
+
+async def download_file_async(bucket, object_name, file_name=None):
+    return await asyncio.to_thread(download_file, bucket, object_name, file_name)
+
     
 if __name__ == "__main__":
 
@@ -1,25 +1,133 @@
 import json
+import os
+import re
+import threading
+import time
 from dotenv import load_dotenv
 
 from openai import OpenAI
+from pymatgen.core import Composition, Element
+
+from store import LRUCache, SQLiteConversationStore
 
 load_dotenv()
-client = OpenAI()
 
+FORMULA_DB_PATH = os.getenv("XAS_FORMULA_DB", "formulas.sqlite3")
+FORMULA_TTL = int(os.getenv("XAS_FORMULA_TTL", 30 * 24 * 3600))  # seconds
+
+FORMULA_PATTERN = re.compile(r"(?:[A-Z][a-z]?\d*(?:\.\d+)?|\(|\)\d*)+")
+
+_client = None
+_client_lock = threading.Lock()
+_formula_store = None
+# name -> (formula, resolved_at) of recent names, in front of the store
+_resolved = LRUCache(int(os.getenv("XAS_FORMULA_CACHE_SIZE", 1024)))
+
+
+def get_openai_client():
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = OpenAI()
+    return _client
 
-def get_chemical_formula(compound_name):
-    formula = ""
-    response = client.responses.create(
+
+def ask_model(compound_name):
+    """
+    The remote fallback: ask gpt-4o for the formula of ``compound_name``.
+    """
+    response = get_openai_client().responses.create(
         model="gpt-4o",
         input=f"""What is the chemical formula of {compound_name}? just give me the formula name, no explanation.
         e.g. H2O, CO2, C6H12O6""",
     )
-    formula = response.output_text
+    return response.output_text
+
+
+def get_formula_store() -> SQLiteConversationStore:
+    global _formula_store
+    if _formula_store is None:
+        _formula_store = SQLiteConversationStore(FORMULA_DB_PATH, table="chemical_formula")
+    return _formula_store
+
+
+def as_formula(text):
+    """
+    ``text`` itself if it already is a chemical formula (NiMoO4, Co, Fe2(SO4)3),
+    the symbol if it is an element name (Nickel -> Ni), else None.
+    """
+    text = text.strip()
+    if FORMULA_PATTERN.fullmatch(text):
+        try:
+            Composition(text)
+            return text
+        except Exception:
+            pass
+    try:
+        return Element.from_name(text.lower()).symbol
+    except (ValueError, KeyError):
+        return None
+
+
+def absorbing_element(formula, absorber=None):
+    """
+    The FEFF absorber for ``formula``: ``absorber`` if given, checked to be
+    one of its elements, else its heaviest element (Ni in NiO, Fe in FeSO4).
+    """
+    formula = as_formula(formula) or formula
+    try:
+        elements = Composition(formula).elements
+    except Exception:
+        raise ValueError(f"{formula!r} is not a chemical formula; give the absorber explicitly")
+    if absorber is None:
+        return max(elements, key=lambda el: el.Z).symbol
+    symbol = absorber.strip()[:1].upper() + absorber.strip()[1:]
+    if symbol not in {el.symbol for el in elements}:
+        raise ValueError(f"Absorber {absorber!r} is not an element of {formula}")
+    return symbol
+
+
+def _cached(key):
+    entry = _resolved.get(key)
+    if entry is None:
+        saved = get_formula_store().get(key)
+        if saved is None:
+            return None
+        entry = (saved["formula"], saved["resolved_at"])
+        _resolved.put(key, entry)
+    formula, resolved_at = entry
+    if time.time() - resolved_at > FORMULA_TTL:
+        return None
+    return formula
+
+
+def _remember(key, formula):
+    now = time.time()
+    _resolved.put(key, (formula, now))
+    get_formula_store().save(key, {"formula": formula, "resolved_at": now})
+
+
+def get_chemical_formula(compound_name, remote=None):
+    """
+    Formula of ``compound_name``: the name itself if it is already a formula,
+    then the name -> formula cache, and only then the model (``remote``,
+    default ask_model).
+    """
+    formula = as_formula(compound_name)
+    if formula is not None:
+        return formula
 
-    print(formula)
+    key = " ".join(compound_name.lower().split())
+    formula = _cached(key)
+    if formula is not None:
+        return formula
 
+    formula = (remote or ask_model)(compound_name).strip()
     if len(formula) > 20:
         return ""
+    if formula:
+        _remember(key, formula)
     return formula
 
 
@@ -0,0 +1,241 @@
+"""
+Size and age limits for the on-disk caches.
+
+Each cache directory is registered with a size limit (MB) and an age limit
+(days), both overridable from the environment as XAS_<NAME>_CACHE_MB and
+XAS_<NAME>_CACHE_DAYS (0 disables a limit). prune_all deletes the entries
+unused for longer than the age limit, then the least recently used ones
+until each cache fits its size limit. An entry's mtime is its last use:
+writers create it, readers that reuse it call touch. Entries used within
+the last IN_USE_GRACE seconds are kept whatever the limits, so a FEFF run
+a fit is reading is not removed under it.
+
+Names starting with "." are locks and scratch space. Lock files are left
+alone; scratch left behind by a killed process is removed after a day.
+
+SQLite stores (conversations, job records) are pruned along with the caches:
+register_store bounds one by row age and row count, overridable as
+XAS_<NAME>_MAX_DAYS and XAS_<NAME>_MAX_ROWS.
+"""
+
+import asyncio
+import os
+import shutil
+import tempfile
+import time
+from pathlib import Path
+from typing import Callable, Dict, List, Optional
+
+IN_USE_GRACE = float(os.getenv("XAS_CACHE_IN_USE_GRACE", 3600))  # seconds
+SCRATCH_MAX_AGE = 24 * 3600  # seconds
+PRUNE_INTERVAL = float(os.getenv("XAS_CACHE_PRUNE_INTERVAL", 3600))  # seconds, 0 disables
+
+
+def _env_limit(name: str, default: float) -> Optional[float]:
+    value = float(os.getenv(name, default))
+    return value if value > 0 else None
+
+
+def top_level_entries(root: Path) -> List[List[Path]]:
+    """
+    Each file or directory directly under ``root`` is one entry.
+    """
+    return [[path] for path in root.iterdir() if not path.name.startswith(".")]
+
+
+def touch(path):
+    """
+    Mark a cache entry as just used.
+    """
+    try:
+        os.utime(path)
+    except OSError:
+        pass
+
+
+def _size(path: Path) -> int:
+    if path.is_dir():
+        total = 0
+        for dirpath, _, filenames in os.walk(path):
+            for name in filenames:
+                try:
+                    total += os.path.getsize(os.path.join(dirpath, name))
+                except OSError:
+                    pass
+        return total
+    try:
+        return path.stat().st_size
+    except OSError:
+        return 0
+
+
+def _last_used(paths: List[Path]) -> float:
+    times = []
+    for path in paths:
+        try:
+            times.append(path.stat().st_mtime)
+        except OSError:
+            pass
+    return max(times, default=0.0)
+
+
+def _remove(path: Path):
+    if not path.exists():
+        return
+    if path.is_dir():
+        # renamed away first, so a reader sees the whole entry or none of it
+        try:
+            trash = tempfile.mkdtemp(prefix=f".{path.name}-evicted-", dir=path.parent)
+            os.rename(path, os.path.join(trash, path.name))
+        except OSError:
+            return
+        shutil.rmtree(trash, ignore_errors=True)
+    else:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+class DiskCache:
+    def __init__(
+        self,
+        name: str,
+        root,
+        max_mb: Optional[float],
+        max_days: Optional[float],
+        entries: Callable[[Path], List[List[Path]]] = top_level_entries,
+    ):
+        self.name = name
+        self.root = Path(root)
+        self.max_bytes = max_mb * 1024 * 1024 if max_mb else None
+        self.max_age = max_days * 24 * 3600 if max_days else None
+        self.entries = entries
+
+    def _remove_stale_scratch(self, now):
+        for path in self.root.iterdir():
+            if path.name.startswith(".") and not path.name.endswith(".lock"):
+                if now - _last_used([path]) > SCRATCH_MAX_AGE:
+                    _remove(path)
+
+    def prune(self, now: Optional[float] = None) -> Dict[str, int]:
+        """
+        Apply the limits; returns how many entries and bytes were removed.
+        """
+        removed = {"entries": 0, "bytes": 0}
+        if not self.root.is_dir():
+            return removed
+        now = now or time.time()
+        self._remove_stale_scratch(now)
+        entries = sorted(
+            ((_last_used(paths), sum(_size(p) for p in paths), paths) for paths in self.entries(self.root)),
+            key=lambda entry: entry[0],
+        )
+        total = sum(size for _, size, _ in entries)
+        for last_used, size, paths in entries:
+            if now - last_used < IN_USE_GRACE:
+                break
+            too_old = self.max_age is not None and now - last_used > self.max_age
+            too_big = self.max_bytes is not None and total > self.max_bytes
+            if not (too_old or too_big):
+                continue
+            for path in paths:
+                _remove(path)
+            total -= size
+            removed["entries"] += 1
+            removed["bytes"] += size
+        return removed
+
+
+class StoreLimit:
+    """
+    Age and row limits of a store with a ``prune(max_age, max_rows, condition)``
+    method, such as SQLiteConversationStore; only rows matching the SQL
+    ``condition`` are removed.
+    """
+
+    def __init__(self, name, store, max_rows, max_days, condition=None):
+        self.name = name
+        self.store = store
+        self.max_rows = int(max_rows) if max_rows else None
+        self.max_age = max_days * 24 * 3600 if max_days else None
+        self.condition = condition
+
+    def prune(self) -> Dict[str, int]:
+        store = self.store() if callable(self.store) else self.store
+        removed = store.prune(self.max_age, self.max_rows, self.condition)
+        return {"entries": removed, "bytes": 0}
+
+
+_caches: Dict[str, object] = {}
+
+
+def register(
+    name: str,
+    root,
+    max_mb: float,
+    max_days: float,
+    entries: Callable[[Path], List[List[Path]]] = top_level_entries,
+) -> DiskCache:
+    """
+    Put ``root`` under limits; ``max_mb`` and ``max_days`` are the defaults
+    for XAS_<NAME>_CACHE_MB and XAS_<NAME>_CACHE_DAYS.
+    """
+    env = f"XAS_{name.upper()}_CACHE"
+    cache = DiskCache(
+        name,
+        root,
+        _env_limit(f"{env}_MB", max_mb),
+        _env_limit(f"{env}_DAYS", max_days),
+        entries,
+    )
+    _caches[name] = cache
+    return cache
+
+
+def register_store(name: str, store, max_rows: int, max_days: float, condition: Optional[str] = None):
+    """
+    Prune ``store`` (or the store ``store()`` returns) with the caches;
+    ``max_rows`` and ``max_days`` are the defaults for XAS_<NAME>_MAX_ROWS
+    and XAS_<NAME>_MAX_DAYS.
+    """
+    env = f"XAS_{name.upper()}"
+    limit = StoreLimit(
+        name,
+        store,
+        _env_limit(f"{env}_MAX_ROWS", max_rows),
+        _env_limit(f"{env}_MAX_DAYS", max_days),
+        condition,
+    )
+    _caches[name] = limit
+    return limit
+
+
+def prune_all() -> Dict[str, Dict[str, int]]:
+    """
+    Prune every registered cache. Blocking; run it in a thread.
+    """
+    report = {}
+    for name, cache in list(_caches.items()):
+        try:
+            report[name] = cache.prune()
+        except Exception as e:
+            print(f"Could not prune the {name} cache: {e}")
+            continue
+        if report[name]["bytes"]:
+            print(
+                f"Pruned {report[name]['entries']} entries "
+                f"({report[name]['bytes'] / 1024 / 1024:.1f} MB) from the {name} cache"
+            )
+        elif report[name]["entries"]:
+            print(f"Pruned {report[name]['entries']} rows from the {name} store")
+    return report
+
+
+async def prune_forever(interval: float = PRUNE_INTERVAL):
+    """
+    prune_all now and then every ``interval`` seconds.
+    """
+    while True:
+        await asyncio.to_thread(prune_all)
+        await asyncio.sleep(interval)
@@ -0,0 +1,158 @@
+"""
+Concurrent downloads of MDR datasets.
+
+Every dataset download goes through one DownloadManager: a bounded thread
+pool sharing one pooled requests.Session, with at most ``per_host``
+downloads running against the same host. Downloads beyond that wait in a
+queue per host without holding a thread, so a slow host cannot starve the
+others. A dataset already being fetched is not fetched twice; callers share
+its future.
+"""
+
+import asyncio
+import logging
+import os
+import threading
+from collections import defaultdict, deque
+from concurrent.futures import ThreadPoolExecutor, Future
+from typing import Dict, Iterable, List, Optional
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from spectrum_database import get_data_by_id, MDR_ZIP_URL
+
+logger = logging.getLogger(__name__)
+
+DOWNLOAD_WORKERS = int(os.getenv("XAS_DOWNLOAD_WORKERS", 8))
+DOWNLOAD_PER_HOST = int(os.getenv("XAS_DOWNLOAD_PER_HOST", 4))
+
+
+def create_session(pool_size: int) -> requests.Session:
+    session = requests.Session()
+    adapter = HTTPAdapter(
+        pool_connections=pool_size,
+        pool_maxsize=pool_size,
+        max_retries=Retry(total=3, backoff_factor=0.5, status_forcelist=(502, 503, 504)),
+    )
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+class DownloadManager:
+    def __init__(
+        self,
+        max_workers: int = DOWNLOAD_WORKERS,
+        per_host: int = DOWNLOAD_PER_HOST,
+        session: Optional[requests.Session] = None,
+        url_template: str = MDR_ZIP_URL,
+    ):
+        self.url_template = url_template
+        self.session = session or create_session(max_workers)
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="xas-download")
+        self.per_host = per_host
+        self._host_active = defaultdict(int)
+        self._host_queue = defaultdict(deque)  # host -> (dataset id, future) waiting
+        self._inflight: Dict[str, Future] = {}
+        # reentrant: failing a future under the lock runs _done, which takes it too
+        self._lock = threading.RLock()
+
+    def _host(self, dataset_id: str) -> str:
+        return urlsplit(self.url_template.format(dataset_id=dataset_id)).netloc
+
+    def _download(self, dataset_id: str, future: Future):
+        if not future.set_running_or_notify_cancel():
+            return self._release(dataset_id)
+        try:
+            result = get_data_by_id(dataset_id, session=self.session, url_template=self.url_template)
+        except BaseException as e:
+            future.set_exception(e)
+        else:
+            future.set_result(result)
+        finally:
+            self._release(dataset_id)
+
+    def _start(self, dataset_id: str, future: Future):
+        # called with the lock held
+        self._host_active[self._host(dataset_id)] += 1
+        try:
+            self._executor.submit(self._download, dataset_id, future)
+        except RuntimeError as e:  # shut down
+            self._host_active[self._host(dataset_id)] -= 1
+            future.set_exception(e)
+
+    def _release(self, dataset_id: str):
+        """
+        A download for this host finished: start the next one queued for it.
+        """
+        host = self._host(dataset_id)
+        with self._lock:
+            self._host_active[host] -= 1
+            queue = self._host_queue[host]
+            while queue and self._host_active[host] < self.per_host:
+                self._start(*queue.popleft())
+            if not queue:
+                del self._host_queue[host]
+
+    def _done(self, dataset_id: str, future: Future):
+        with self._lock:
+            if self._inflight.get(dataset_id) is future:
+                del self._inflight[dataset_id]
+
+    def submit(self, dataset_id: str) -> Future:
+        """
+        Future of get_data_by_id(dataset_id); joins a download already running.
+        """
+        with self._lock:
+            future = self._inflight.get(dataset_id)
+            if future is None:
+                future = Future()
+                self._inflight[dataset_id] = future
+                future.add_done_callback(lambda f: self._done(dataset_id, f))
+                if self._host_active[self._host(dataset_id)] < self.per_host:
+                    self._start(dataset_id, future)
+                else:
+                    self._host_queue[self._host(dataset_id)].append((dataset_id, future))
+        return future
+
+    def prefetch(self, dataset_ids: Iterable[str]) -> List[str]:
+        """
+        Start downloading ``dataset_ids`` without waiting; returns the ids.
+        """
+        ids = list(dict.fromkeys(i for i in dataset_ids if i))
+        for dataset_id in ids:
+            self.submit(dataset_id)
+        return ids
+
+    async def fetch(self, dataset_id: str):
+        return await asyncio.wrap_future(self.submit(dataset_id))
+
+    async def fetch_all(self, dataset_ids: Iterable[str]) -> Dict[str, Optional[List[str]]]:
+        """
+        { dataset id: its .txt files } for all ids, downloaded concurrently.
+        A failed download maps to None rather than failing the others.
+        """
+        ids = list(dict.fromkeys(i for i in dataset_ids if i))
+        results = await asyncio.gather(*(self.fetch(i) for i in ids), return_exceptions=True)
+        files = {}
+        for dataset_id, result in zip(ids, results):
+            if isinstance(result, Exception):
+                logger.warning(f"Download of dataset {dataset_id} failed: {result}")
+                result = None
+            files[dataset_id] = result
+        return files
+
+    def shutdown(self):
+        with self._lock:
+            self._host_queue.clear()
+            pending = list(self._inflight.values())
+        # not started yet, queued or in the executor: nobody is left to run them
+        for future in pending:
+            future.cancel()
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+download_manager = DownloadManager()
@@ -0,0 +1,428 @@
+"""
+Bounded process pool for the CPU-heavy work behind the API: FEFF runs, fits
+and figure rendering. Keeps the uvicorn event loop free while jobs run.
+
+Jobs are scheduled by priority class before they reach the pool:
+
+  interactive  chat turns and single fits a user is waiting for
+  batch        batch and sequential fits of whole datasets
+  warm         background cache warming
+
+Each class has its own limit on running jobs, and batch and warm jobs
+together leave INTERACTIVE_RESERVED workers free for interactive ones. A
+free worker always goes to the highest class with work waiting, and within
+a class users take turns.
+Every job gets a wall-time and a CPU-time limit and can be cancelled; a
+running feff8l is killed with its whole process group.
+"""
+
+import asyncio
+import contextvars
+import logging
+import multiprocessing
+import os
+import signal
+import subprocess
+import tempfile
+import time
+from collections import Counter, OrderedDict, deque
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from uuid import uuid4
+
+logger = logging.getLogger(__name__)
+
+MAX_WORKERS = int(os.getenv("XAS_POOL_WORKERS", os.cpu_count() or 1))
+MAX_QUEUED = int(os.getenv("XAS_POOL_MAX_QUEUED", 4 * MAX_WORKERS))
+JOB_TIMEOUT = float(os.getenv("XAS_JOB_TIMEOUT", 600))
+JOB_CPU_LIMIT = float(os.getenv("XAS_JOB_CPU_LIMIT", JOB_TIMEOUT))
+FEFF_TIMEOUT = float(os.getenv("XAS_FEFF_TIMEOUT", 300))
+
+PRIORITIES = ("interactive", "batch", "warm")  # highest first
+CLASS_LIMITS = {
+    "interactive": int(os.getenv("XAS_INTERACTIVE_SLOTS", MAX_WORKERS)),
+    "batch": int(os.getenv("XAS_BATCH_SLOTS", MAX_WORKERS)),
+    "warm": int(os.getenv("XAS_WARM_SLOTS", max(1, MAX_WORKERS // 4))),
+}
+# workers batch and warm jobs together leave free for interactive ones;
+# a single worker cannot be reserved without starving everything else
+INTERACTIVE_RESERVED = int(os.getenv("XAS_INTERACTIVE_RESERVED", 1))
+
+CANCEL_DIR = Path(tempfile.gettempdir()) / "xas-cancel"
+POLL_INTERVAL = 0.5  # seconds between checks on a running subprocess
+
+# defaults for run_in_pool, set by whoever starts a chat turn or a job
+current_priority = contextvars.ContextVar("current_priority", default="interactive")
+current_user = contextvars.ContextVar("current_user", default=None)
+current_job = contextvars.ContextVar("current_job", default=None)
+
+
+class PoolBusyError(RuntimeError):
+    """
+    Raised when the pool already holds its maximum number of queued jobs.
+    """
+
+
+class JobCancelled(RuntimeError):
+    """
+    Raised for a job cancelled while queued or running.
+    """
+
+
+class CpuLimitExceeded(RuntimeError):
+    """
+    Raised in a worker when a job uses up its CPU-time limit.
+    """
+
+
+class Scheduler:
+    """
+    Hands out pool slots by priority class, with a per-class limit and
+    round-robin between users inside a class. Runs on the event loop.
+    """
+
+    def __init__(self, workers=MAX_WORKERS, limits=CLASS_LIMITS, reserved=INTERACTIVE_RESERVED):
+        self.workers = workers
+        self.limits = dict(limits)
+        self.reserved = max(0, min(reserved, workers - 1))
+        self.running = Counter()
+        # class -> user -> waiting (future, job) pairs; users rotate
+        self.waiting = {cls: OrderedDict() for cls in PRIORITIES}
+
+    def _can_run(self, cls):
+        if sum(self.running.values()) >= self.workers or self.running[cls] >= self.limits[cls]:
+            return False
+        if cls == "interactive":
+            return True
+        background = sum(self.running[c] for c in PRIORITIES if c != "interactive")
+        return background < self.workers - self.reserved
+
+    def queued(self, cls=None):
+        classes = [cls] if cls else PRIORITIES
+        return sum(len(q) for c in classes for q in self.waiting[c].values())
+
+    async def acquire(self, cls, user=None, job=None):
+        if cls not in self.waiting:
+            raise ValueError(f"Unknown priority {cls!r}; use one of {PRIORITIES}")
+        higher = PRIORITIES[: PRIORITIES.index(cls) + 1]
+        if self._can_run(cls) and not any(self.queued(c) for c in higher):
+            self.running[cls] += 1
+            return
+        future = asyncio.get_running_loop().create_future()
+        self.waiting[cls].setdefault(user, deque()).append((future, job))
+        self._dispatch()
+        try:
+            await future
+        except BaseException:
+            if future.done() and not future.cancelled() and future.exception() is None:
+                # the slot was granted just as we were cancelled: pass it on
+                self.release(cls)
+            else:
+                self._forget(cls, user, future)
+            raise
+
+    def _forget(self, cls, user, future):
+        queue = self.waiting[cls].get(user)
+        if queue is None:
+            return
+        for entry in list(queue):
+            if entry[0] is future:
+                queue.remove(entry)
+        if not queue:
+            del self.waiting[cls][user]
+
+    def release(self, cls):
+        self.running[cls] -= 1
+        self._dispatch()
+
+    def _dispatch(self):
+        for cls in PRIORITIES:
+            users = self.waiting[cls]
+            while users and self._can_run(cls):
+                user, queue = next(iter(users.items()))
+                future, _ = queue.popleft()
+                # this user goes to the back of the line
+                del users[user]
+                if queue:
+                    users[user] = queue
+                if not future.done():
+                    self.running[cls] += 1
+                    future.set_result(None)
+
+    def cancel_job(self, job):
+        """
+        Fail the queued calls of ``job``; returns how many there were.
+        """
+        count = 0
+        for cls in PRIORITIES:
+            for user, queue in list(self.waiting[cls].items()):
+                for future, entry_job in list(queue):
+                    if entry_job == job and not future.done():
+                        future.set_exception(JobCancelled(f"Job {job} cancelled"))
+                        queue.remove((future, entry_job))
+                        count += 1
+                if not queue:
+                    del self.waiting[cls][user]
+        return count
+
+    def status(self):
+        return {
+            cls: {
+                "running": self.running[cls],
+                "queued": self.queued(cls),
+                "limit": self.limits[cls],
+            }
+            for cls in PRIORITIES
+        }
+
+
+_executor = None
+_scheduler = None
+_pending = 0
+_job_calls = {}  # job id -> cancel tokens of its calls in the pool
+
+
+def get_executor() -> ProcessPoolExecutor:
+    """
+    Create the shared process pool on first use.
+    """
+    global _executor
+    if _executor is None:
+        # spawn: forking a process that runs uvicorn's thread pool is not safe
+        _executor = ProcessPoolExecutor(
+            max_workers=MAX_WORKERS,
+            mp_context=multiprocessing.get_context("spawn"),
+        )
+        logger.info(f"Started process pool with {MAX_WORKERS} workers")
+    return _executor
+
+
+def get_scheduler() -> Scheduler:
+    global _scheduler
+    if _scheduler is None:
+        _scheduler = Scheduler()
+    return _scheduler
+
+
+def shutdown_executor():
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=False, cancel_futures=True)
+        _executor = None
+
+
+# ---- worker side ----
+
+_current_token = None
+
+
+def _cancel_file(token) -> Path:
+    return CANCEL_DIR / token
+
+
+def cancel_requested() -> bool:
+    """
+    True if the job running in this worker has been cancelled or timed out.
+    """
+    return _current_token is not None and _cancel_file(_current_token).exists()
+
+
+def _on_sigxcpu(signum, frame):
+    raise CpuLimitExceeded("Job exceeded its CPU time limit")
+
+
+def _limit_cpu(cpu_limit):
+    """
+    Let this worker use ``cpu_limit`` more CPU seconds; returns the old limits.
+    """
+    try:
+        import resource
+    except ImportError:  # not on POSIX
+        return None
+    old = resource.getrlimit(resource.RLIMIT_CPU)
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    soft = int(usage.ru_utime + usage.ru_stime + cpu_limit) + 1
+    if old[1] != resource.RLIM_INFINITY:
+        soft = min(soft, old[1])
+    signal.signal(signal.SIGXCPU, _on_sigxcpu)
+    resource.setrlimit(resource.RLIMIT_CPU, (soft, old[1]))
+    return old
+
+
+def _run_job(token, cpu_limit, fn, args, kwargs):
+    """
+    Worker entry point: run ``fn`` under the job's cancel token and CPU limit.
+    """
+    global _current_token
+    _current_token = token
+    old = _limit_cpu(cpu_limit) if cpu_limit else None
+    try:
+        if cancel_requested():
+            raise JobCancelled("Job cancelled before it started")
+        return fn(*args, **kwargs)
+    finally:
+        if old is not None:
+            import resource
+
+            resource.setrlimit(resource.RLIMIT_CPU, old)
+        _current_token = None
+
+
+def _kill_group(proc):
+    try:
+        os.killpg(proc.pid, signal.SIGKILL)
+    except ProcessLookupError:
+        pass
+    proc.wait()
+
+
+def run_process(cmd, cwd=None, timeout=None):
+    """
+    Run ``cmd`` in its own process group, like subprocess.run(check=True).
+    On timeout, cancellation or any error in the caller the whole group is
+    killed, so no orphaned feff8l keeps a CPU busy.
+    """
+    proc = subprocess.Popen(cmd, cwd=cwd, start_new_session=True)
+    deadline = time.monotonic() + timeout if timeout else None
+    try:
+        while True:
+            try:
+                returncode = proc.wait(timeout=POLL_INTERVAL)
+                break
+            except subprocess.TimeoutExpired:
+                if cancel_requested():
+                    raise JobCancelled(f"{cmd[0]} cancelled")
+                if deadline is not None and time.monotonic() > deadline:
+                    raise subprocess.TimeoutExpired(cmd, timeout)
+    except BaseException:
+        _kill_group(proc)
+        raise
+    if returncode:
+        raise subprocess.CalledProcessError(returncode, cmd)
+    return returncode
+
+
+# ---- event loop side ----
+
+
+def _mark_cancelled(token):
+    try:
+        os.makedirs(CANCEL_DIR, exist_ok=True)
+        _cancel_file(token).touch()
+    except OSError as e:
+        logger.warning(f"Could not mark job {token} cancelled: {e}")
+
+
+def cancel_job(job) -> dict:
+    """
+    Cancel everything ``job`` has queued or running in the pool.
+    """
+    queued = get_scheduler().cancel_job(job)
+    running = list(_job_calls.get(job, ()))
+    for token in running:
+        _mark_cancelled(token)
+    return {"queued": queued, "running": len(running)}
+
+
+async def run_in_pool(
+    fn,
+    *args,
+    job_timeout=JOB_TIMEOUT,
+    priority=None,
+    user=None,
+    cpu_limit=None,
+    on_start=None,
+    **kwargs,
+):
+    """
+    Run ``fn(*args, **kwargs)`` in the process pool and await its result.
+
+    ``fn`` must be a module-level function and its arguments and return value
+    must be picklable. ``priority`` and ``user`` default to the current chat
+    turn or job (current_priority, current_user). Raises PoolBusyError when
+    more than MAX_WORKERS + MAX_QUEUED jobs are in flight, and
+    asyncio.TimeoutError when the job does not finish within ``job_timeout``
+    seconds, or when a run_process in the worker times out; ``cpu_limit``
+    bounds its CPU seconds (default JOB_CPU_LIMIT). A call counts as in
+    flight until its worker is done, even after a timeout.
+    A timed out or cancelled call stops its worker's subprocesses.
+    ``on_start()`` is called once the call has left the scheduler queue.
+    """
+    global _pending
+    if _pending >= MAX_WORKERS + MAX_QUEUED:
+        raise PoolBusyError(f"{_pending} jobs in flight, try again later")
+
+    priority = priority or current_priority.get()
+    user = user if user is not None else current_user.get()
+    job = current_job.get()
+    token = uuid4().hex
+    scheduler = get_scheduler()
+
+    _pending += 1
+    submitted = False
+    try:
+        started = time.monotonic()
+        await asyncio.wait_for(scheduler.acquire(priority, user, job), job_timeout)
+        if job is not None:
+            _job_calls.setdefault(job, set()).add(token)
+        try:
+            if on_start is not None:
+                on_start()
+            future = get_executor().submit(
+                _run_job, token, cpu_limit or JOB_CPU_LIMIT, fn, args, kwargs
+            )
+        except BaseException:
+            _finished(priority, job, token)
+            raise
+        submitted = True
+        # the slot is held until the worker is really done, not until we
+        # stop waiting, so a timed out job still counts while it runs
+        loop = asyncio.get_running_loop()
+        future.add_done_callback(lambda f: _finish_soon(loop, priority, job, token))
+        try:
+            remaining = job_timeout - (time.monotonic() - started)
+            return await asyncio.wait_for(asyncio.wrap_future(future), remaining)
+        except subprocess.TimeoutExpired as e:
+            # feff8l ran out of time in the worker: the same as any timeout
+            raise asyncio.TimeoutError(f"{e.cmd[0]} timed out after {e.timeout:g} s") from e
+        except BaseException:
+            # timed out or cancelled: stop the worker side too
+            if not future.cancel():
+                _mark_cancelled(token)
+            raise
+    finally:
+        if not submitted:
+            _pending -= 1
+
+
+def _finished(priority, job, token, submitted=False):
+    """
+    Give back the pool slot of a call; for a submitted call, once its worker is done.
+    """
+    global _pending
+    get_scheduler().release(priority)
+    if job is not None:
+        _job_calls.get(job, set()).discard(token)
+        if not _job_calls.get(job):
+            _job_calls.pop(job, None)
+    if submitted:
+        _pending -= 1
+        _cancel_file(token).unlink(missing_ok=True)
+
+
+def _finish_soon(loop, priority, job, token):
+    # runs in the executor's thread; the bookkeeping belongs to the event loop
+    try:
+        loop.call_soon_threadsafe(_finished, priority, job, token, True)
+    except RuntimeError:  # loop closed at shutdown
+        pass
+
+
+def pool_status() -> dict:
+    return {
+        "workers": MAX_WORKERS,
+        "in_flight": _pending,
+        "max_queued": MAX_QUEUED,
+        "classes": get_scheduler().status(),
+        "reserved_for_interactive": get_scheduler().reserved,
+    }
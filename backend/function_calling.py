@@ -22,19 +22,24 @@ from larch.xafs import (
 )
 from larch.fitting import param, guess, param_group
 from larch.io import read_ascii
-from physics.physic_functions import load_prj
+from physics.physic_functions import load_prj, resolve_paths
+from physics.path_index import path_label
+from physics.render import fit_curves, save_curves, render_fit_figure
+from executor import run_in_pool
 
 from agents import function_tool
 from pydantic import BaseModel
 from typing import List
 import numpy as np
-from matplotlib import pyplot as plt
+import asyncio
 from pathlib import Path
 from aws import (
     upload_file,
     download_file,
     delete_file,
+    S3_BUCKET,
 )
+from artifacts import publish_file
 
 
 load_dotenv()
@@ -97,25 +102,86 @@ class FEFF_Path(BaseModel):
 class Report(BaseModel):
     fitted_parameter: FittedParameter | None = None
     path_parameter: List[PathParameter] | None = None
+    figure_url: str | None = None
 
 
 @function_tool
-def fit_ffef(name: str, params: Param, paths: FEFF_Path,xas_path:str) -> Report:
+async def fit_ffef(name: str, params: Param, feff_run: str, path_ids: List[int], xas_path: str) -> Report:
     """
     Fit XAFS data using the provided parameters to FEFF paths
+
+    Args:
+        name: name of the material
+        params: initial values of the fit parameters
+        feff_run: the FEFF run key given in the instructions
+        path_ids: ids of the paths to fit, from the shell summary; an empty list fits every path listed there
+        xas_path: the XAS dataset to fit
+    """
+    # path files are looked up here, so they never pass through the prompt
+    paths = await asyncio.to_thread(resolve_paths, feff_run, path_ids)
+    # the fit is CPU bound, keep it off the event loop
+    report = await run_in_pool(
+        _fit_ffef_report, name, params.model_dump(), list(paths.items()), xas_path
+    )
+    # the figure is drawn in the background; /viz/{xas_path} serves it when ready
+    start_render(xas_path)
+    return report
+
+
+_render_tasks = set()
+
+
+def start_render(xas_path: str):
+    """
+    Render and upload the figure of the latest fit of ``xas_path`` in the
+    pool without waiting for it.
+    """
+    async def render():
+        try:
+            await run_in_pool(render_and_upload, xas_path)
+        except Exception as e:
+            print(f"Rendering the fit figure of {xas_path} failed: {e}")
+
+    task = asyncio.create_task(render())
+    _render_tasks.add(task)
+    task.add_done_callback(_render_tasks.discard)
+
+
+def render_and_upload(xas_path: str, on_stage=None):
     """
+    Worker side of the render stage: draw the saved fit curves, upload the figure.
+    """
+    on_stage = on_stage or (lambda stage: None)
+    on_stage("render")
+    save_path = render_fit_figure(xas_path)
+
+    on_stage("upload")
+    # same figure as last time: nothing to upload
+    publish_file(save_path, f"viz/{xas_path}.jpg", S3_BUCKET)
+    return save_path
+
+
+def _fit_ffef_report(
+    name: str, params: dict, paths: list, xas_path: str, on_stage=None
+) -> Report:
+    """
+    Worker side of fit_ffef: runs the fit in a pool process and saves the
+    curves of every path for the figure (see render_and_upload).
+    """
+    on_stage = on_stage or (lambda stage: None)
+    on_stage("fit")
     params_group = param_group(
-        amp=param(params.amp, vary=True),
-        e0=param(params.e0, vary=True),
-        alpha=param(params.alpha, vary=True),
-        sigma2=param(params.sigma2, vary=True),
-        sigma2_2=param(params.sigma2_2, vary=True),
-        sigma2_4=param(params.sigma2_4, vary=True),
+        amp=param(params["amp"], vary=True),
+        e0=param(params["e0"], vary=True),
+        alpha=param(params["alpha"], vary=True),
+        sigma2=param(params["sigma2"], vary=True),
+        sigma2_2=param(params["sigma2_2"], vary=True),
+        sigma2_4=param(params["sigma2_4"], vary=True),
     )
 
     # --- Define the paths ---
     paths_dict = {}
-    for path_key, path_str in paths.items():
+    for path_key, path_str in paths:
         path = feffpath(
             path_str,
             degen="degen",
@@ -144,124 +210,17 @@ def fit_ffef(name: str, params: Param, paths: FEFF_Path,xas_path:str) -> Report:
 
 
 
-    viz(name,paths_dict,result,xas_path=xas_path)  # this is the function that visualizes the result
-
-    return Report(fitted_parameter=fitted_parameters, path_parameter=path_parameters)
-
-
+    # χ(k) and χ(R) per path are computed once here and cached with the fit
+    labels = {key: path_label(path_str) for key, path_str in paths}
+    save_curves(xas_path, fit_curves(result, paths_dict, labels=labels, title=name))
 
+    return Report(
+        fitted_parameter=fitted_parameters,
+        path_parameter=path_parameters,
+        figure_url=f"/viz/{xas_path}",
+    )
 
-def viz(name,path_list,result,xas_path:str  ):
-    """
-    Visualize the result
-    """
 
-    print("Visualizing the result...")
-
-    data=load_prj(xas_path=xas_path)
-
-    datalist = [name]
-
-
-    # cmap = plt.cm.nipy_spectral
-    cmap = plt.cm.magma
-    colors = [cmap(value) for value in np.linspace(0, 1, 16)]
-    usepath = 16
-
-    # step = 2.2 # Cu foil
-    kweight = 2
-    step = 1.2 * kweight / 2
-
-    kmax = 10
-
-
-
-    for i, sample in enumerate(datalist):
-        plt.figure(figsize=(10,5))
-        
-        mod = result.datasets[i].model
-        dat = result.datasets[i].data
-        data_chik  = dat.chi * dat.k**kweight
-        model_chik = mod.chi * mod.k**kweight
-
-        plt.subplot(131)
-        plt.plot(dat.k, data_chik, color='navy', label='data', alpha=0.6, lw=2)
-        plt.plot(mod.k, model_chik, color='crimson', label='fit', alpha=0.6, lw=2)
-
-        for i, path_i in enumerate(list(path_list.values())[:usepath]):
-            path_i_data = ff2chi([path_i], params=result.paramgroup)
-            path_chik  = path_i_data.chi * path_i_data.k**kweight
-            path_name = path_i.filename.split('_')[-1].split('.')[0]
-            
-            plt.plot(path_i_data.k,
-                    path_chik - step*(i+1),
-                    label=path_name, 
-                    color=colors[i], 
-                    alpha=0.6, lw=1.5, ls='-.')
-            
-        plt.xlabel("$k$ [$\\AA^{-1}$]", fontsize=12)
-        plt.ylabel("$k^2 \\chi (k)$ [$\\AA^{-2}$]", fontsize=12)
-        plt.xlim(0, 9.5)
-        # plt.ylim(-4, 1.25)
-
-        plt.subplot(132)
-        xftf(dat, kmin=3, kmax=kmax, kweight=kweight, dk=1, window='hanning', rmax_out=12)
-        xftf(mod, kmin=3, kmax=kmax, kweight=kweight, dk=1, window='hanning', rmax_out=12)
-
-        plt.plot(dat.r, dat.chir_mag, color='navy', label='data', alpha=0.6, lw=2)
-        plt.plot(mod.r, mod.chir_mag, color='crimson', label='fit', alpha=0.6, lw=2)
-
-        for i, path_i in enumerate(list(path_list.values())[:usepath]):
-            path_i_data = ff2chi([path_i], params=result.paramgroup)
-            path_chik  = path_i_data.chi * path_i_data.k**kweight
-            xftf(path_i_data, kmin=3.5, kmax=9.5, kweight=kweight, dk=1, window='hanning', rmax_out=12)
-            path_name = path_i.filename.split('_')[-1].split('.')[0]
-            
-            plt.plot(path_i_data.r,
-                    path_i_data.chir_mag - step*(i+1),
-                    label=path_name, 
-                    color=colors[i], 
-                    alpha=0.6, lw=1.5, ls='-.')
-            
-        plt.title(sample)
-        plt.xlabel("$R$ [$\\AA$]", fontsize=12)
-        plt.ylabel("$|\\chi(R)|$ [$\\AA ^{-3}$]", fontsize=12)
-        plt.xlim(0, 5)
-        # plt.ylim(-4, 1.25)
-
-        plt.subplot(133)
-        
-        plt.plot(dat.r, dat.chir_re, color='navy', label='data', alpha=0.6, lw=2)
-        plt.plot(mod.r, mod.chir_re, color='crimson', label='fit', alpha=0.6, lw=2)
-
-        for i, path_i in enumerate(list(path_list.values())[:usepath]):
-            path_i_data = ff2chi([path_i], params=result.paramgroup)
-            path_chik  = path_i_data.chi * path_i_data.k**kweight
-            xftf(path_i_data, kmin=3.5, kmax=9.5, kweight=kweight, dk=1, window='hanning', rmax_out=12)
-            path_name = path_i.filename.split('_')[-1].split('.')[0]
-            
-            plt.plot(path_i_data.r,
-                    path_i_data.chir_re - step*(i+1),
-                    label=path_name, 
-                    color=colors[i], 
-                    alpha=0.6, lw=1.5, ls='-.')
-            
-        plt.xlabel("$R$ [$\\AA$]", fontsize=12)
-        plt.ylabel("Re[$\\chi(R)$] [$\\AA ^{-3}$]", fontsize=12)
-        plt.xlim(0, 5)
-        # plt.ylim(-4, 1.25)
-        plt.legend(loc='upper right', frameon=False)
-        plt.tight_layout();
-
-        origin = Path.cwd() 
-
-        save_folder = 'physics/viz/'
-        save_path = origin / save_folder / f"{sample}_all.jpg"
-        plt.savefig(save_path, dpi = 300)
-        # save_file_aws
-
-        upload_file(save_path, "test-dr-xas", f"viz/{xas_path}.jpg")# what if file already exists?
-        print(f"Visualization saved to {save_path}")
 
 
 def extract_fitted_parameters(result) -> FittedParameter:
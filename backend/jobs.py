@@ -0,0 +1,173 @@
+"""
+Job records for the long FEFF + fit pipelines, so that clients poll for
+progress instead of holding one HTTP request open for the whole run.
+
+The helpers are module-level and open their own store lazily, so pool
+workers can report progress for the stages they run.
+"""
+
+import asyncio
+import functools
+import logging
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional, Dict, Any, List
+from uuid import uuid4
+
+from store import SQLiteConversationStore
+from disk_cache import register_store
+
+logger = logging.getLogger(__name__)
+
+JOB_DB_PATH = os.getenv("XAS_JOB_DB", "jobs.sqlite3")
+
+FIT_STAGES = ["structure_lookup", "feff", "path_parse", "fit", "render", "upload"]
+CHAT_STAGES = ["structure_lookup", "upload", "feff", "path_parse", "fit"]
+BATCH_FIT_STAGES = ["structure_lookup", "feff", "path_parse", "fit"]
+
+_job_store = None
+
+
+def get_job_store() -> SQLiteConversationStore:
+    global _job_store
+    if _job_store is None:
+        _job_store = SQLiteConversationStore(JOB_DB_PATH, table="jobs")
+    return _job_store
+
+
+def create_job(kind: str, stages: List[str]) -> str:
+    job_id = uuid4().hex
+    now = time.time()
+    get_job_store().save(
+        job_id,
+        {
+            "id": job_id,
+            "kind": kind,
+            "status": "queued",
+            "stage": None,
+            "stages": stages,
+            "completed_stages": [],
+            "progress": 0.0,
+            "error": None,
+            "result": None,
+            "created_at": now,
+            "updated_at": now,
+        },
+    )
+    return job_id
+
+
+def get_job(job_id: str) -> Optional[Dict[str, Any]]:
+    return get_job_store().get(job_id)
+
+
+FINAL_STATUSES = ("done", "failed", "cancelled")
+
+# ended jobs are kept for a while for polling clients, running ones always
+register_store(
+    "jobs", get_job_store, max_rows=10000, max_days=30,
+    condition="json_extract(state, '$.status') IN ('done', 'failed', 'cancelled')",
+)
+
+
+def _update_job(job_id: str, change):
+    """
+    Apply ``change(state)`` (returns the changes) to a job that has not
+    ended yet, as one transaction. A finished, failed or cancelled job is
+    left as it is, so a late stage report cannot bring it back to running.
+    """
+
+    def apply(state):
+        if state["status"] in FINAL_STATUSES:
+            return None
+        state.update(change(state))
+        state["updated_at"] = time.time()
+        return state
+
+    get_job_store().update(job_id, apply)
+
+
+def set_job_stage(job_id: str, stage: str):
+    """
+    Mark ``stage`` as running; every stage listed before it counts as done.
+    """
+
+    def change(state):
+        stages = state["stages"]
+        done = stages[: stages.index(stage)] if stage in stages else state["completed_stages"]
+        return dict(
+            status="running",
+            stage=stage,
+            completed_stages=done,
+            progress=len(done) / len(stages) if stages else 0.0,
+        )
+
+    _update_job(job_id, change)
+
+
+def finish_job(job_id: str, result: Any):
+    _update_job(
+        job_id,
+        lambda state: dict(
+            status="done",
+            stage=None,
+            completed_stages=state["stages"],
+            progress=1.0,
+            result=result,
+        ),
+    )
+
+
+def fail_job(job_id: str, error: str):
+    _update_job(job_id, lambda state: dict(status="failed", error=error))
+
+
+def cancel_job_record(job_id: str):
+    _update_job(job_id, lambda state: dict(status="cancelled", stage=None))
+
+
+_writer = None
+
+
+def _record_writer() -> ThreadPoolExecutor:
+    global _writer
+    if _writer is None:
+        # one thread, so the records of a job are written in the order reported
+        _writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="job-records")
+    return _writer
+
+
+def _log_failure(future):
+    if not future.cancelled() and future.exception() is not None:
+        logger.warning(f"Could not write a job record: {future.exception()}")
+
+
+async def record(fn, *args):
+    """
+    ``fn(*args)`` (one of the job record helpers) off the event loop.
+    """
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_record_writer(), functools.partial(fn, *args))
+
+
+class StageReporter:
+    """
+    ``on_stage`` callback of a job. On the event loop the write is handed to
+    the job record thread and not waited for; elsewhere (a pool worker, a
+    thread) it is written directly. Picklable, so run_in_pool can pass it on.
+    """
+
+    def __init__(self, job_id: str):
+        self.job_id = job_id
+
+    def __call__(self, stage: str):
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            set_job_stage(self.job_id, stage)
+            return
+        future = loop.run_in_executor(
+            _record_writer(), functools.partial(set_job_stage, self.job_id, stage)
+        )
+        future.add_done_callback(_log_failure)
@@ -1,54 +1,249 @@
 from mp_api.client import MPRester
 import os
+import threading
+import time
 import dotenv
 from dotenv import load_dotenv
-from pydash import random
+from pymatgen.core import Composition
 
-load_dotenv()
-
-# MATERIAL_PROJECT_API_KEY = os.getenv("MATERIAL_PROJECT_API_KEY")
-MATERIAL_PROJECT_API_KEY = "9EsNZYQ4fi0fM07c8RoyqryfhZy5yHhu"
-
-mpr = MPRester(MATERIAL_PROJECT_API_KEY)
+from singleflight import SingleFlight
+from store import SQLiteConversationStore
 
+load_dotenv()
 
-def search_materials(chemsys):
-    docs = mpr.materials.summary.search(
-        formula=chemsys,
-        fields=["material_id", "formula_pretty", "structure", "theoretical"],
+MATERIAL_PROJECT_API_KEY = os.getenv("MATERIAL_PROJECT_API_KEY")
+MATERIAL_CIF_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "material_cif")
+MATERIAL_DB_PATH = os.getenv("XAS_MATERIAL_DB", "materials.sqlite3")
+
+# all the selection needs; structures are fetched only for the chosen id
+CANDIDATE_FIELDS = ["material_id", "formula_pretty", "theoretical", "energy_above_hull"]
+
+_client = None
+_client_lock = threading.Lock()
+_candidate_store = None
+_choice_store = None
+# concurrent lookups of the same formula / downloads of the same CIF run once
+_choice_flight = SingleFlight()
+_cif_flight = SingleFlight()
+
+
+def get_client():
+    """
+    The MPRester, created on first use rather than at import.
+    """
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                if not MATERIAL_PROJECT_API_KEY:
+                    raise RuntimeError(
+                        "MATERIAL_PROJECT_API_KEY is not set; add your Materials Project "
+                        "API key to the environment or the .env file"
+                    )
+                _client = MPRester(MATERIAL_PROJECT_API_KEY)
+    return _client
+
+
+def set_client(client):
+    """
+    Use ``client`` (anything with .materials.summary.search) instead of MPRester, e.g. a stub in tests.
+    """
+    global _client
+    with _client_lock:
+        _client = client
+
+
+def get_candidate_store() -> SQLiteConversationStore:
+    global _candidate_store
+    if _candidate_store is None:
+        _candidate_store = SQLiteConversationStore(MATERIAL_DB_PATH, table="formula_candidates")
+    return _candidate_store
+
+
+def _formula_key(formula):
+    """
+    Reduced formula ("Ni2O2" -> "NiO"; "ni" -> "Ni", capitalized as chat turns
+    capitalize absorbers), or None for strings that are not a plain formula.
+    """
+    formula = formula.strip()
+    for text in (formula, formula[:1].upper() + formula[1:]):
+        try:
+            return Composition(text).reduced_formula
+        except Exception:
+            pass
+    return None
+
+
+def _lookup_key(formula):
+    # what flights and stores are keyed on; wildcards and the like stay as given
+    return _formula_key(formula) or formula.strip()
+
+
+def _candidate(doc):
+    return {
+        "material_id": str(doc.material_id),
+        "formula_pretty": doc.formula_pretty,
+        "theoretical": doc.theoretical,
+        "energy_above_hull": getattr(doc, "energy_above_hull", None),
+    }
+
+
+def _search_candidates(formula):
+    docs = get_client().materials.summary.search(formula=formula, fields=CANDIDATE_FIELDS)
+    return [_candidate(doc) for doc in docs]
+
+
+def get_candidates(formulas):
+    """
+    { formula: [candidate, ...] } for every formula; candidates are the
+    CANDIDATE_FIELDS of each matching Materials Project entry. Plain formulas
+    not cached yet are looked up together in one search call.
+    """
+    store = get_candidate_store()
+    found = {}
+    cached_formulas = set()
+    batch = {}
+    for formula in dict.fromkeys(formulas):
+        cached = store.get(_lookup_key(formula))
+        if cached is not None:
+            found[formula] = cached["candidates"]
+            cached_formulas.add(formula)
+        elif _formula_key(formula) is not None:
+            batch.setdefault(_formula_key(formula), []).append(formula)
+        else:
+            # wildcards and the like: MP has to match them itself
+            found[formula] = _search_candidates(formula)
+
+    if len(batch) == 1:
+        ((key, same),) = batch.items()
+        candidates = _search_candidates(key)
+        found.update({formula: candidates for formula in same})
+    elif batch:
+        docs = get_client().materials.summary.search(
+            formula=list(batch), fields=CANDIDATE_FIELDS
+        )
+        by_key = {key: [] for key in batch}
+        for doc in docs:
+            key = _formula_key(doc.formula_pretty)
+            if key in by_key:
+                by_key[key].append(_candidate(doc))
+        for key, candidates in by_key.items():
+            found.update({formula: candidates for formula in batch[key]})
+
+    for formula, candidates in found.items():
+        # an empty answer may be a transient failure; ask again next time
+        if candidates and formula not in cached_formulas:
+            store.save(_lookup_key(formula), {"candidates": candidates, "fetched_at": time.time()})
+    return found
+
+
+def _id_order(material_id):
+    # "mp-1234" sorts numerically, so mp-13 comes before mp-1000
+    prefix, _, number = material_id.rpartition("-")
+    return (prefix, int(number)) if number.isdigit() else (material_id, 0)
+
+
+def rank_key(candidate):
+    """
+    Experimental entries first, then lowest energy above hull, then id.
+    """
+    e_hull = candidate.get("energy_above_hull")
+    return (
+        candidate["theoretical"] is not False,
+        float("inf") if e_hull is None else e_hull,
+        _id_order(candidate["material_id"]),
     )
 
-    mpids = [doc.material_id for doc in docs]
-
-    best_match = None
-    # select the one with experimental data, if none with experimental data, return random.
-    for doc in docs:
-        if doc.theoretical == False:
-            best_match = doc.material_id
-    if best_match is None and len(mpids) > 0:
-        best_match = docs[random(0, len(mpids) - 1)].material_id
 
-    return best_match
+def select_material(candidates):
+    """
+    The best candidate by rank_key; the same candidates always give the same id.
+    """
+    if not candidates:
+        return None
+    return min(candidates, key=rank_key)["material_id"]
 
 
-def get_material_by_id(mp_id):
+def get_choice_store() -> SQLiteConversationStore:
+    global _choice_store
+    if _choice_store is None:
+        _choice_store = SQLiteConversationStore(MATERIAL_DB_PATH, table="formula_choice")
+    return _choice_store
 
-    entry = mpr.materials.summary.get_data_by_id(mp_id)
 
-    if entry is None:
-        return None
+def search_materials(chemsys):
+    return search_materials_batch([chemsys])[chemsys]
+
+
+def search_materials_batch(formulas):
+    """
+    { formula: chosen material id or None } for several formulas at once.
+    The choice is remembered per formula, so a formula keeps mapping to the
+    same structure (and its cached FEFF runs) even if MP adds entries.
+    Formulas another request is already looking up are waited for, not
+    looked up again. Formulas are compared reduced, so "NiO" and "Ni2O2"
+    share one lookup and one remembered choice.
+    """
+    keys = {formula: _lookup_key(formula) for formula in formulas}
+    chosen = _choice_flight.do_many(keys.values(), _choose_materials)
+    return {formula: chosen[keys[formula]] for formula in formulas}
+
+
+def _choose_materials(formulas):
+    store = get_choice_store()
+    chosen = {}
+    for formula in dict.fromkeys(formulas):
+        saved = store.get(formula)
+        if saved is not None:
+            chosen[formula] = saved["material_id"]
+    missing = [f for f in dict.fromkeys(formulas) if f not in chosen]
+    if missing:
+        candidates = get_candidates(missing)
+        for formula in missing:
+            chosen[formula] = select_material(candidates[formula])
+            if chosen[formula] is not None:
+                store.save(formula, {"material_id": chosen[formula], "chosen_at": time.time()})
+    return chosen
+
+
+def cif_file(mp_id):
+    return os.path.join(MATERIAL_CIF_DIR, f"{mp_id}.cif")
+
+
+def _write_cif(mp_id, structure):
+    os.makedirs(MATERIAL_CIF_DIR, exist_ok=True)
+    tmp_path = f"{cif_file(mp_id)}.{os.getpid()}.tmp"
+    with open(tmp_path, "w") as f:
+        f.write(structure.to(fmt="cif"))
+    os.replace(tmp_path, cif_file(mp_id))
+
+
+def get_materials_by_ids(mp_ids):
+    """
+    { id: "material_cif/<id>.cif" or None }; CIFs already on disk are not
+    fetched again, the others come from one search call.
+    """
+    missing = [i for i in dict.fromkeys(mp_ids) if not os.path.isfile(cif_file(i))]
+    if missing:
+        _cif_flight.do_many(missing, _fetch_cifs)
+    return {
+        i: f"material_cif/{i}.cif" if os.path.isfile(cif_file(i)) else None
+        for i in mp_ids
+    }
+
+
+def _fetch_cifs(mp_ids):
+    docs = get_client().materials.summary.search(
+        material_ids=mp_ids, fields=["material_id", "structure"]
+    )
+    for doc in docs:
         # structure is already a pymatgen object
-    cif_str = entry.structure.to(fmt="cif")
-    parent_dir = os.path.dirname(os.path.abspath(__file__))
-
-    sub_folder = os.path.join(parent_dir, "material_cif")
+        _write_cif(str(doc.material_id), doc.structure)
+    return {}
 
-    os.makedirs(sub_folder, exist_ok=True)
 
-    with open(os.path.join(sub_folder, f"{mp_id}.cif"), "w") as f:
-        f.write(cif_str)
-
-    return f"material_cif/{mp_id}.cif"
+def get_material_by_id(mp_id):
+    return get_materials_by_ids([mp_id])[mp_id]
 
 
 if __name__ == "__main__":
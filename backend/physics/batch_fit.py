@@ -0,0 +1,256 @@
+"""
+Fit every spectrum of a dataset against one FEFF path set.
+
+``fit_spectrum`` is the unit of work: a module-level function that pool
+workers run. Each worker builds the feffpath objects for a path set once and
+reuses them for every spectrum it fits. Sequential fits of a series run
+``fit_step`` per spectrum, passing the converged parameters on.
+"""
+
+import asyncio
+import csv
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+from typing import List, Dict, Any
+
+from executor import run_in_pool, PoolBusyError
+from store import LRUCache
+from physics.physic_functions import load_dat, fit_data, transform_paths
+
+FIT_PARAMS = ("amp", "e0", "alpha", "sigma2", "sigma2_2", "sigma2_4")
+TABLE_COLUMNS = (
+    ["file", "nvarys", "nfev", "chi2_reduced", "rfactor"]
+    + [col for name in FIT_PARAMS for col in (name, f"{name}_err")]
+    + ["error"]
+)
+
+# feffpath objects of the path sets most recently fitted by this process
+_path_lists = LRUCache(int(os.getenv("XAS_PATH_LIST_CACHE_SIZE", 8)))
+
+
+def spectrum_files(xas_path: str) -> List[Path]:
+    """
+    All .dat spectra of a downloaded dataset, in file name order.
+    """
+    folder = Path.cwd() / "online_xas_data" / Path(xas_path)
+    if not folder.exists():
+        raise FileNotFoundError(f"Folder {folder} does not exist.")
+    files = sorted(folder.rglob("*.dat"))
+    if not files:
+        raise FileNotFoundError(f"No .dat file found in folder {folder}.")
+    return files
+
+
+def _path_list(paths: tuple) -> dict:
+    path_list = _path_lists.get(paths)
+    if path_list is None:
+        path_list = transform_paths(dict(paths))
+        _path_lists.put(paths, path_list)
+    return path_list
+
+
+def fit_row(filename, result) -> Dict[str, Any]:
+    """
+    One table row of fitted parameters for ``filename``.
+    """
+    row = {
+        "file": os.path.basename(str(filename)),
+        "nvarys": result.nvarys,
+        # optimizer function evaluations, what a warm start saves
+        "nfev": getattr(result, "nfev", None),
+        "chi2_reduced": result.chi2_reduced,
+        "rfactor": result.rfactor,
+        "error": None,
+    }
+    for name in FIT_PARAMS:
+        p = result.params.get(name)
+        row[name] = float(p.value) if p is not None else None
+        row[f"{name}_err"] = float(p.stderr) if p is not None and p.stderr is not None else None
+    return row
+
+
+def _error_row(filename, error) -> Dict[str, Any]:
+    row = {col: None for col in TABLE_COLUMNS}
+    row.update(file=os.path.basename(str(filename)), error=str(error))
+    return row
+
+
+def fit_spectrum(filename, params: dict, paths) -> Dict[str, Any]:
+    """
+    Fit one spectrum file; ``paths`` is a sequence of ('pathN', feffNNNN.dat) pairs.
+    Errors are reported in the row instead of raised, so one bad spectrum
+    does not sink a batch.
+    """
+    try:
+        path_list = _path_list(tuple(paths))
+        result = fit_data(params, path_list, load_dat(filename))
+        return fit_row(filename, result)
+    except Exception as e:
+        print(f"fit_spectrum {filename}: {e}")
+        return _error_row(filename, e)
+
+
+async def fit_spectrum_in_pool(filename, params: dict, paths) -> Dict[str, Any]:
+    """
+    fit_spectrum as a pool call. Waits for room while the pool is busy; a
+    timed-out fit becomes an error row like any other failed spectrum.
+    """
+    while True:
+        try:
+            return await run_in_pool(fit_spectrum, str(filename), params, paths)
+        except PoolBusyError:
+            await asyncio.sleep(1)
+        except asyncio.TimeoutError as e:
+            return _error_row(filename, str(e) or "fit timed out")
+
+
+def batch_fit(xas_path: str, params: dict, paths: dict, max_workers=None) -> List[Dict[str, Any]]:
+    """
+    Fit every spectrum of ``xas_path`` in parallel worker processes.
+    Returns one row per spectrum, in file order.
+    """
+    files = spectrum_files(xas_path)
+    path_items = tuple(paths.items())
+    with ProcessPoolExecutor(max_workers=max_workers) as pool:
+        futures = {
+            pool.submit(fit_spectrum, str(f), params, path_items): i
+            for i, f in enumerate(files)
+        }
+        rows = [None] * len(files)
+        for future in as_completed(futures):
+            rows[futures[future]] = future.result()
+    return rows
+
+
+def converged_params(result, fallback: dict) -> dict:
+    """
+    Fitted values of FIT_PARAMS as a params dict, for seeding the next fit.
+    """
+    params = dict(fallback)
+    for name in FIT_PARAMS:
+        p = result.params.get(name)
+        if p is not None and p.value is not None:
+            params[name] = float(p.value)
+    return params
+
+
+def fit_step(filename, seed: dict, paths) -> tuple:
+    """
+    One warm-started fit of a series: (row, seed for the next spectrum).
+    A failed fit leaves the seed unchanged.
+    """
+    try:
+        result = fit_data(seed, _path_list(tuple(paths)), load_dat(str(filename)))
+    except Exception as e:
+        print(f"sequential_fit {filename}: {e}")
+        return _error_row(filename, e), seed
+    return fit_row(filename, result), converged_params(result, seed)
+
+
+def _fit_pass(files, order, params, paths, rows):
+    """
+    Fit ``files`` in ``order``, each fit seeded with the previous converged
+    parameters. Fills ``rows`` by position.
+    """
+    seed = dict(params)
+    for i in order:
+        rows[i], seed = fit_step(files[i], seed, paths)
+    return seed
+
+
+async def _fit_pass_in_pool(files, order, params, paths, rows):
+    """
+    _fit_pass with every spectrum its own pool call, so each fit gets the
+    full job time and CPU limit and finished fits are kept when one fails.
+    """
+    seed = dict(params)
+    for i in order:
+        while True:
+            try:
+                rows[i], seed = await run_in_pool(fit_step, str(files[i]), seed, paths)
+            except PoolBusyError:
+                # the series keeps its place; wait for room rather than give up
+                await asyncio.sleep(1)
+                continue
+            except asyncio.TimeoutError as e:
+                rows[i] = _error_row(files[i], str(e) or "fit timed out")
+            break
+    return seed
+
+
+def _chi2(row):
+    value = row.get("chi2_reduced")
+    return float("inf") if value is None else value
+
+
+def _check_passes(passes):
+    if passes not in ("forward", "backward", "both"):
+        raise ValueError(f"passes must be forward, backward or both, not {passes}")
+
+
+def _best_rows(rows, back_rows):
+    # per spectrum the fit with the lower reduced chi-square
+    return [min(f, b, key=_chi2) for f, b in zip(rows, back_rows)]
+
+
+def sequential_fit(xas_path: str, params: dict, paths, passes: str = "forward") -> List[Dict[str, Any]]:
+    """
+    Fit the spectra of a time-resolved series in order, warm-starting every fit
+    from the previous spectrum's converged parameters instead of ``params``.
+
+    passes: "forward", "backward", or "both" — a forward pass, then a
+    backward pass seeded from its last fit; per spectrum the fit with the
+    lower reduced chi-square is kept.
+    Runs serially in one process; returns one row per spectrum, in file order.
+    """
+    _check_passes(passes)
+    files = spectrum_files(xas_path)
+    path_items = tuple(paths.items()) if isinstance(paths, dict) else tuple(paths)
+    forward = list(range(len(files)))
+    rows = [None] * len(files)
+
+    if passes == "backward":
+        _fit_pass(files, forward[::-1], params, path_items, rows)
+        return rows
+
+    seed = _fit_pass(files, forward, params, path_items, rows)
+    if passes == "both":
+        back_rows = [None] * len(files)
+        _fit_pass(files, forward[::-1], seed, path_items, back_rows)
+        rows = _best_rows(rows, back_rows)
+    return rows
+
+
+async def sequential_fit_in_pool(
+    xas_path: str, params: dict, paths, passes: str = "forward"
+) -> List[Dict[str, Any]]:
+    """
+    sequential_fit for the API: one pool call per spectrum, the converged
+    parameters passed on from call to call. A long series or a "both" pass
+    is not bound by a single job timeout, and a fit that times out becomes
+    an error row instead of losing the fits before it.
+    """
+    _check_passes(passes)
+    files = await asyncio.to_thread(spectrum_files, xas_path)
+    path_items = tuple(paths.items()) if isinstance(paths, dict) else tuple(paths)
+    forward = list(range(len(files)))
+    rows = [None] * len(files)
+
+    if passes == "backward":
+        await _fit_pass_in_pool(files, forward[::-1], params, path_items, rows)
+        return rows
+
+    seed = await _fit_pass_in_pool(files, forward, params, path_items, rows)
+    if passes == "both":
+        back_rows = [None] * len(files)
+        await _fit_pass_in_pool(files, forward[::-1], seed, path_items, back_rows)
+        rows = _best_rows(rows, back_rows)
+    return rows
+
+
+def write_table(rows: List[Dict[str, Any]], csv_path):
+    with open(csv_path, "w", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=TABLE_COLUMNS)
+        writer.writeheader()
+        writer.writerows(rows)
@@ -0,0 +1,117 @@
+"""
+Caches for FEFF input preparation.
+
+Parsed structures are kept by CIF content hash, in memory and as pymatgen
+JSON on disk, so a CIF is parsed once across runs and worker processes; each
+entry also keeps the structure's canonical digest used in FEFF run keys.
+Generated feff.inp texts are kept by their input key the same way.
+"""
+
+import hashlib
+import json
+import os
+from pathlib import Path
+
+import numpy as np
+from pymatgen.core import Structure
+from pymatgen.io.cif import CifParser
+
+from disk_cache import register as register_cache, touch
+from store import LRUCache
+
+INPUT_CACHE_DIR = Path.cwd() / "physics/input_cache"
+INPUT_CACHE_SIZE = int(os.getenv("XAS_INPUT_CACHE_SIZE", 64))
+
+register_cache("structures", INPUT_CACHE_DIR / "structures", max_mb=200, max_days=90)
+register_cache("feff_inputs", INPUT_CACHE_DIR / "inputs", max_mb=200, max_days=90)
+
+# feff.inp is these blocks of FEFFDictSet.all_input(), as write_input joins them
+FEFF_INP_BLOCKS = ("HEADER", "PARAMETERS", "POTENTIALS", "ATOMS")
+
+
+_structures = LRUCache(INPUT_CACHE_SIZE)
+_inputs = LRUCache(INPUT_CACHE_SIZE)
+
+
+def file_hash(filename):
+    h = hashlib.sha256()
+    with open(filename, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
+    return h.hexdigest()[:20]
+
+
+def structure_digest(struct):
+    """
+    Hash of the canonical structure: sorted sites, lattice and fractional
+    coordinates rounded to 1e-6, so equal structures from different CIFs match.
+    """
+    struct = struct.get_sorted_structure()
+    payload = {
+        "lattice": np.round(struct.lattice.matrix, 6).tolist(),
+        "sites": [
+            [site.species_string, (np.round(site.frac_coords, 6) % 1.0).tolist()]
+            for site in struct
+        ],
+    }
+    return hashlib.sha256(json.dumps(payload, sort_keys=True).encode()).hexdigest()[:20]
+
+
+def _write_atomic(path, text):
+    try:
+        os.makedirs(path.parent, exist_ok=True)
+        tmp_path = path.with_name(f".{path.name}.{os.getpid()}")
+        with open(tmp_path, "w") as f:
+            f.write(text)
+        os.replace(tmp_path, path)
+    except OSError as e:
+        print(f"Could not write input cache {path}: {e}")
+
+
+def load_structure(cif_file):
+    """
+    (structure, digest) of the first structure in ``cif_file``. The structure
+    is a copy; callers may modify it.
+    """
+    key = file_hash(cif_file)
+    entry = _structures.get(key)
+    if entry is None:
+        path = INPUT_CACHE_DIR / "structures" / f"{key}.json"
+        if path.is_file():
+            touch(path)
+            with open(path) as f:
+                saved = json.load(f)
+            entry = (Structure.from_dict(saved["structure"]), saved["digest"])
+        else:
+            struct = CifParser(cif_file).get_structures()[0]
+            entry = (struct, structure_digest(struct))
+            _write_atomic(
+                path, json.dumps({"structure": struct.as_dict(), "digest": entry[1]})
+            )
+        _structures.put(key, entry)
+    return entry[0].copy(), entry[1]
+
+
+def feff_inp_text(feff_set):
+    """
+    feff.inp as FEFFDictSet.write_input would write it, without touching disk.
+    """
+    feff = feff_set.all_input()
+    return "\n\n".join(str(feff[k]) for k in FEFF_INP_BLOCKS if k in feff)
+
+
+def cached_input(key, build):
+    """
+    The feff.inp text for input key ``key``; ``build()`` makes it on a miss.
+    """
+    text = _inputs.get(key)
+    if text is None:
+        path = INPUT_CACHE_DIR / "inputs" / f"{key}.inp"
+        if path.is_file():
+            touch(path)
+            text = path.read_text()
+        else:
+            text = build()
+            _write_atomic(path, text)
+        _inputs.put(key, text)
+    return text
@@ -0,0 +1,366 @@
+"""
+Index of the scattering paths in a FEFF run directory.
+
+list.dat and every feffNNNN.dat are parsed once; recent results are kept in memory
+and saved next to the run as path_index.npz, so later loads skip text parsing.
+"""
+
+import os
+
+import numpy as np
+
+from store import LRUCache
+
+INDEX_FILE = "path_index.npz"
+
+PATH_DTYPE = np.dtype(
+    [
+        ("index", "i4"),
+        ("amp", "f8"),
+        ("reff", "f8"),
+        ("degen", "f8"),
+        ("nlegs", "i4"),
+        ("bond", "U16"),
+    ]
+)
+
+# columns of the feffNNNN.dat data block, in file order
+DATA_COLUMNS = (
+    "k",
+    "real_2phc",
+    "mag_feff",
+    "phase_feff",
+    "red_factor",
+    "lambda",
+    "real_p",
+)
+
+# (list.dat mtime, index) of the runs most recently loaded by this process
+_loaded = LRUCache(int(os.getenv("XAS_PATH_INDEX_CACHE_SIZE", 16)))
+
+
+def _read_list_dat(list_file):
+    """
+    Parse the path table of list.dat into (index, amp, reff, degen, nlegs) tuples.
+    """
+    lines = open(list_file).read().splitlines()
+    start = next((i + 1 for i, L in enumerate(lines) if "pathindex" in L.lower()), None)
+    if start is None:
+        start = next(
+            (i + 1 for i, L in enumerate(lines) if L.strip().startswith("-----")), None
+        )
+    if start is None:
+        raise ValueError("Couldn't find table in list.dat")
+
+    entries = []
+    for L in lines[start:]:
+        parts = L.split()
+        if not parts or not parts[0].isdigit():
+            continue
+        idx = int(parts[0])
+        amp = float(parts[2])
+        deg = float(parts[3])
+        nlegs = int(parts[4])
+        r_eff = float(parts[5])
+        entries.append((idx, amp, r_eff, deg, nlegs))
+    return entries
+
+
+def _read_feff_dat(fname):
+    """
+    Parse one feffNNNN.dat: the bond label from the first two atoms of the
+    path geometry, and the numeric data block as an (nk, 7) array.
+    """
+    bond = ""
+    with open(fname) as f:
+        datlines = f.readlines()
+
+    data_start = len(datlines)
+    for j, line in enumerate(datlines):
+        lower = line.lower()
+        if "pot at#" in lower and not bond:
+            atom_lines = [ln for ln in datlines[j + 1 : j + 4] if ln.strip()]
+            if len(atom_lines) >= 2:
+                el0 = atom_lines[0].split()[5]
+                el1 = atom_lines[1].split()[5]
+                bond = f"{el0}-{el1}"
+        if "real[2*phc]" in lower:
+            data_start = j + 1
+            break
+
+    rows = [ln.split() for ln in datlines[data_start:] if ln.strip()]
+    data = np.array(rows, dtype=float).reshape(-1, len(DATA_COLUMNS))
+    return bond, data
+
+
+def _object_array(items):
+    if isinstance(items, np.ndarray) and items.dtype == object:
+        return items
+    arr = np.empty(len(items), dtype=object)
+    for i, item in enumerate(items):
+        arr[i] = item
+    return arr
+
+
+def _matches(column, value):
+    # plain comparison for one value, np.isin only for a set of them
+    return np.isin(column, value) if np.ndim(value) else column == value
+
+
+def _order(key, field, descending=None):
+    """
+    Stable sort order of ``key``; amplitudes sort descending by default.
+    """
+    if descending is None:
+        descending = field == "amp"
+    return np.argsort(-key if descending else key, kind="stable")
+
+
+def _shell_ids(reff, tol):
+    if len(reff) == 0:
+        return np.zeros(0, dtype=int)
+    uniq, inverse = np.unique(reff, return_inverse=True)
+    shell_of_uniq = np.concatenate(([0], np.cumsum(np.diff(uniq) > tol)))
+    return shell_of_uniq[inverse]
+
+
+class FeffPathIndex:
+    """
+    The paths of one FEFF run: a structured ``table`` (index, amp, reff, degen,
+    nlegs, bond), the feffNNNN.dat file of each path and its data columns.
+    Use ``FeffPathIndex.load(feff_dir)`` rather than the constructor.
+    """
+
+    def __init__(self, feff_dir, table, filenames, data):
+        self.feff_dir = str(feff_dir)
+        self.table = table
+        # object arrays, so that queries subset them with one fancy index
+        self.filenames = _object_array(filenames)
+        self.data = _object_array(data)
+
+    @classmethod
+    def load(cls, feff_dir):
+        """
+        Index of ``feff_dir``: from memory, from path_index.npz, or parsed
+        from the text files, in that order.
+        """
+        feff_dir = str(feff_dir)
+        list_file = os.path.join(feff_dir, "list.dat")
+        if not os.path.isfile(list_file):
+            raise FileNotFoundError(f"No list.dat found in {feff_dir}")
+        mtime = os.path.getmtime(list_file)
+
+        cached = _loaded.get(feff_dir)
+        if cached is not None and cached[0] == mtime:
+            return cached[1]
+
+        index_file = os.path.join(feff_dir, INDEX_FILE)
+        if os.path.isfile(index_file) and os.path.getmtime(index_file) >= mtime:
+            index = cls._from_npz(feff_dir, index_file)
+        else:
+            index = cls._parse(feff_dir, list_file)
+            index.save()
+        _loaded.put(feff_dir, (mtime, index))
+        return index
+
+    @classmethod
+    def _parse(cls, feff_dir, list_file):
+        rows, filenames, data = [], [], []
+        for idx, amp, r_eff, deg, nlegs in _read_list_dat(list_file):
+            fname = os.path.join(feff_dir, f"feff{idx:04d}.dat")
+            if not os.path.exists(fname):
+                alt = fname.replace(".dat", ".data")
+                if os.path.exists(alt):
+                    fname = alt
+                else:
+                    continue
+            bond, columns = _read_feff_dat(fname)
+            rows.append((idx, amp, r_eff, deg, nlegs, bond))
+            filenames.append(fname)
+            data.append(columns)
+        return cls(feff_dir, np.array(rows, dtype=PATH_DTYPE), filenames, data)
+
+    @classmethod
+    def _from_npz(cls, feff_dir, index_file):
+        with np.load(index_file) as npz:
+            table = npz["table"]
+            filenames = [os.path.join(feff_dir, f) for f in npz["filenames"]]
+            data = [npz[f"data_{idx}"] for idx in table["index"]]
+        return cls(feff_dir, table, filenames, data)
+
+    def save(self):
+        """
+        Write path_index.npz next to the run; a read-only run dir is not an error.
+        """
+        arrays = {f"data_{idx}": d for idx, d in zip(self.table["index"], self.data)}
+        names = np.array([os.path.basename(f) for f in self.filenames], dtype=str)
+        tmp_file = os.path.join(self.feff_dir, f".{INDEX_FILE}.{os.getpid()}")
+        try:
+            with open(tmp_file, "wb") as f:
+                np.savez(f, table=self.table, filenames=names, **arrays)
+            os.replace(tmp_file, os.path.join(self.feff_dir, INDEX_FILE))
+        except OSError as e:
+            print(f"Could not save path index in {self.feff_dir}: {e}")
+
+    def __len__(self):
+        return len(self.table)
+
+    def row(self, idx):
+        """
+        Table row of FEFF path number ``idx``.
+        """
+        pos = np.flatnonzero(self.table["index"] == idx)
+        if len(pos) == 0:
+            raise KeyError(f"No path {idx} in {self.feff_dir}")
+        return self.table[pos[0]]
+
+    def columns(self, idx):
+        """
+        Data columns of FEFF path number ``idx`` as a dict of arrays.
+        """
+        pos = int(np.flatnonzero(self.table["index"] == idx)[0])
+        return dict(zip(DATA_COLUMNS, self.data[pos].T))
+
+    def label(self, idx):
+        row = self.row(idx)
+        return f"{row['bond']} {row['reff']:.2f}Å" if row["bond"] else f"path{idx}"
+
+    # ---- queries: each returns a new FeffPathIndex over a subset of rows ----
+
+    def subset(self, rows):
+        """
+        Index restricted to ``rows``: a boolean mask or positions into ``table``.
+        """
+        rows = np.asarray(rows)
+        pos = np.flatnonzero(rows) if rows.dtype == bool else rows.astype(int)
+        return FeffPathIndex(
+            self.feff_dir, self.table[pos], self.filenames[pos], self.data[pos]
+        )
+
+    def mask(
+        self,
+        amp_ratio=None,
+        r_max=None,
+        r_min=None,
+        nlegs=None,
+        max_nlegs=None,
+        degen=None,
+        bond=None,
+    ):
+        """
+        Boolean mask over ``table``; every given criterion must hold.
+        ``nlegs``, ``degen`` and ``bond`` accept one value or a sequence.
+        """
+        t = self.table
+        keep = np.ones(len(t), dtype=bool)
+        if amp_ratio is not None:
+            keep &= t["amp"] >= amp_ratio
+        if r_max is not None:
+            keep &= t["reff"] <= r_max
+        if r_min is not None:
+            keep &= t["reff"] >= r_min
+        if nlegs is not None:
+            keep &= _matches(t["nlegs"], nlegs)
+        if max_nlegs is not None:
+            keep &= t["nlegs"] <= max_nlegs
+        if degen is not None:
+            keep &= _matches(t["degen"], degen)
+        if bond is not None:
+            keep &= _matches(t["bond"], bond)
+        return keep
+
+    def select(self, shells=None, shell_tol=0.05, top=None, by="amp", **criteria):
+        """
+        Paths matching ``criteria`` (see ``mask``), then optionally only the
+        first ``shells`` shells among them and the ``top`` paths by ``by``.
+
+        e.g. first three shells, single scattering only:
+            index.select(nlegs=2, shells=3)
+        """
+        pos = np.flatnonzero(self.mask(**criteria))
+        if shells is not None:
+            pos = pos[_shell_ids(self.table["reff"][pos], shell_tol) < shells]
+        if top is not None:
+            pos = pos[_order(self.table[by][pos], by)[:top]]
+        return self.subset(pos)
+
+    def sort_by(self, field="amp", descending=None):
+        """
+        Rows sorted by a table field; amplitude sorts descending by default,
+        everything else ascending. The sort is stable.
+        """
+        return self.subset(_order(self.table[field], field, descending))
+
+    def top(self, n, by="amp"):
+        return self.subset(_order(self.table[by], by)[:n])
+
+    def shell_ids(self, tol=0.05):
+        """
+        Shell number (0 = nearest) of every row: distinct R_eff values closer
+        than ``tol`` Å to the previous one belong to the same shell.
+        """
+        return _shell_ids(self.table["reff"], tol)
+
+    def group_by_shell(self, tol=0.05):
+        """
+        { shell number: FeffPathIndex of the paths in that shell }
+        """
+        ids = self.shell_ids(tol)
+        return {int(shell): self.subset(ids == shell) for shell in np.unique(ids)}
+
+    def paths(self):
+        """
+        { 'path<index>': '…/feffNNNN.dat' } for every path in the index.
+        """
+        return {
+            f"path{idx}": fname for idx, fname in zip(self.table["index"], self.filenames)
+        }
+
+    def summary(self, max_shells=6, min_amp=10.0, shell_tol=0.05):
+        """
+        A compact text table for prompts: one row per shell (up to
+        ``max_shells``, nearest first) with its bond(s), mean R_eff, total
+        degeneracy, strongest amplitude and the ids of its paths with at
+        least ``min_amp`` % amplitude. Weaker paths are left out.
+        """
+        sel = self.select(amp_ratio=min_amp, shells=max_shells, shell_tol=shell_tol)
+        rows = ["shell reff bond deg amp ids"]
+        for shell, paths in sel.group_by_shell(shell_tol).items():
+            t = paths.table
+            bonds = "/".join(dict.fromkeys(b for b in t["bond"] if b)) or "?"
+            ids = ",".join(str(i) for i in t["index"])
+            rows.append(
+                f"{shell + 1} {t['reff'].mean():.2f} {bonds} {t['degen'].sum():g} "
+                f"{t['amp'].max():.0f} {ids}"
+            )
+        rows.append(f"({len(sel)} of {len(self)} paths; amp in %, reff in Å)")
+        return "\n".join(rows)
+
+    def summary_ids(self, max_shells=6, min_amp=10.0, shell_tol=0.05):
+        """
+        Ids of the paths listed by ``summary`` with the same arguments.
+        """
+        sel = self.select(amp_ratio=min_amp, shells=max_shells, shell_tol=shell_tol)
+        return [int(i) for i in sel.table["index"]]
+
+    def print_table(self):
+        header = f"{'Path':>4}  {'Bond':<7}  {'Amp (%)':>8}  {'R_eff (Å)':>9}  {'Deg':>4}  {'Nlegs':>5}"
+        print(header)
+        print("-" * len(header))
+        for row in self.table:
+            print(
+                f"{row['index']:4d}  {row['bond']:<7}  {row['amp']:8.3f}  "
+                f"{row['reff']:9.3f}  {row['degen']:4.1f}  {row['nlegs']:5d}"
+            )
+
+
+def path_label(filename):
+    """
+    Legend label (bond and R_eff) of a feffNNNN.dat file, from its run's index.
+    """
+    feff_dir, base = os.path.split(str(filename))
+    idx = int("".join(ch for ch in base.split(".")[0] if ch.isdigit()) or 0)
+    try:
+        return FeffPathIndex.load(feff_dir).label(idx)
+    except (FileNotFoundError, KeyError, ValueError):
+        return base.split(".")[0]
@@ -1,5 +1,10 @@
 from pathlib import Path
 import glob
+import hashlib
+import json
+import re
+import shutil
+import tempfile
 from pymatgen.io.cif import CifParser
 from pymatgen.io.feff.sets import FEFFDictSet
 
@@ -34,95 +39,316 @@ from larch.io import read_ascii
 
 from agents import function_tool
 from typing import List
-import matplotlib.pyplot as plt
 import numpy as np
 
+from physics.path_index import FeffPathIndex, path_label
+from executor import run_process
+from singleflight import file_lock
+from disk_cache import register as register_cache, touch, top_level_entries
+from physics.feff_inputs import load_structure, structure_digest, feff_inp_text, cached_input
+from physics.spectrum_cache import spectrum_cache, spectrum_key
+from physics.render import fit_curves, save_curves, render_fit_figure
+
 
 def get_absorber_from_cif(cif_file: str) -> str:
     absorber = "Ni"  # placeholder for the absorber element
     return absorber
 
 
-def make_and_run_feff(cif_file_name, absorber, radius=5.0, edge="K"):
+# initial guesses for the fit parameters, shared by the API, the agent and scripts
+DEFAULT_PARAMS = {
+    "amp": 0.8,  # amplitude
+    "e0": 0.0,  # energy shift
+    "alpha": 0.0,  # expansion coefficient, deltar = alpha * reff
+    "sigma2": 0.001,  # mean square displacement
+    "sigma2_2": 0.001,  # second moment
+    "sigma2_4": 0.001,  # fourth moment
+}
+
+FEFF_PATHS_DIR = Path.cwd() / "physics/FEFF_paths"
+FEFF_POTENTIALS_DIR = FEFF_PATHS_DIR / "potentials"
+
+# run directories and saved potentials, least recently used removed first
+register_cache(
+    "feff", FEFF_PATHS_DIR, max_mb=5000, max_days=90,
+    entries=lambda root: [e for e in top_level_entries(root) if e[0].name != "potentials"],
+)
+register_cache("feff_potentials", FEFF_POTENTIALS_DIR, max_mb=1000, max_days=90)
+FEFF_CONTROL_HEADER = "*         pot    xsph  fms   paths genfmt ff2chi\n"
+FEFF_PRINT = "PRINT     1      0     0     0     0      3\n"
+
+# Which FEFF modules run, per calculation profile (pot xsph fms paths genfmt ff2chi).
+#   exafs             path fitting: everything but full multiple scattering
+#   xanes             near-edge spectrum: pot, xsph, fms within the FEFF radius
+#                     and ff2x for xmu.dat; no paths
+#   radius-extension  paths and genfmt on the pot/xsph outputs of an earlier run
+#                     of the same structure, absorber and edge; when none exists
+#                     yet it runs like exafs and leaves those outputs for next time
+# "outputs" must exist after the run, or it is not cached as finished.
+FEFF_PROFILES = {
+    "exafs": {"control": (1, 1, 0, 1, 1, 1), "tags": {}, "outputs": ("list.dat",)},
+    "xanes": {"control": (1, 1, 1, 0, 0, 1), "tags": {"XANES": "4 0.05 0.1"}, "outputs": ("xmu.dat",)},
+    "radius-extension": {"control": (0, 0, 0, 1, 1, 1), "tags": {}, "outputs": ("list.dat",)},
+}
+DEFAULT_FEFF_PROFILE = "exafs"
+# what pot and xsph leave behind for the later modules
+POTENTIAL_FILES = ("pot.bin", "phase.bin", "xsect.bin")
+MANIFEST_FILE = "manifest.json"
+
+
+def feff_control(profile, reuse_potentials=False):
+    """
+    The CONTROL card of ``profile``; with ``reuse_potentials`` pot and xsph are off.
+    """
+    control = list(FEFF_PROFILES[profile]["control"])
+    if reuse_potentials:
+        control[0] = control[1] = 0
+    return FEFF_CONTROL_HEADER + "CONTROL   " + "      ".join(str(c) for c in control) + "\n"
+
+
+# the CONTROL card of the default profile
+FEFF_CONTROL = feff_control(DEFAULT_FEFF_PROFILE)
+
+
+def make_and_run_feff(
+    cif_file_name, absorber, radius=5.0, edge="K", timeout=None, profile=DEFAULT_FEFF_PROFILE
+):
     """
-    Run FEFF on a single CIF file.
+    Run FEFF on a single CIF file and return the (possibly cached) run directory.
     """
     origin = Path.cwd() / "material_cif"
     cif_file = origin / f"{cif_file_name}.cif"
-    output_dir = Path.cwd() / "physics/FEFF_paths" / cif_file_name
-    _make_and_run_feff(
-        str(cif_file), str(output_dir), absorber=absorber, radius=radius, edge=edge
+    return _make_and_run_feff(
+        str(cif_file),
+        FEFF_PATHS_DIR,
+        absorber=absorber,
+        radius=radius,
+        edge=edge,
+        timeout=timeout,
+        profile=profile,
     )
-    return Path.cwd() / "physics/FEFF_paths" / cif_file_name
+
+
+def _hash(payload):
+    blob = json.dumps(payload, sort_keys=True).encode()
+    return hashlib.sha256(blob).hexdigest()[:20]
+
+
+def feff_run_key(struct, absorber, radius=5.0, edge="K", profile=DEFAULT_FEFF_PROFILE, digest=None):
+    """
+    Content hash of a FEFF run: the canonical structure plus the FEFFDictSet
+    parameters and the profile. Equal keys produce identical feff.inp files.
+    ``digest`` is the structure_digest of ``struct``, if already known.
+    """
+    payload = dict(
+        structure=digest or structure_digest(struct),
+        absorber=str(absorber),
+        radius=float(radius),
+        edge=edge,
+        profile=profile,
+        control=FEFF_PROFILES[profile]["control"],
+    )
+    return _hash(payload)
+
+
+def feff_potential_key(struct, absorber, edge="K", digest=None):
+    """
+    Key of the pot/xsph outputs: they depend on the structure, absorber and
+    edge, not on the cluster radius used for the path search.
+    """
+    return _hash(
+        dict(structure=digest or structure_digest(struct), absorber=str(absorber), edge=edge)
+    )
+
+
+def patch_control(inp_text, control):
+    """
+    feff.inp text with our CONTROL and PRINT cards in place of the generated
+    ones, or just before POTENTIALS if there were none.
+    """
+    new_lines = []
+    saw_control = False
+    for line in inp_text.splitlines(keepends=True):
+        if line.strip().startswith("CONTROL") and not saw_control:
+            new_lines.append(control + FEFF_PRINT)
+            saw_control = True
+            # skip the original CONTROL line
+            continue
+        if not saw_control and line.strip().startswith("POTENTIALS"):
+            new_lines.append(control + FEFF_PRINT)
+            saw_control = True
+        new_lines.append(line)
+    return "".join(new_lines)
+
+
+def _save_potentials(run_dir, potentials_dir):
+    """
+    Keep the pot/xsph outputs of a finished run for later radius extensions.
+    """
+    if potentials_dir.is_dir() or not all(
+        (run_dir / name).is_file() for name in POTENTIAL_FILES[:2]
+    ):
+        return
+    scratch = Path(tempfile.mkdtemp(prefix=f".{potentials_dir.name}-", dir=potentials_dir.parent))
+    try:
+        for name in POTENTIAL_FILES:
+            if (run_dir / name).is_file():
+                shutil.copy2(run_dir / name, scratch / name)
+        os.rename(scratch, potentials_dir)
+    except OSError:
+        shutil.rmtree(scratch, ignore_errors=True)
 
 
 def _make_and_run_feff(
-    cif_file, out_dir, absorber="", radius=5.0, edge="K", feff_exe="feff8l"
+    cif_file,
+    cache_dir=None,
+    absorber="",
+    radius=5.0,
+    edge="K",
+    feff_exe="feff8l",
+    timeout=None,
+    profile=DEFAULT_FEFF_PROFILE,
 ):
-
+    """
+    Run FEFF for a CIF file, reusing a finished run with the same inputs.
+
+    Runs are stored under ``cache_dir/<feff_run_key>``. A fresh run is written
+    to a scratch directory next to it and renamed into place only once FEFF
+    has finished, so a run directory is never seen half-written.
+    ``timeout`` (seconds) bounds the feff8l run. ``profile`` picks the FEFF
+    modules to run (see FEFF_PROFILES); manifest.json in the run directory
+    records it. Concurrent calls with the same inputs run FEFF once; the
+    others wait on a lock file and reuse its run. Returns the run directory.
+    """
+    if profile not in FEFF_PROFILES:
+        raise ValueError(f"Unknown FEFF profile {profile!r}; use one of {sorted(FEFF_PROFILES)}")
+    cache_dir = Path(cache_dir) if cache_dir is not None else FEFF_PATHS_DIR
+    potentials_root = cache_dir / "potentials"
+    scratch_dir = None
     try:
-        os.makedirs(out_dir, exist_ok=True)
+        os.makedirs(potentials_root, exist_ok=True)
 
-        # 1) Parse CIF → structure
-        struct = CifParser(cif_file).get_structures()[0]
+        # 1) Parse CIF → structure (cached by CIF content hash)
+        struct, digest = load_structure(cif_file)
         print(f"Read structure with {len(struct)} atoms from {cif_file}")
 
-        # 2) Generate basic feff.inp with ff2chi=1
-        feff_set = FEFFDictSet(
-            absorbing_atom=absorber,
-            structure=struct,
-            radius=radius,
-            edge=edge,
-            config_dict={},
-            user_tag_settings={"CONTROL": {"ff2chi": 1}},
-        )
-        feff_set.write_input(out_dir)
-
-        # 3) Read, patch, write back
-        inp_path = os.path.join(out_dir, "feff.inp")
-        new_lines = []
-        saw_control = saw_print = False
-
-        for line in open(inp_path):
-            # After writing or seeing a CONTROL line, inject our CONTROL+PRINT
-            if line.strip().startswith("CONTROL") and not saw_control:
-                new_lines.append(
-                    "*         pot    xsph  fms   paths genfmt ff2chi\n"
-                    "CONTROL   1      1     1     1     1      1\n"
+        run_dir = cache_dir / feff_run_key(struct, absorber, radius, edge, profile, digest)
+        # written last, so it marks a finished run of any profile
+        if (run_dir / MANIFEST_FILE).is_file():
+            print(f"Reusing FEFF run in {run_dir}")
+            touch(run_dir)
+            return run_dir
+
+        # one run per key at a time, across worker processes and API instances;
+        # whoever waited here usually finds the run finished
+        with file_lock(cache_dir / f".{run_dir.name}.lock"):
+            if (run_dir / MANIFEST_FILE).is_file():
+                print(f"Reusing FEFF run in {run_dir}")
+                touch(run_dir)
+                return run_dir
+
+            potentials_dir = potentials_root / feff_potential_key(struct, absorber, edge, digest)
+            reuse_potentials = profile == "radius-extension" and potentials_dir.is_dir()
+            if reuse_potentials:
+                touch(potentials_dir)
+            # without earlier potentials a radius extension computes them itself
+            control = feff_control(
+                "exafs" if profile == "radius-extension" and not reuse_potentials else profile,
+                reuse_potentials,
+            )
+
+            scratch_dir = tempfile.mkdtemp(prefix=f".{run_dir.name}-", dir=cache_dir)
+
+            # 2) feff.inp with our CONTROL/PRINT, generated in memory once per input key
+            tags = dict(FEFF_PROFILES[profile]["tags"])
+            if FEFF_PROFILES[profile]["control"][2]:
+                # full multiple scattering over the same cluster
+                tags["FMS"] = f"{float(radius)} 0"
+
+            def build_input():
+                feff_set = FEFFDictSet(
+                    absorbing_atom=absorber,
+                    structure=struct,
+                    radius=radius,
+                    edge=edge,
+                    config_dict={},
+                    user_tag_settings={"CONTROL": {"ff2chi": 1}, **tags},
                 )
-                new_lines.append("PRINT     1      0     0     0     0      3\n")
-                saw_control = saw_print = True
-                # skip any original CONTROL/PRINT lines
-                continue
-
-            # If CONTROL never appeared before POTENTIALS, inject just before POTENTIALS
-            if not saw_control and line.strip().startswith("POTENTIALS"):
-                new_lines.append(
-                    "*         pot    xsph  fms   paths genfmt ff2chi\n"
-                    "CONTROL   1      1     1     1     1      1\n"
-                    "PRINT     1      0     0     0     0      3\n"
+                return patch_control(feff_inp_text(feff_set), control)
+
+            input_key = _hash(
+                dict(
+                    structure=digest,
+                    absorber=str(absorber),
+                    radius=float(radius),
+                    edge=edge,
+                    profile=profile,
+                    control=control,
+                )
+            )
+            with open(os.path.join(scratch_dir, "feff.inp"), "w") as f:
+                f.write(cached_input(input_key, build_input))
+
+            if reuse_potentials:
+                for name in POTENTIAL_FILES:
+                    if (potentials_dir / name).is_file():
+                        shutil.copy2(potentials_dir / name, os.path.join(scratch_dir, name))
+                print(f"Reusing pot/xsph outputs from {potentials_dir}")
+
+            # 3) Run the real FEFF8L (must be the Fortran binary!)
+            print(f"Running {feff_exe} in {scratch_dir} …")
+            # own process group: a timeout or cancelled job kills feff8l and its children
+            run_process([feff_exe], cwd=scratch_dir, timeout=timeout)
+            for name in FEFF_PROFILES[profile]["outputs"]:
+                if not os.path.isfile(os.path.join(scratch_dir, name)):
+                    raise RuntimeError(f"{feff_exe} finished without writing {name}")
+
+            with open(os.path.join(scratch_dir, MANIFEST_FILE), "w") as f:
+                json.dump(
+                    {
+                        "profile": profile,
+                        "absorber": str(absorber),
+                        "radius": float(radius),
+                        "edge": edge,
+                        "control": control.splitlines()[-1],
+                        "potential_key": potentials_dir.name,
+                        "reused_potentials": reuse_potentials,
+                        "cif_file": str(cif_file),
+                    },
+                    f,
+                    indent=1,
                 )
-                saw_control = saw_print = True
-
-            new_lines.append(line)
-
-        with open(inp_path, "w") as f:
-            f.writelines(new_lines)
 
-        # 4) Run the real FEFF8L (must be the Fortran binary!)
-        print(f"Running {feff_exe} in {out_dir} …")
-        subprocess.run([feff_exe], cwd=out_dir, check=True)
-        print("Done; check for feff0001.dat … in", out_dir)
+            # 4) Publish the finished run atomically
+            try:
+                os.rename(scratch_dir, run_dir)
+            except OSError:
+                # a concurrent run of the same inputs got there first
+                if not (run_dir / MANIFEST_FILE).is_file():
+                    raise
+                shutil.rmtree(scratch_dir, ignore_errors=True)
+            scratch_dir = None
+            if not reuse_potentials:
+                _save_potentials(run_dir, potentials_dir)
+            print("Done; check for feff0001.dat … in", run_dir)
+            return run_dir
     except Exception as e:
         print(f"_make_and_run_feff: {e}")
         raise e
+    finally:
+        if scratch_dir is not None:
+            shutil.rmtree(scratch_dir, ignore_errors=True)
 
 
-def load_paths(feff_dir, amp_ratio=None, r_max=None, verbose=False):
+def load_paths(feff_dir, amp_ratio=None, r_max=None, verbose=False, **query):
     """
     Scan a FEFF run directory, filter by amp_ratio and r_max, and return
     a dict mapping 'path<index>' to the corresponding feffNNNN.dat filepath.
 
+    The directory is parsed once into a FeffPathIndex (see path_index.py),
+    which later calls reuse. Any further keyword (nlegs, bond, degen, shells,
+    top, …) is passed on to FeffPathIndex.select.
+
     If verbose=True, prints a table with:
       Path  Bond   Amp (%)  R_eff (Å)   Deg  Nlegs
 
@@ -142,79 +368,42 @@ def load_paths(feff_dir, amp_ratio=None, r_max=None, verbose=False):
     dict
         { 'path1': '…/feff0001.dat', 'path2': … }
     """
-    list_file = os.path.join(feff_dir, "list.dat")
-    if not os.path.isfile(list_file):
-        raise FileNotFoundError(f"No list.dat found in {feff_dir}")
-
-    # Read list.dat and locate table start
-    lines = open(list_file).read().splitlines()
-    start = next((i + 1 for i, L in enumerate(lines) if "pathindex" in L.lower()), None)
-    if start is None:
-        start = next(
-            (i + 1 for i, L in enumerate(lines) if L.strip().startswith("-----")), None
-        )
-    if start is None:
-        raise ValueError("Couldn't find table in list.dat")
-
-    # Parse columns: (index, amp, r_eff, deg, nlegs)
-    entries = []
-    for L in lines[start:]:
-        parts = L.split()
-        if not parts or not parts[0].isdigit():
-            continue
-        idx = int(parts[0])
-        amp = float(parts[2])
-        deg = float(parts[3])
-        nlegs = int(parts[4])
-        r_eff = float(parts[5])
-        entries.append((idx, amp, r_eff, deg, nlegs))
+    index = FeffPathIndex.load(feff_dir)
 
     # Apply filters
-    sel = [
-        (i, amp, r_eff, deg, nlegs)
-        for (i, amp, r_eff, deg, nlegs) in entries
-        if (amp_ratio is None or amp >= amp_ratio) and (r_max is None or r_eff <= r_max)
-    ]
+    sel = index.select(amp_ratio=amp_ratio, r_max=r_max, **query)
 
-    # Verbose header
     if verbose:
-        header = f"{'Path':>4}  {'Bond':<7}  {'Amp (%)':>8}  {'R_eff (Å)':>9}  {'Deg':>4}  {'Nlegs':>5}"
-        print(header)
-        print("-" * len(header))
-
-    paths = {}
-    for idx, amp, r_eff, deg, nlegs in sel:
-        # File path
-        fname = os.path.join(feff_dir, f"feff{idx:04d}.dat")
-        if not os.path.exists(fname):
-            alt = fname.replace(".dat", ".data")
-            if os.path.exists(alt):
-                fname = alt
-            else:
-                continue
-
-        # Determine bond type
-        bond = ""
-        with open(fname) as f:
-            datlines = f.readlines()
-        for j, line in enumerate(datlines):
-            if "pot at#" in line.lower():
-                atom_lines = [ln for ln in datlines[j + 1 : j + 4] if ln.strip()]
-                if len(atom_lines) >= 2:
-                    el0 = atom_lines[0].split()[5]
-                    el1 = atom_lines[1].split()[5]
-                    bond = f"{el0}-{el1}"
-                break
-
-        # Print row
-        if verbose:
-            print(
-                f"{idx:4d}  {bond:<7}  {amp:8.3f}  {r_eff:9.3f}  {deg:4.1f}  {nlegs:5d}"
-            )
+        sel.print_table()
+
+    return sel.paths()
 
-        paths[f"path{idx}"] = fname
 
-    return paths
+def feff_run_dir(run_key: str) -> Path:
+    """
+    Directory of the cached FEFF run ``run_key`` (its feff_run_key).
+    """
+    if not re.fullmatch(r"[0-9a-f]{20}", run_key):
+        raise ValueError(f"Invalid FEFF run key {run_key!r}")
+    run_dir = FEFF_PATHS_DIR / run_key
+    if not (run_dir / "list.dat").is_file():
+        raise FileNotFoundError(f"No FEFF run {run_key}")
+    touch(run_dir)
+    return run_dir
+
+
+def resolve_paths(run_key: str, path_ids=None) -> dict:
+    """
+    { 'pathN': file } of FEFF run ``run_key`` for the given path ids; without
+    ids, the paths its summary lists. Used so that prompts and tool calls carry
+    ids instead of file names.
+    """
+    index = FeffPathIndex.load(feff_run_dir(run_key))
+    ids = list(path_ids) if path_ids else index.summary_ids()
+    unknown = set(ids) - set(int(i) for i in index.table["index"])
+    if unknown:
+        raise KeyError(f"No paths {sorted(unknown)} in FEFF run {run_key}")
+    return index.subset(np.isin(index.table["index"], ids)).paths()
 
 
 def transform_paths(paths):
@@ -262,24 +451,7 @@ def load_prj(xas_path: str):
             use_hashkey=False,
         )
     elif filename.suffix.lower() == ".dat":
-        # Assume plain text, xmu, or ascii spectrum
-        data = larch.io.read_ascii(
-            filename,
-            labels=("ang_c", "ang_o", "time", "i0", "itrans")
-        )
-        hc = 12398.42
-        d = 1.63747
-        theta = np.radians(data.ang_c)   # angle in radians
-        energy = hc / (2 * d * np.sin(theta))
-
-        data.energy = energy
-        data.mu = -np.log(data.itrans / data.i0)
-
-        # Step 3: process for EXAFS
-        pre_edge(data)
-        autobk(data)
-        xftf(data)
-
+        data = load_dat(filename)
 
     else:
         # Assume plain text, xmu, or ascii spectrum
@@ -289,13 +461,59 @@ def load_prj(xas_path: str):
     return data
 
 
+# everything that changes the outcome of load_dat; part of the cache key
+DAT_PROCESSING = {
+    "labels": ("ang_c", "ang_o", "time", "i0", "itrans"),
+    "hc": 12398.42,
+    "d": 1.63747,
+    "steps": ("pre_edge", "autobk", "xftf"),
+}
+
+
+def load_dat(filename):
+    """
+    Read a beamline .dat spectrum (monochromator angle, i0, itrans) and process
+    it for EXAFS. Results are cached by file content (see spectrum_cache.py).
+    """
+    key = spectrum_key(filename, DAT_PROCESSING)
+    data = spectrum_cache.get(key)
+    if data is not None:
+        print(f"Using cached spectrum for {filename}")
+        return data
+
+    # Assume plain text, xmu, or ascii spectrum
+    data = larch.io.read_ascii(filename, labels=DAT_PROCESSING["labels"])
+    hc = DAT_PROCESSING["hc"]
+    d = DAT_PROCESSING["d"]
+    theta = np.radians(data.ang_c)   # angle in radians
+    energy = hc / (2 * d * np.sin(theta))
+
+    data.energy = energy
+    data.mu = -np.log(data.itrans / data.i0)
+
+    # Step 3: process for EXAFS
+    pre_edge(data)
+    autobk(data)
+    xftf(data)
+
+    spectrum_cache.put(key, data)
+    return data
+
+
 def _fit_ffef(name: str, params: dict, pathlist: list, xas_path: str):
     """
     Run a single fit on a FEFF path.
     """
-    # This function is a placeholder for future implementation
-    # It should take a path from the FEFF output and perform a fit
+    data = load_prj(
+        xas_path=xas_path
+    )  # this function loads the data from the project file, which is used for the fit
+    return fit_data(params, pathlist, data)
 
+
+def fit_data(params: dict, pathlist: dict, data):
+    """
+    Fit one processed spectrum ``data`` with the feffpath objects in ``pathlist``.
+    """
     # --- Define fourier transform ---
 
     fit_params = param_group(
@@ -312,16 +530,26 @@ def _fit_ffef(name: str, params: dict, pathlist: list, xas_path: str):
     trans = feffit_transform(
         kmin=3, kmax=13, rmin=1, rmax=5.0, kweight=[1, 2, 3], dk=1, window="Hanning"
     )  # TODO : this can also be given as a parameter. hyper parameter. => we can use this for now
-    data = load_prj(
-        xas_path=xas_path
-    )  # this function loads the data from the project file, which is used for the fit
-    # Do pre-edge subtraction
     dset = feffit_dataset(data=data, transform=trans, pathlist=pathlist)
 
     result = feffit(fit_params, [dset])
     return result
 
 
+def run_fit(
+    cif_file_name, absorber, params, xas_path, amp_ratio=None, r_max=None, timeout=None
+):
+    """
+    FEFF run, path selection and fit for one material and spectrum.
+    Module-level so it can be sent to the process pool; returns the report text.
+    """
+    dat_paths = make_and_run_feff(cif_file_name, absorber, timeout=timeout)
+    dat_paths_str = load_paths(dat_paths, amp_ratio, r_max, verbose=True)
+    path_list = transform_paths(dat_paths_str)
+    result = _fit_ffef(cif_file_name, params, path_list, xas_path=xas_path)
+    return feffit_report(result, with_paths=True)
+
+
 def report(result):
     """
     Print a report of the fit results.
@@ -425,136 +653,10 @@ def viz(name, path_list, result,xas_path=None):
     """
     Visualize the result
     """
-
-    data = load_prj(xas_path)
-
-    datalist = [name]
-
-    # cmap = plt.cm.nipy_spectral
-    cmap = plt.cm.magma
-    colors = [cmap(value) for value in np.linspace(0, 1, 16)]
-    usepath = 16
-
-    # step = 2.2 # Cu foil
-    kweight = 2
-    step = 1.2 * kweight / 2
-
-    kmax = 10
-
-    for i, sample in enumerate(datalist):
-        plt.figure(figsize=(10, 5))
-
-        mod = result.datasets[i].model
-        dat = result.datasets[i].data
-        data_chik = dat.chi * dat.k**kweight
-        model_chik = mod.chi * mod.k**kweight
-
-        plt.subplot(131)
-        plt.plot(dat.k, data_chik, color="navy", label="data", alpha=0.6, lw=2)
-        plt.plot(mod.k, model_chik, color="crimson", label="fit", alpha=0.6, lw=2)
-
-        for i, path_i in enumerate(list(path_list.values())[:usepath]):
-            path_i_data = ff2chi([path_i], params=result.paramgroup)
-            path_chik = path_i_data.chi * path_i_data.k**kweight
-            path_name = path_i.filename.split("_")[-1].split(".")[0]
-
-            plt.plot(
-                path_i_data.k,
-                path_chik - step * (i + 1),
-                label=path_name,
-                color=colors[i],
-                alpha=0.6,
-                lw=1.5,
-                ls="-.",
-            )
-
-        plt.xlabel("$k$ [$\\AA^{-1}$]", fontsize=12)
-        plt.ylabel("$k^2 \\chi (k)$ [$\\AA^{-2}$]", fontsize=12)
-        plt.xlim(0, 9.5)
-        # plt.ylim(-4, 1.25)
-
-        plt.subplot(132)
-        xftf(
-            dat, kmin=3, kmax=kmax, kweight=kweight, dk=1, window="hanning", rmax_out=12
-        )
-        xftf(
-            mod, kmin=3, kmax=kmax, kweight=kweight, dk=1, window="hanning", rmax_out=12
-        )
-
-        plt.plot(dat.r, dat.chir_mag, color="navy", label="data", alpha=0.6, lw=2)
-        plt.plot(mod.r, mod.chir_mag, color="crimson", label="fit", alpha=0.6, lw=2)
-
-        for i, path_i in enumerate(list(path_list.values())[:usepath]):
-            path_i_data = ff2chi([path_i], params=result.paramgroup)
-            path_chik = path_i_data.chi * path_i_data.k**kweight
-            xftf(
-                path_i_data,
-                kmin=3.5,
-                kmax=9.5,
-                kweight=kweight,
-                dk=1,
-                window="hanning",
-                rmax_out=12,
-            )
-            path_name = path_i.filename.split("_")[-1].split(".")[0]
-
-            plt.plot(
-                path_i_data.r,
-                path_i_data.chir_mag - step * (i + 1),
-                label=path_name,
-                color=colors[i],
-                alpha=0.6,
-                lw=1.5,
-                ls="-.",
-            )
-
-        plt.title(sample)
-        plt.xlabel("$R$ [$\\AA$]", fontsize=12)
-        plt.ylabel("$|\\chi(R)|$ [$\\AA ^{-3}$]", fontsize=12)
-        plt.xlim(0, 5)
-        # plt.ylim(-4, 1.25)
-
-        plt.subplot(133)
-
-        plt.plot(dat.r, dat.chir_re, color="navy", label="data", alpha=0.6, lw=2)
-        plt.plot(mod.r, mod.chir_re, color="crimson", label="fit", alpha=0.6, lw=2)
-
-        for i, path_i in enumerate(list(path_list.values())[:usepath]):
-            path_i_data = ff2chi([path_i], params=result.paramgroup)
-            path_chik = path_i_data.chi * path_i_data.k**kweight
-            xftf(
-                path_i_data,
-                kmin=3.5,
-                kmax=9.5,
-                kweight=kweight,
-                dk=1,
-                window="hanning",
-                rmax_out=12,
-            )
-            path_name = path_i.filename.split("_")[-1].split(".")[0]
-
-            plt.plot(
-                path_i_data.r,
-                path_i_data.chir_re - step * (i + 1),
-                label=path_name,
-                color=colors[i],
-                alpha=0.6,
-                lw=1.5,
-                ls="-.",
-            )
-
-        plt.xlabel("$R$ [$\\AA$]", fontsize=12)
-        plt.ylabel("Re[$\\chi(R)$] [$\\AA ^{-3}$]", fontsize=12)
-        plt.xlim(0, 5)
-        # plt.ylim(-4, 1.25)
-        plt.legend(loc="upper right", frameon=False)
-        plt.tight_layout()
-
-        origin = Path.cwd()
-
-        save_folder = "physics/viz/"
-        save_path = origin / save_folder / f"{sample}_all.jpg"
-        plt.savefig(save_path, dpi=300)
+    fig_name = xas_path or name
+    labels = {key: path_label(path.filename) for key, path in path_list.items()}
+    save_curves(fig_name, fit_curves(result, path_list, labels=labels, title=name))
+    return render_fit_figure(fig_name)
 
 
 if __name__ == "__main__":
@@ -571,23 +673,7 @@ if __name__ == "__main__":
 
     # user feedback is needed here, what are the parameters that the user wants to set? We can provide some initial guesses
 
-    amp = 0.8  # initial guess for the amplitude
-    e0 = 0.0  # initial guess for the energy shift
-    alpha = 0  # initial guess for the Debye-Waller factor
-    # t = 300.0  # initial guess for the temperature (if needed)
-    # theta = 400.0v  # initial guess for the Debye temperature (if needed)
-    sigma2 = 0.001  # initial guess for the mean square displacement
-    sigma2_2 = 0.001  # initial guess for the second moment
-    sigma2_4 = 0.001  # initial guess for the fourth moment
-
-    params = {
-        "amp": amp,
-        "e0": e0,
-        "alpha": alpha,
-        "sigma2": sigma2,
-        "sigma2_2": sigma2_2,
-        "sigma2_4": sigma2_4,
-    }  # dict of parameter initial values
+    params = dict(DEFAULT_PARAMS)  # dict of parameter initial values
 
     dat_paths = make_and_run_feff(material_id, material)
     dat_paths_str = load_paths(
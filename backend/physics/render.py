@@ -0,0 +1,153 @@
+"""
+Fit figures: the curves are computed once right after the fit and saved with
+it as physics/viz/<name>.npz; the figure is drawn from that file later, in a
+pool worker, with matplotlib's non-interactive Agg canvas.
+"""
+
+import os
+from pathlib import Path
+
+import numpy as np
+from matplotlib import colormaps
+from matplotlib.figure import Figure
+from larch.xafs import ff2chi, xftf
+
+from disk_cache import register as register_cache
+
+VIZ_DIR = Path.cwd() / "physics/viz"
+
+USEPATH = 16  # paths drawn under the data and the fit
+KWEIGHT = 2
+KMAX = 10
+
+# a fit's curves and figure go together; other files in viz/ are left alone
+register_cache(
+    "viz", VIZ_DIR, max_mb=500, max_days=30,
+    entries=lambda root: [[p, p.with_suffix(".jpg")] for p in root.glob("[!.]*.npz")],
+)
+
+
+def curves_file(name: str) -> Path:
+    return VIZ_DIR / f"{name}.npz"
+
+
+def figure_file(name: str) -> Path:
+    return VIZ_DIR / f"{name}.jpg"
+
+
+def fit_curves(result, path_list, labels=None, title=""):
+    """
+    χ(k) and χ(R) of the data, the fit and each of the first USEPATH paths.
+    Every path gets one ff2chi and one xftf; the arrays are all the
+    figure needs.
+    """
+    kweight = KWEIGHT
+    mod = result.datasets[0].model
+    dat = result.datasets[0].data
+    xftf(dat, kmin=3, kmax=KMAX, kweight=kweight, dk=1, window="hanning", rmax_out=12)
+    xftf(mod, kmin=3, kmax=KMAX, kweight=kweight, dk=1, window="hanning", rmax_out=12)
+
+    curves = {
+        "title": np.array(title),
+        "kweight": np.array(kweight),
+        "data_k": dat.k,
+        "data_chik": dat.chi * dat.k**kweight,
+        "model_k": mod.k,
+        "model_chik": mod.chi * mod.k**kweight,
+        "data_r": dat.r,
+        "data_chir_mag": dat.chir_mag,
+        "data_chir_re": dat.chir_re,
+        "model_r": mod.r,
+        "model_chir_mag": mod.chir_mag,
+        "model_chir_re": mod.chir_re,
+    }
+
+    path_labels = []
+    for i, (key, path_i) in enumerate(list(path_list.items())[:USEPATH]):
+        path_i_data = ff2chi([path_i], params=result.paramgroup)
+        xftf(
+            path_i_data,
+            kmin=3.5,
+            kmax=9.5,
+            kweight=kweight,
+            dk=1,
+            window="hanning",
+            rmax_out=12,
+        )
+        curves[f"path{i}_k"] = path_i_data.k
+        curves[f"path{i}_chik"] = path_i_data.chi * path_i_data.k**kweight
+        curves[f"path{i}_r"] = path_i_data.r
+        curves[f"path{i}_chir_mag"] = path_i_data.chir_mag
+        curves[f"path{i}_chir_re"] = path_i_data.chir_re
+        path_labels.append(labels[key] if labels and key in labels else key)
+    curves["path_labels"] = np.array(path_labels, dtype=str)
+    return curves
+
+
+def save_curves(name: str, curves: dict) -> Path:
+    """
+    Store the curves of a new fit and drop the figure of the previous one.
+    """
+    os.makedirs(VIZ_DIR, exist_ok=True)
+    path = curves_file(name)
+    tmp_path = VIZ_DIR / f".{name}.{os.getpid()}.npz"
+    with open(tmp_path, "wb") as f:
+        np.savez(f, **curves)
+    os.replace(tmp_path, path)
+    figure_file(name).unlink(missing_ok=True)
+    return path
+
+
+def render_curves(curves, save_path):
+    """
+    Draw k²χ(k), |χ(R)| and Re χ(R) with the paths stacked below data and fit.
+    """
+    kweight = int(curves["kweight"])
+    step = 1.2 * kweight / 2
+    labels = list(curves["path_labels"])
+    cmap = colormaps["magma"]
+    colors = [cmap(value) for value in np.linspace(0, 1, USEPATH)]
+
+    fig = Figure(figsize=(10, 5))
+    ax_k, ax_mag, ax_re = fig.subplots(1, 3)
+
+    ax_k.plot(curves["data_k"], curves["data_chik"], color="navy", label="data", alpha=0.6, lw=2)
+    ax_k.plot(curves["model_k"], curves["model_chik"], color="crimson", label="fit", alpha=0.6, lw=2)
+    ax_k.set_xlabel("$k$ [$\\AA^{-1}$]", fontsize=12)
+    ax_k.set_ylabel("$k^2 \\chi (k)$ [$\\AA^{-2}$]", fontsize=12)
+    ax_k.set_xlim(0, 9.5)
+
+    for ax, part in ((ax_mag, "chir_mag"), (ax_re, "chir_re")):
+        ax.plot(curves["data_r"], curves[f"data_{part}"], color="navy", label="data", alpha=0.6, lw=2)
+        ax.plot(curves["model_r"], curves[f"model_{part}"], color="crimson", label="fit", alpha=0.6, lw=2)
+        ax.set_xlabel("$R$ [$\\AA$]", fontsize=12)
+        ax.set_xlim(0, 5)
+    ax_mag.set_title(str(curves["title"]))
+    ax_mag.set_ylabel("$|\\chi(R)|$ [$\\AA ^{-3}$]", fontsize=12)
+    ax_re.set_ylabel("Re[$\\chi(R)$] [$\\AA ^{-3}$]", fontsize=12)
+
+    for i, label in enumerate(labels):
+        offset = step * (i + 1)
+        style = dict(label=label, color=colors[i], alpha=0.6, lw=1.5, ls="-.")
+        ax_k.plot(curves[f"path{i}_k"], curves[f"path{i}_chik"] - offset, **style)
+        ax_mag.plot(curves[f"path{i}_r"], curves[f"path{i}_chir_mag"] - offset, **style)
+        ax_re.plot(curves[f"path{i}_r"], curves[f"path{i}_chir_re"] - offset, **style)
+
+    ax_re.legend(loc="upper right", frameon=False)
+    fig.tight_layout()
+    fig.savefig(save_path, dpi=300)
+
+
+def render_fit_figure(name: str) -> Path:
+    """
+    Render physics/viz/<name>.jpg from the saved curves. Written to a scratch
+    file first, so the figure appears complete or not at all.
+    """
+    with np.load(curves_file(name)) as npz:
+        curves = {key: npz[key] for key in npz.files}
+    save_path = figure_file(name)
+    tmp_path = VIZ_DIR / f".{name}.{os.getpid()}.jpg"
+    render_curves(curves, tmp_path)
+    os.replace(tmp_path, save_path)
+    print(f"Visualization saved to {save_path}")
+    return save_path
@@ -0,0 +1,131 @@
+"""
+Cache of processed spectra (read, converted to energy, pre_edge, autobk, xftf),
+keyed by file content hash and processing parameters.
+
+Entries live in an in-memory LRU and are also written to disk as .npz, so
+other worker processes and later runs skip the processing too.
+"""
+
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+from pathlib import Path
+
+import numpy as np
+from larch import Group
+
+from disk_cache import register as register_cache, touch
+
+SPECTRUM_CACHE_DIR = Path.cwd() / "physics/spectrum_cache"
+SPECTRUM_CACHE_SIZE = int(os.getenv("XAS_SPECTRUM_CACHE_SIZE", 32))
+
+# group attributes worth keeping; the rest can be recomputed from these
+ARRAY_ATTRS = (
+    "energy",
+    "mu",
+    "i0",
+    "itrans",
+    "norm",
+    "flat",
+    "dmude",
+    "pre_edge",
+    "post_edge",
+    "bkg",
+    "k",
+    "chi",
+    "kwin",
+    "r",
+    "chir",
+    "chir_mag",
+    "chir_re",
+    "chir_im",
+)
+SCALAR_ATTRS = ("e0", "edge_step")
+
+
+def spectrum_key(filename, processing: dict) -> str:
+    """
+    Hash of the file content plus the processing parameters.
+    """
+    h = hashlib.sha256()
+    with open(filename, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
+    h.update(json.dumps(processing, sort_keys=True, default=str).encode())
+    return h.hexdigest()[:24]
+
+
+class SpectrumCache:
+    def __init__(self, cache_dir=SPECTRUM_CACHE_DIR, max_items=SPECTRUM_CACHE_SIZE):
+        self.cache_dir = Path(cache_dir)
+        self.max_items = max_items
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """
+        A fresh Group for ``key``, or None. Callers may modify the returned
+        group (feffit and xftf do); the cached arrays are not shared.
+        """
+        with self._lock:
+            arrays = self._items.get(key)
+            if arrays is not None:
+                self._items.move_to_end(key)
+        if arrays is None:
+            arrays = self._read(key)
+            if arrays is None:
+                return None
+            self._remember(key, arrays)
+        return _to_group(arrays)
+
+    def put(self, key, group):
+        arrays = {}
+        for attr in ARRAY_ATTRS + SCALAR_ATTRS:
+            value = getattr(group, attr, None)
+            if value is not None:
+                arrays[attr] = np.array(value, copy=True)
+        self._remember(key, arrays)
+        self._write(key, arrays)
+
+    def _remember(self, key, arrays):
+        with self._lock:
+            self._items[key] = arrays
+            self._items.move_to_end(key)
+            while len(self._items) > self.max_items:
+                self._items.popitem(last=False)
+
+    def _read(self, key):
+        path = self.cache_dir / f"{key}.npz"
+        if not path.is_file():
+            return None
+        try:
+            with np.load(path) as npz:
+                arrays = {name: npz[name] for name in npz.files}
+        except (OSError, ValueError) as e:
+            print(f"Ignoring unreadable cached spectrum {path}: {e}")
+            return None
+        touch(path)
+        return arrays
+
+    def _write(self, key, arrays):
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            tmp_path = self.cache_dir / f".{key}.{os.getpid()}.npz"
+            with open(tmp_path, "wb") as f:
+                np.savez(f, **arrays)
+            os.replace(tmp_path, self.cache_dir / f"{key}.npz")
+        except OSError as e:
+            print(f"Could not write spectrum cache for {key}: {e}")
+
+
+def _to_group(arrays):
+    values = {}
+    for name, value in arrays.items():
+        values[name] = value.item() if name in SCALAR_ATTRS else value.copy()
+    return Group(**values)
+
+
+spectrum_cache = SpectrumCache()
+register_cache("spectrum", spectrum_cache.cache_dir, max_mb=2000, max_days=30)
@@ -0,0 +1,141 @@
+"""
+Single-flight coalescing of identical in-flight work.
+
+When several requests ask for the same thing at once (a FEFF run for the same
+material, the same MP lookup), only the first one computes it; the others
+wait for that computation and get its result or its exception. Callers key
+flights on normalized inputs (run_feff capitalizes the absorber, material
+lookups use the reduced formula), so "ni" and "Ni" share one flight.
+
+SingleFlight is for code running in threads, AsyncSingleFlight for coroutines
+on the event loop, and file_lock serializes work on one cache entry across
+processes (uvicorn workers and pool workers).
+"""
+
+import asyncio
+import os
+import threading
+from concurrent.futures import Future
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Hashable, Iterable
+
+try:
+    import fcntl
+except ImportError:  # not on POSIX
+    fcntl = None
+
+
+class SingleFlight:
+    def __init__(self):
+        self._inflight: Dict[Hashable, Future] = {}
+        self._lock = threading.Lock()
+
+    def _claim(self, keys):
+        """
+        (futures for all keys, the keys this caller now has to compute).
+        """
+        futures, led = {}, []
+        with self._lock:
+            for key in keys:
+                future = self._inflight.get(key)
+                if future is None:
+                    future = self._inflight[key] = Future()
+                    led.append(key)
+                futures[key] = future
+        return futures, led
+
+    def _settle(self, key, result=None, error=None):
+        with self._lock:
+            future = self._inflight.pop(key)
+        if error is not None:
+            future.set_exception(error)
+        else:
+            future.set_result(result)
+
+    def do(self, key: Hashable, fn: Callable, *args, **kwargs) -> Any:
+        """
+        ``fn(*args, **kwargs)``, run once for all concurrent callers with ``key``.
+        """
+        futures, led = self._claim([key])
+        if led:
+            try:
+                result = fn(*args, **kwargs)
+            except BaseException as e:
+                self._settle(key, error=e)
+                raise
+            self._settle(key, result)
+        return futures[key].result()
+
+    def do_many(self, keys: Iterable[Hashable], fn: Callable[[list], dict]) -> dict:
+        """
+        { key: result } for ``keys``. ``fn(keys)`` is called once with the keys
+        nobody else is computing and must return a result for each of them;
+        the rest are waited for.
+        """
+        futures, led = self._claim(list(dict.fromkeys(keys)))
+        if led:
+            try:
+                results = fn(led)
+            except BaseException as e:
+                for key in led:
+                    self._settle(key, error=e)
+                raise
+            for key in led:
+                self._settle(key, results.get(key))
+        return {key: future.result() for key, future in futures.items()}
+
+
+class AsyncSingleFlight:
+    def __init__(self):
+        self._inflight: Dict[Hashable, asyncio.Task] = {}
+        self._waiters: Dict[Hashable, int] = {}
+
+    async def do(self, key: Hashable, fn: Callable, *args, **kwargs) -> Any:
+        """
+        ``await fn(*args, **kwargs)``, run once for all concurrent callers with
+        ``key``. A caller that is cancelled stops waiting; the shared work
+        goes on for the others, and is cancelled once nobody waits for it.
+        """
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(fn(*args, **kwargs))
+            self._inflight[key] = task
+            self._waiters[key] = 0
+            task.add_done_callback(lambda t: self._done(key, t))
+        self._waiters[key] += 1
+        try:
+            return await asyncio.shield(task)
+        finally:
+            if self._inflight.get(key) is task:
+                self._waiters[key] -= 1
+                if not self._waiters[key] and not task.done():
+                    task.cancel()
+
+    def _done(self, key, task):
+        if self._inflight.get(key) is task:
+            del self._inflight[key]
+            del self._waiters[key]
+        if not task.cancelled():
+            # retrieved, so a failure nobody waited for is not logged as lost
+            task.exception()
+
+    def in_flight(self) -> int:
+        return len(self._inflight)
+
+
+@contextmanager
+def file_lock(path):
+    """
+    Exclusive lock on ``path`` (created if missing) for the duration of the
+    block, held against other threads and processes alike.
+    """
+    if fcntl is None:
+        yield
+        return
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(path, "a") as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
@@ -3,62 +3,359 @@
 # [https://mdr.nims.go.jp/api/v1/datasets?q=XAFS specimen:"Nickel"](https://mdr.nims.go.jp/api/v1/datasets?q=XAFS%20specimen:%22Nickel%22) instead of nickel, could have a lot
 
 
-import requests
-import zipfile
+import json
 import os
+import re
+import shutil
+import threading
+import time
+import zipfile
+from collections import Counter, defaultdict
 
+import requests
+from pymatgen.core import Composition, Element
 
-def get_datasets():
-    response = requests.get("https://mdr.nims.go.jp/api/v1/datasets?q=XAFS")
+from singleflight import file_lock
+from disk_cache import register as register_cache, touch
 
-    datasets_list = response.json()
-    datasets_map = {}
-    count = 0
 
-    for i in datasets_list:
-        if len(i["data"]["attributes"]["specimens"]) >= 1:
-            datasets_map[i["data"]["attributes"]["titles"][0]["title"]] = (
-                i["data"]["id"],
-                i["data"]["attributes"]["specimens"][0]["name"],
-            )
-        else:
-            datasets_map[i["data"]["attributes"]["titles"][0]["title"]] = (
-                i["data"]["id"],
-                "",
+# point at a local stand-in of MDR for tests and development
+MDR_BASE_URL = os.getenv("MDR_BASE_URL", "https://mdr.nims.go.jp")
+MDR_DATASETS_URL = f"{MDR_BASE_URL}/api/v1/datasets?q=XAFS"
+CATALOG_FILE = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "online_xas_data", "catalog.json"
+)
+CATALOG_TTL = int(os.getenv("XAS_CATALOG_TTL", 24 * 3600))  # seconds
+
+
+def _tokens(text):
+    return set(re.findall(r"[a-z0-9]+", text.lower()))
+
+
+def _specimen_elements(name):
+    """
+    Element symbols named by a specimen, e.g. "Nickel" -> {"Ni"}, "NiMoO4 powder"
+    -> {"Ni", "Mo", "O"}. Words that are neither element names nor formulas are ignored.
+    """
+    elements = set()
+    for word in re.findall(r"[A-Za-z0-9()]+", name):
+        try:
+            elements.add(Element.from_name(word.lower()).symbol)
+            continue
+        except (ValueError, KeyError):
+            pass
+        if word[0].isupper():
+            try:
+                elements.update(el.symbol for el in Composition(word).elements)
+            except Exception:
+                pass
+    return elements
+
+
+def _entry(item):
+    """
+    Catalog entry for one dataset of the MDR search response.
+    """
+    attributes = item["data"]["attributes"]
+    specimens = [s.get("name", "") for s in attributes.get("specimens", [])]
+    titles = attributes.get("titles") or [{"title": ""}]
+    elements = set()
+    for specimen in specimens:
+        elements |= _specimen_elements(specimen)
+    return {
+        "id": item["data"]["id"],
+        "title": titles[0]["title"],
+        "specimen": specimens[0] if specimens else "",
+        "specimens": specimens,
+        "elements": sorted(elements),
+    }
+
+
+def _build_index(entries):
+    """
+    (entries, by_id, by_element, by_token) for one catalog snapshot. Built
+    apart from the live catalog and swapped in whole, so a query never mixes
+    positions of an old list with a new one.
+    """
+    titles = Counter(e["title"] for e in entries)
+    # datasets sharing a title are told apart by their id
+    entries = [
+        dict(e, label=e["title"] if titles[e["title"]] == 1 else f"{e['title']} [{e['id'][:8]}]")
+        for e in entries
+    ]
+    by_id = {e["id"]: e for e in entries}
+    by_element = defaultdict(list)
+    by_token = defaultdict(set)
+    for pos, e in enumerate(entries):
+        for el in e["elements"]:
+            by_element[el].append(pos)
+        for token in _tokens(e["title"]) | _tokens(" ".join(e["specimens"])):
+            by_token[token].add(pos)
+    return entries, by_id, dict(by_element), dict(by_token)
+
+
+class XafsCatalog:
+    """
+    The MDR XAFS dataset list, mirrored to online_xas_data/catalog.json and
+    indexed by id, specimen element and title token.
+
+    A copy older than ``ttl`` seconds is still served; it is revalidated in
+    the background with a conditional request (ETag / Last-Modified), so the
+    endpoint only waits for MDR the very first time.
+    """
+
+    def __init__(self, path=CATALOG_FILE, ttl=CATALOG_TTL, url=MDR_DATASETS_URL):
+        self.path = path
+        self.ttl = ttl
+        self.url = url
+        self.fetched_at = 0.0
+        self.etag = None
+        self.last_modified = None
+        self._lock = threading.Lock()
+        self._refreshing = False
+        self.entries, self.by_id, self.by_element, self.by_token = _build_index([])
+
+    def _snapshot(self):
+        with self._lock:
+            return self.entries, self.by_id, self.by_element, self.by_token
+
+    def _load_file(self):
+        if not os.path.isfile(self.path):
+            return False
+        try:
+            with open(self.path) as f:
+                saved = json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"Ignoring unreadable XAFS catalog {self.path}: {e}")
+            return False
+        index = _build_index(saved["entries"])
+        with self._lock:
+            self.entries, self.by_id, self.by_element, self.by_token = index
+            self.fetched_at = saved.get("fetched_at", 0.0)
+            self.etag = saved.get("etag")
+            self.last_modified = saved.get("last_modified")
+        return True
+
+    def _save_file(self):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        tmp_path = f"{self.path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(
+                {
+                    "fetched_at": self.fetched_at,
+                    "etag": self.etag,
+                    "last_modified": self.last_modified,
+                    "entries": self.entries,
+                },
+                f,
             )
-        count += 1
-
-    print(datasets_map)
-    print(count)
-
-    return datasets_map
-
-
-def get_data_by_id(dataset_id):
-    url = f"https://mdr.nims.go.jp/datasets/{dataset_id}.zip"
-    response = requests.get(url)
-    if response.status_code == 200:
-        zip_path = f"{dataset_id}.zip"
-        parent_dir = os.path.dirname(os.path.abspath(__file__))
-        sub_folder = os.path.join(parent_dir, "online_xas_data")
-        sub_sub_folder = os.path.join(sub_folder, dataset_id)
-
-        os.makedirs(sub_folder, exist_ok=True)
-        os.makedirs(sub_sub_folder, exist_ok=True)
-        zip_file_path = os.path.join(sub_sub_folder, zip_path)
-        with open(zip_file_path, "wb") as f:
-            f.write(response.content)
-        txt_files = []
-        with zipfile.ZipFile(zip_file_path, "r") as zip_ref:
-            zip_ref.extractall(
-                sub_sub_folder
-            )  # extract to sub folder in parent directory
-            for file in zip_ref.namelist():
-                if file.endswith(".txt"):
-                    txt_files.append(
-                        os.path.abspath(os.path.join(sub_sub_folder, file))
-                    )
-        return txt_files
+        os.replace(tmp_path, self.path)
+
+    def refresh(self):
+        """
+        Fetch the dataset list from MDR, or only confirm it if unchanged (304).
+        """
+        headers = {}
+        if self.entries and self.etag:
+            headers["If-None-Match"] = self.etag
+        if self.entries and self.last_modified:
+            headers["If-Modified-Since"] = self.last_modified
+        response = requests.get(self.url, headers=headers, timeout=30)
+        if response.status_code != 304:
+            response.raise_for_status()
+            index = _build_index([_entry(item) for item in response.json()])
+        with self._lock:
+            if response.status_code != 304:
+                self.entries, self.by_id, self.by_element, self.by_token = index
+            self.etag = response.headers.get("ETag", self.etag)
+            self.last_modified = response.headers.get("Last-Modified", self.last_modified)
+            self.fetched_at = time.time()
+            self._save_file()
+
+    def _refresh_in_background(self):
+        with self._lock:
+            if self._refreshing:
+                return
+            self._refreshing = True
+
+        def run():
+            try:
+                self.refresh()
+            except Exception as e:
+                print(f"XAFS catalog refresh failed, keeping the old copy: {e}")
+            finally:
+                with self._lock:
+                    self._refreshing = False
+
+        threading.Thread(target=run, daemon=True).start()
+
+    def ensure_loaded(self):
+        """
+        Entries from memory or catalog.json; fetched synchronously only if
+        there is no copy at all, revalidated in the background once stale.
+        """
+        if not self.entries and not self._load_file():
+            self.refresh()
+        elif time.time() - self.fetched_at > self.ttl:
+            self._refresh_in_background()
+        return self
+
+    def get(self, dataset_id):
+        self.ensure_loaded()
+        return self._snapshot()[1].get(dataset_id)
+
+    def query(self, q=None, element=None, offset=0, limit=None):
+        """
+        (total, entries) matching every given filter, in catalog order.
+        ``q`` matches title and specimen tokens (all words, prefix match on
+        the last one); ``element`` is a symbol or name, e.g. "Ni" or "nickel".
+        """
+        self.ensure_loaded()
+        # one consistent snapshot; a refresh may swap in a new one meanwhile
+        entries, _, by_element, by_token = self._snapshot()
+        pos = None
+        if element:
+            try:
+                symbol = Element.from_name(element.lower()).symbol
+            except (ValueError, KeyError):
+                symbol = element.strip().capitalize()
+            pos = set(by_element.get(symbol, ()))
+        if q:
+            words = re.findall(r"[a-z0-9]+", q.lower())
+            for i, word in enumerate(words):
+                if i == len(words) - 1:
+                    hits = set()
+                    for token in [t for t in by_token if t.startswith(word)]:
+                        hits |= by_token[token]
+                else:
+                    hits = by_token.get(word, set())
+                pos = hits if pos is None else pos & hits
+        matched = entries if pos is None else [entries[i] for i in sorted(pos)]
+        end = None if limit is None else offset + limit
+        return len(matched), matched[offset:end]
+
+
+def title_map(entries):
+    """
+    { title: (id, specimen) }, the shape the dataset picker expects.
+    """
+    return {e["label"]: (e["id"], e["specimen"]) for e in entries}
+
+
+xafs_catalog = XafsCatalog()
+
+
+def get_datasets(q=None, element=None, offset=0, limit=None):
+    """
+    The XAFS datasets of MDR as { title: (id, specimen) }, from the local catalog.
+    """
+    total, entries = xafs_catalog.query(q=q, element=element, offset=offset, limit=limit)
+    return title_map(entries)
+
+
+MDR_ZIP_URL = MDR_BASE_URL + "/datasets/{dataset_id}.zip"
+XAS_DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "online_xas_data")
+SPECTRUM_SUFFIXES = (".txt", ".dat")
+COMPLETE_MARKER = ".complete"
+DOWNLOAD_CHUNK = 1 << 20
+
+_download_locks = defaultdict(threading.Lock)
+
+# finished downloads only; a partial one is left to be resumed
+register_cache(
+    "datasets", XAS_DATA_DIR, max_mb=5000, max_days=90,
+    entries=lambda root: [[p] for p in root.iterdir() if (p / COMPLETE_MARKER).is_file()],
+)
+
+
+def dataset_dir(dataset_id):
+    if not re.fullmatch(r"[A-Za-z0-9_-]+", dataset_id):
+        raise ValueError(f"Invalid dataset id {dataset_id!r}")
+    return os.path.join(XAS_DATA_DIR, dataset_id)
+
+
+def _stream_download(url, part_path, session=requests):
+    """
+    Download ``url`` to ``part_path`` in chunks, resuming a partial file with
+    a Range request. Returns False if the server has no such file.
+    """
+    done = os.path.getsize(part_path) if os.path.exists(part_path) else 0
+    headers = {"Range": f"bytes={done}-"} if done else {}
+    with session.get(url, headers=headers, stream=True, timeout=(10, 60)) as response:
+        if response.status_code == 416:  # the partial file is already complete
+            return True
+        if response.status_code == 404:
+            return False
+        response.raise_for_status()
+        # 206: the server resumes; 200: it ignored the Range, start over
+        mode = "ab" if response.status_code == 206 else "wb"
+        with open(part_path, mode) as f:
+            for chunk in response.iter_content(chunk_size=DOWNLOAD_CHUNK):
+                f.write(chunk)
+    return True
+
+
+def _extract_spectra(zip_file_path, folder):
+    """
+    Extract only the .txt/.dat members of the zip; returns their paths.
+    """
+    root = os.path.realpath(folder)
+    files = []
+    with zipfile.ZipFile(zip_file_path, "r") as zip_ref:
+        for member in zip_ref.infolist():
+            if member.is_dir() or not member.filename.lower().endswith(SPECTRUM_SUFFIXES):
+                continue
+            target = os.path.realpath(os.path.join(root, member.filename))
+            if not target.startswith(root + os.sep):
+                print(f"Skipping zip member outside the dataset folder: {member.filename}")
+                continue
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            with zip_ref.open(member) as src, open(target, "wb") as dst:
+                shutil.copyfileobj(src, dst, DOWNLOAD_CHUNK)
+            files.append(target)
+    return files
+
+
+def _txt_files(files):
+    return [f for f in files if f.endswith(".txt")]
+
+
+def get_data_by_id(dataset_id, session=requests, url_template=MDR_ZIP_URL):
+    """
+    Paths of the .txt spectra of an MDR dataset, downloaded and extracted on
+    the first call. Later calls read the completion marker and return at once.
+    Returns None if MDR has no such dataset.
+    """
+    folder = dataset_dir(dataset_id)
+    marker = os.path.join(folder, COMPLETE_MARKER)
+    # the file lock keeps other API processes off a dataset being fetched
+    with _download_locks[dataset_id], file_lock(os.path.join(XAS_DATA_DIR, f".{dataset_id}.lock")):
+        if os.path.isfile(marker):
+            touch(folder)
+            with open(marker) as f:
+                return _txt_files(json.load(f)["files"])
+
+        os.makedirs(folder, exist_ok=True)
+        zip_file_path = os.path.join(folder, f"{dataset_id}.zip")
+        part_path = zip_file_path + ".part"
+        if not os.path.isfile(zip_file_path):
+            url = url_template.format(dataset_id=dataset_id)
+            if not _stream_download(url, part_path, session):
+                return None
+            os.replace(part_path, zip_file_path)
+
+        try:
+            files = _extract_spectra(zip_file_path, folder)
+        except zipfile.BadZipFile:
+            # a corrupt download is fetched again next time
+            os.remove(zip_file_path)
+            raise
+        with open(marker + ".tmp", "w") as f:
+            json.dump({"files": files, "completed_at": time.time()}, f)
+        os.replace(marker + ".tmp", marker)
+        # the spectra are extracted; the archive is not needed any more
+        os.remove(zip_file_path)
+        return _txt_files(files)
 
 
 if __name__ == "__main__":
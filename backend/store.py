@@ -0,0 +1,271 @@
+import json
+import sqlite3
+import threading
+import time
+import zlib
+from collections import OrderedDict
+from typing import Callable, Optional, Dict, Any
+
+
+# =========================
+# Stores for conversation, agent and job state
+# =========================
+
+class ConversationStore:
+    def get(self, conversation_id: str) -> Optional[Dict[str, Any]]:
+        pass
+
+    def save(self, conversation_id: str, state: Dict[str, Any]):
+        pass
+
+    def delete(self, conversation_id: str):
+        pass
+
+class LRUCache:
+    """
+    Thread-safe in-memory map holding at most ``max_items`` values; the least
+    recently used is dropped first. For per-process caches in front of disk.
+    """
+
+    def __init__(self, max_items: int):
+        self.max_items = max_items
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            value = self._items.get(key)
+            if value is not None:
+                self._items.move_to_end(key)
+            return value
+
+    def put(self, key, value):
+        with self._lock:
+            self._items[key] = value
+            self._items.move_to_end(key)
+            while len(self._items) > self.max_items:
+                self._items.popitem(last=False)
+
+    def __len__(self):
+        return len(self._items)
+
+
+class InMemoryConversationStore(ConversationStore):
+    def __init__(self):
+        self._conversations: Dict[str, Dict[str, Any]] = {}
+
+    def get(self, conversation_id: str) -> Optional[Dict[str, Any]]:
+        return self._conversations.get(conversation_id)
+
+    def save(self, conversation_id: str, state: Dict[str, Any]):
+        self._conversations[conversation_id] = state
+
+    def delete(self, conversation_id: str):
+        self._conversations.pop(conversation_id, None)
+
+class InMemoryAgentStore(ConversationStore):
+    def __init__(self):
+        self._agents: Dict[str, Dict[str, Any]] = {}
+
+    def get(self, agent_id: str) -> Optional[Dict[str, Any]]:
+        return self._agents.get(agent_id)
+
+    def save(self, agent_id: str, state: Dict[str, Any]):
+        self._agents[agent_id] = state
+
+    def delete(self, agent_id: str):
+        self._agents.pop(agent_id, None)
+
+
+class LRUAgentStore(ConversationStore):
+    """
+    Agents and their preprocessed paths, in memory. Holds at most
+    ``max_items`` entries and evicts the least recently used one.
+    """
+
+    def __init__(self, max_items: int = 64):
+        self.max_items = max_items
+        self._items: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, agent_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            state = self._items.get(agent_id)
+            if state is not None:
+                self._items.move_to_end(agent_id)
+            return state
+
+    def save(self, agent_id: str, state: Dict[str, Any]):
+        with self._lock:
+            self._items[agent_id] = state
+            self._items.move_to_end(agent_id)
+            while len(self._items) > self.max_items:
+                self._items.popitem(last=False)
+
+    def delete(self, agent_id: str):
+        with self._lock:
+            self._items.pop(agent_id, None)
+
+    def __len__(self):
+        return len(self._items)
+
+
+class SQLiteConversationStore(ConversationStore):
+    """
+    Store backed by a local SQLite file, one JSON document per id.
+
+    Safe to share between threads, and between processes that open the same
+    file (WAL journal, writers wait up to ``timeout`` seconds for the lock).
+    With ``compress`` the documents are stored as zlib-compressed JSON;
+    either kind is read back.
+    """
+
+    def __init__(
+        self,
+        db_path: str,
+        table: str = "conversations",
+        timeout: float = 30.0,
+        compress: bool = False,
+    ):
+        self._table = table
+        self._compress = compress
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, timeout=timeout, check_same_thread=False)
+        with self._lock, self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                f"CREATE TABLE IF NOT EXISTS {table} ("
+                "id TEXT PRIMARY KEY, state TEXT NOT NULL, updated_at REAL NOT NULL)"
+            )
+
+    def _read(self, conversation_id):
+        row = self._conn.execute(
+            f"SELECT state FROM {self._table} WHERE id = ?", (conversation_id,)
+        ).fetchone()
+        if not row:
+            return None
+        blob = row[0]
+        return json.loads(zlib.decompress(blob) if isinstance(blob, bytes) else blob)
+
+    def _write(self, conversation_id, state):
+        blob = json.dumps(state, default=str, separators=(",", ":"))
+        if self._compress:
+            blob = zlib.compress(blob.encode(), 6)
+        self._conn.execute(
+            f"INSERT OR REPLACE INTO {self._table} (id, state, updated_at) VALUES (?, ?, ?)",
+            (conversation_id, blob, time.time()),
+        )
+
+    def get(self, conversation_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            return self._read(conversation_id)
+
+    def save(self, conversation_id: str, state: Dict[str, Any]):
+        with self._lock, self._conn:
+            self._write(conversation_id, state)
+
+    def update(
+        self, conversation_id: str, change: Callable[[Dict[str, Any]], Optional[Dict[str, Any]]]
+    ) -> Optional[Dict[str, Any]]:
+        """
+        Read, change and save one document as a single write transaction, so
+        concurrent updates from other threads or processes are not lost.
+        ``change(state)`` returns the new state, or None to leave it as is.
+        Returns the saved state, or None if nothing was saved.
+        """
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                state = self._read(conversation_id)
+                state = change(state) if state is not None else None
+                if state is not None:
+                    self._write(conversation_id, state)
+                self._conn.commit()
+            except BaseException:
+                self._conn.rollback()
+                raise
+        return state
+
+    def delete(self, conversation_id: str):
+        with self._lock, self._conn:
+            self._conn.execute(f"DELETE FROM {self._table} WHERE id = ?", (conversation_id,))
+
+    def prune(
+        self,
+        max_age: Optional[float] = None,
+        max_rows: Optional[int] = None,
+        condition: Optional[str] = None,
+    ) -> int:
+        """
+        Delete documents not saved for ``max_age`` seconds, then the least
+        recently saved beyond ``max_rows``. With ``condition`` (an SQL
+        expression over id, state and updated_at) only matching rows are
+        deleted or counted. Returns how many were deleted.
+        """
+        where = f"({condition})" if condition else "1"
+        removed = 0
+        with self._lock, self._conn:
+            if max_age is not None:
+                removed += self._conn.execute(
+                    f"DELETE FROM {self._table} WHERE {where} AND updated_at < ?",
+                    (time.time() - max_age,),
+                ).rowcount
+            if max_rows is not None:
+                removed += self._conn.execute(
+                    f"DELETE FROM {self._table} WHERE id IN (SELECT id FROM {self._table} "
+                    f"WHERE {where} ORDER BY updated_at DESC LIMIT -1 OFFSET ?)",
+                    (max_rows,),
+                ).rowcount
+        return removed
+
+
+class TieredConversationStore(ConversationStore):
+    """
+    An LRU/TTL memory tier in front of a persistent store.
+
+    Reads hit memory first; entries older than ``ttl`` seconds or beyond
+    ``max_items`` drop out of memory only, and are read back from
+    ``persistent`` when needed. Writes go to both tiers.
+    """
+
+    def __init__(self, persistent: ConversationStore, max_items: int = 256, ttl: float = 3600.0):
+        self.persistent = persistent
+        self.max_items = max_items
+        self.ttl = ttl
+        self._items: "OrderedDict[str, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _remember(self, conversation_id: str, state: Dict[str, Any]):
+        with self._lock:
+            self._items[conversation_id] = (time.monotonic(), state)
+            self._items.move_to_end(conversation_id)
+            while len(self._items) > self.max_items:
+                self._items.popitem(last=False)
+
+    def get(self, conversation_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            entry = self._items.get(conversation_id)
+            if entry is not None:
+                if time.monotonic() - entry[0] <= self.ttl:
+                    self._items.move_to_end(conversation_id)
+                    return entry[1]
+                del self._items[conversation_id]
+        state = self.persistent.get(conversation_id)
+        if state is not None:
+            self._remember(conversation_id, state)
+        return state
+
+    def save(self, conversation_id: str, state: Dict[str, Any]):
+        self.persistent.save(conversation_id, state)
+        self._remember(conversation_id, state)
+
+    def delete(self, conversation_id: str):
+        with self._lock:
+            self._items.pop(conversation_id, None)
+        self.persistent.delete(conversation_id)
+
+    def prune(self, max_age=None, max_rows=None, condition=None) -> int:
+        """
+        Prune the persistent tier; the memory tier is bounded already.
+        """
+        return self.persistent.prune(max_age, max_rows, condition)
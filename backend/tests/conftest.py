@@ -0,0 +1,5 @@
+import os
+import sys
+
+# the backend modules are imported top-level, as uvicorn runs them from backend/
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
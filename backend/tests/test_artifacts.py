@@ -0,0 +1,86 @@
+from collections import Counter
+
+import boto3
+import pytest
+from moto import mock_aws
+
+import artifacts
+import aws
+from artifacts import artifact_key, file_digests, publish_file, put_artifact, resolve_artifact
+from store import SQLiteConversationStore
+
+BUCKET = "test-artifacts"
+
+
+@pytest.fixture
+def s3(tmp_path, monkeypatch):
+    for name in ("AWS_ACCESS_KEY_ID", "AWS_SECRET_ACCESS_KEY", "AWS_SESSION_TOKEN"):
+        monkeypatch.setenv(name, "testing")
+    monkeypatch.setattr(
+        artifacts, "_name_store", SQLiteConversationStore(str(tmp_path / "artifacts.sqlite3"), table="artifact_names")
+    )
+    monkeypatch.setattr(artifacts, "_present", set())
+    with mock_aws():
+        client = boto3.client("s3", region_name=aws.S3_REGION)
+        client.calls = Counter()
+        client.meta.events.register(
+            "before-call.s3.*", lambda model, **kwargs: client.calls.update([model.name])
+        )
+        aws.set_s3_client(client)
+        yield client
+    aws.set_s3_client(None)
+
+
+@pytest.fixture
+def cif(tmp_path):
+    path = tmp_path / "mp-23.cif"
+    path.write_text("data_Ni\n_cell_length_a 3.52\n")
+    return path
+
+
+def test_ensure_bucket_checks_once_per_process(s3):
+    aws.ensure_bucket(BUCKET)
+    aws.ensure_bucket(BUCKET)
+    assert s3.calls["HeadBucket"] == 1
+    assert s3.calls["CreateBucket"] == 1
+    assert BUCKET in [b["Name"] for b in s3.list_buckets()["Buckets"]]
+
+
+def test_same_content_is_uploaded_once(s3, cif, tmp_path):
+    key = put_artifact(cif, name="Ni_conversation1.cif", bucket=BUCKET)
+    sha256, _ = file_digests(cif)
+    assert key == artifact_key(sha256, ".cif")
+    head = s3.head_object(Bucket=BUCKET, Key=key)
+    assert head["Metadata"]["sha256"] == sha256
+
+    copy = tmp_path / "copy.cif"
+    copy.write_bytes(cif.read_bytes())
+    assert put_artifact(copy, name="Ni_conversation2.cif", bucket=BUCKET) == key
+    assert s3.calls["PutObject"] == 1
+    assert resolve_artifact("Ni_conversation2.cif")["key"] == key
+
+
+def test_existing_object_is_found_by_its_metadata_after_a_restart(s3, cif, monkeypatch):
+    key = put_artifact(cif, bucket=BUCKET)
+    monkeypatch.setattr(artifacts, "_present", set())
+    assert put_artifact(cif, bucket=BUCKET) == key
+    assert s3.calls["PutObject"] == 1
+    assert s3.calls["HeadObject"] == 2
+
+
+def test_objects_without_metadata_are_matched_by_etag(s3, cif):
+    aws.ensure_bucket(BUCKET)
+    sha256, _ = file_digests(cif)
+    key = artifact_key(sha256, ".cif")
+    # uploaded before artifacts.py recorded the hash
+    s3.put_object(Bucket=BUCKET, Key=key, Body=cif.read_bytes())
+    assert put_artifact(cif, bucket=BUCKET) == key
+    assert s3.calls["PutObject"] == 1
+
+
+def test_publish_file_uploads_only_changed_content(s3, cif):
+    assert publish_file(cif, "viz/Ni.cif", bucket=BUCKET)
+    assert not publish_file(cif, "viz/Ni.cif", bucket=BUCKET)
+    cif.write_text("data_Ni\n_cell_length_a 3.53\n")
+    assert publish_file(cif, "viz/Ni.cif", bucket=BUCKET)
+    assert s3.calls["PutObject"] == 2
@@ -0,0 +1,79 @@
+import time
+
+import pytest
+
+import chemical_formula
+from chemical_formula import absorbing_element, as_formula, get_chemical_formula
+from store import LRUCache, SQLiteConversationStore
+
+
+class FakeModel:
+    def __init__(self, answers):
+        self.answers = answers
+        self.asked = []
+
+    def __call__(self, compound_name):
+        self.asked.append(compound_name)
+        return self.answers[compound_name]
+
+
+@pytest.fixture(autouse=True)
+def formula_store(tmp_path, monkeypatch):
+    store = SQLiteConversationStore(str(tmp_path / "formulas.sqlite3"), table="chemical_formula")
+    monkeypatch.setattr(chemical_formula, "_formula_store", store)
+    monkeypatch.setattr(chemical_formula, "_resolved", LRUCache(16))
+    return store
+
+
+def test_formulas_and_element_names_resolve_locally():
+    assert as_formula(" NiMoO4 ") == "NiMoO4"
+    assert as_formula("Fe2(SO4)3") == "Fe2(SO4)3"
+    assert as_formula("Nickel") == "Ni"
+    assert as_formula("nickel molybdate") is None
+
+    model = FakeModel({})
+    assert get_chemical_formula("Cobalt", remote=model) == "Co"
+    assert model.asked == []
+
+
+def test_names_are_asked_once_and_remembered(formula_store):
+    model = FakeModel({"Nickel molybdate": " NiMoO4\n"})
+    assert get_chemical_formula("Nickel molybdate", remote=model) == "NiMoO4"
+    # case and spacing do not make a new name
+    assert get_chemical_formula("nickel   MOLYBDATE", remote=model) == "NiMoO4"
+    assert model.asked == ["Nickel molybdate"]
+    assert formula_store.get("nickel molybdate")["formula"] == "NiMoO4"
+
+
+def test_remembered_names_survive_the_memory_tier(monkeypatch):
+    model = FakeModel({"cobalt oxide": "CoO"})
+    get_chemical_formula("cobalt oxide", remote=model)
+    monkeypatch.setattr(chemical_formula, "_resolved", LRUCache(16))
+    assert get_chemical_formula("cobalt oxide", remote=model) == "CoO"
+    assert len(model.asked) == 1
+
+
+def test_expired_names_are_asked_again(monkeypatch, formula_store):
+    model = FakeModel({"rust": "Fe2O3"})
+    get_chemical_formula("rust", remote=model)
+    now = time.time()
+    monkeypatch.setattr(chemical_formula.time, "time", lambda: now + chemical_formula.FORMULA_TTL + 1)
+    assert get_chemical_formula("rust", remote=model) == "Fe2O3"
+    assert model.asked == ["rust", "rust"]
+
+
+def test_overlong_answers_are_not_remembered(formula_store):
+    model = FakeModel({"mystery": "I am not sure which compound you mean"})
+    assert get_chemical_formula("mystery", remote=model) == ""
+    assert formula_store.get("mystery") is None
+
+
+def test_absorber_defaults_to_the_heaviest_element():
+    assert absorbing_element("NiO") == "Ni"
+    assert absorbing_element("Fe2(SO4)3") == "Fe"
+    assert absorbing_element("Nickel") == "Ni"
+    assert absorbing_element("NiMoO4", "ni") == "Ni"
+    with pytest.raises(ValueError):
+        absorbing_element("NiO", "Co")
+    with pytest.raises(ValueError):
+        absorbing_element("nickel molybdate")
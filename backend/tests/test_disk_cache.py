@@ -0,0 +1,45 @@
+import os
+import time
+
+import disk_cache
+from disk_cache import DiskCache
+
+DAY = 24 * 3600
+
+
+def make_entry(root, name, size, age, now):
+    path = root / name
+    path.mkdir()
+    (path / "data").write_bytes(b"x" * size)
+    os.utime(path, (now - age, now - age))
+    return path
+
+
+def test_old_entries_are_removed(tmp_path):
+    now = time.time()
+    old = make_entry(tmp_path, "old", 10, 10 * DAY, now)
+    new = make_entry(tmp_path, "new", 10, 2 * DAY, now)
+    removed = DiskCache("test", tmp_path, max_mb=None, max_days=5).prune(now)
+    assert removed == {"entries": 1, "bytes": 10}
+    assert not old.exists() and new.exists()
+
+
+def test_least_recently_used_go_until_under_the_size_limit(tmp_path):
+    now = time.time()
+    mb = 1024 * 1024
+    entries = [make_entry(tmp_path, f"e{i}", mb, (5 - i) * DAY, now) for i in range(5)]
+    DiskCache("test", tmp_path, max_mb=2.5, max_days=None).prune(now)
+    assert [e.exists() for e in entries] == [False, False, False, True, True]
+
+
+def test_recently_used_entries_and_locks_are_kept(tmp_path):
+    now = time.time()
+    used = make_entry(tmp_path, "used", 10, 10 * DAY, now)
+    disk_cache.touch(used)
+    lock = tmp_path / ".used.lock"
+    lock.touch()
+    os.utime(lock, (now - 10 * DAY, now - 10 * DAY))
+    scratch = make_entry(tmp_path, ".used-tmp", 10, 2 * DAY, now)
+    DiskCache("test", tmp_path, max_mb=None, max_days=1).prune(now)
+    assert used.exists() and lock.exists()
+    assert not scratch.exists()
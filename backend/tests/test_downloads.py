@@ -0,0 +1,144 @@
+import asyncio
+import io
+import threading
+import time
+import zipfile
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+import spectrum_database
+from downloads import DownloadManager, create_session
+
+
+def dataset_zip(name):
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w") as zf:
+        zf.writestr(f"{name}/spectrum.txt", "# energy mu\n8300 0.1\n")
+        zf.writestr(f"{name}/readme.pdf", "not a spectrum")
+    return buffer.getvalue()
+
+
+class MDRStandIn(ThreadingHTTPServer):
+    """
+    Serves /datasets/<id>.zip from ``files``; a request for an id in
+    ``hold`` waits until that id's event is set.
+    """
+
+    daemon_threads = True
+
+    def __init__(self):
+        super().__init__(("127.0.0.1", 0), Handler)
+        self.files = {}
+        self.hold = {}
+        self.requested = []
+        self.lock = threading.Lock()
+
+
+class Handler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        dataset_id = self.path.rsplit("/", 1)[-1].removesuffix(".zip")
+        with self.server.lock:
+            self.server.requested.append(dataset_id)
+        if dataset_id in self.server.hold:
+            self.server.hold[dataset_id].wait(10)
+        body = self.server.files.get(dataset_id)
+        if body is None:
+            self.send_response(404)
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def mdr(tmp_path, monkeypatch):
+    monkeypatch.setattr(spectrum_database, "XAS_DATA_DIR", str(tmp_path / "online_xas_data"))
+    server = MDRStandIn()
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    for event in server.hold.values():
+        event.set()
+    server.shutdown()
+    server.server_close()
+
+
+def wait_for(condition, timeout=10):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.01)
+
+
+def manager(mdr, **kwargs):
+    return DownloadManager(
+        session=create_session(4),
+        url_template=f"http://127.0.0.1:{mdr.server_port}/datasets/{{dataset_id}}.zip",
+        **kwargs,
+    )
+
+
+def test_downloads_extract_the_spectra_once(mdr):
+    mdr.files["ds-1"] = dataset_zip("ds-1")
+    downloads = manager(mdr)
+    try:
+        files = downloads.submit("ds-1").result(10)
+        assert [f.rsplit("/", 2)[-2:] for f in files] == [["ds-1", "spectrum.txt"]]
+        # the completion marker serves the second call
+        assert downloads.submit("ds-1").result(10) == files
+        assert mdr.requested == ["ds-1"]
+    finally:
+        downloads.shutdown()
+
+
+def test_callers_join_a_download_in_flight(mdr):
+    mdr.files["ds-1"] = dataset_zip("ds-1")
+    mdr.hold["ds-1"] = threading.Event()
+    downloads = manager(mdr)
+    try:
+        first = downloads.submit("ds-1")
+        wait_for(lambda: mdr.requested)
+        second = downloads.submit("ds-1")
+        assert first is second and not first.done()
+        mdr.hold["ds-1"].set()
+        assert first.result(10)
+        assert mdr.requested == ["ds-1"]
+    finally:
+        downloads.shutdown()
+
+
+def test_downloads_beyond_the_per_host_limit_wait_without_a_thread(mdr):
+    for name in ("ds-1", "ds-2", "ds-3"):
+        mdr.files[name] = dataset_zip(name)
+    mdr.hold["ds-1"] = threading.Event()
+    downloads = manager(mdr, max_workers=2, per_host=1)
+    try:
+        futures = [downloads.submit(name) for name in ("ds-1", "ds-2", "ds-3")]
+        wait_for(lambda: mdr.requested)
+        assert not futures[0].done()
+        assert [d for d, _ in downloads._host_queue[downloads._host("ds-2")]] == ["ds-2", "ds-3"]
+        assert mdr.requested == ["ds-1"]
+        mdr.hold["ds-1"].set()
+        assert all(f.result(10) for f in futures)
+        assert mdr.requested == ["ds-1", "ds-2", "ds-3"]
+        assert not downloads._host_queue
+    finally:
+        downloads.shutdown()
+
+
+def test_fetch_all_maps_failures_to_none(mdr):
+    mdr.files["good"] = dataset_zip("good")
+    mdr.files["corrupt"] = b"not a zip file"
+    downloads = manager(mdr)
+    try:
+        files = asyncio.run(downloads.fetch_all(["good", "corrupt", "missing", "good"]))
+        assert list(files) == ["good", "corrupt", "missing"]
+        assert files["good"] and files["corrupt"] is None and files["missing"] is None
+    finally:
+        downloads.shutdown()
@@ -0,0 +1,64 @@
+import asyncio
+import threading
+
+import pytest
+
+import jobs
+from store import SQLiteConversationStore
+
+
+@pytest.fixture(autouse=True)
+def job_store(tmp_path, monkeypatch):
+    store = SQLiteConversationStore(str(tmp_path / "jobs.sqlite3"), table="jobs")
+    monkeypatch.setattr(jobs, "_job_store", store)
+    return store
+
+
+def test_stages_count_the_earlier_ones_as_done():
+    job_id = jobs.create_job("fit", jobs.FIT_STAGES)
+    jobs.set_job_stage(job_id, "path_parse")
+    job = jobs.get_job(job_id)
+    assert job["status"] == "running"
+    assert job["completed_stages"] == ["structure_lookup", "feff"]
+    assert job["progress"] == pytest.approx(2 / 6)
+
+
+def test_ended_jobs_are_not_brought_back_to_running():
+    job_id = jobs.create_job("fit", jobs.FIT_STAGES)
+    jobs.cancel_job_record(job_id)
+    jobs.set_job_stage(job_id, "fit")
+    jobs.finish_job(job_id, {"rows": []})
+    job = jobs.get_job(job_id)
+    assert job["status"] == "cancelled"
+    assert job["result"] is None
+
+
+def test_concurrent_updates_are_not_lost(job_store):
+    job_id = jobs.create_job("fit", jobs.FIT_STAGES)
+
+    def count():
+        for _ in range(50):
+            job_store.update(job_id, lambda state: {**state, "n": state.get("n", 0) + 1})
+
+    threads = [threading.Thread(target=count) for _ in range(4)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert jobs.get_job(job_id)["n"] == 200
+
+
+def test_stage_reports_on_the_event_loop_are_written_in_order():
+    job_id = jobs.create_job("fit", jobs.FIT_STAGES)
+    on_stage = jobs.StageReporter(job_id)
+
+    async def pipeline():
+        on_stage("feff")
+        on_stage("fit")
+        await jobs.record(jobs.finish_job, job_id, "ok")
+        on_stage("render")  # too late, the job is done
+        await jobs.record(jobs.get_job, job_id)
+
+    asyncio.run(pipeline())
+    job = jobs.get_job(job_id)
+    assert (job["status"], job["stage"], job["result"]) == ("done", None, "ok")
@@ -0,0 +1,90 @@
+from types import SimpleNamespace
+
+import pytest
+
+import material_database
+from material_database import search_materials, search_materials_batch
+from store import SQLiteConversationStore
+
+
+def doc(material_id, formula, theoretical=False, e_hull=0.0):
+    return SimpleNamespace(
+        material_id=material_id,
+        formula_pretty=formula,
+        theoretical=theoretical,
+        energy_above_hull=e_hull,
+    )
+
+
+class StubSummary:
+    def __init__(self, docs):
+        self.docs = docs
+        self.calls = []
+
+    def search(self, formula=None, material_ids=None, fields=None):
+        self.calls.append(formula if formula is not None else material_ids)
+        wanted = [formula] if isinstance(formula, str) else formula
+        return [d for d in self.docs if d.formula_pretty in wanted]
+
+
+@pytest.fixture
+def summary(tmp_path, monkeypatch):
+    db = str(tmp_path / "materials.sqlite3")
+    monkeypatch.setattr(
+        material_database, "_candidate_store", SQLiteConversationStore(db, table="formula_candidates")
+    )
+    monkeypatch.setattr(
+        material_database, "_choice_store", SQLiteConversationStore(db, table="formula_choice")
+    )
+    monkeypatch.setattr(material_database, "_client", None)
+    summary = StubSummary(
+        [
+            doc("mp-19009", "NiO", theoretical=True, e_hull=0.0),
+            doc("mp-715434", "NiO", e_hull=0.05),
+            doc("mp-23", "Ni"),
+            doc("mp-102", "Co", e_hull=0.01),
+            doc("mp-54", "Co"),
+        ]
+    )
+    material_database.set_client(SimpleNamespace(materials=SimpleNamespace(summary=summary)))
+    return summary
+
+
+def test_formula_variants_share_one_lookup_and_choice(summary):
+    chosen = search_materials_batch(["NiO", "Ni2O2", " NiO"])
+    assert chosen == {"NiO": "mp-715434", "Ni2O2": "mp-715434", " NiO": "mp-715434"}
+    assert search_materials("ni") == search_materials("Ni") == "mp-23"
+    assert summary.calls == ["NiO", "Ni"]
+
+
+def test_rank_key_prefers_experimental_then_hull_then_numeric_id():
+    candidates = [
+        {"material_id": "mp-1000", "theoretical": False, "energy_above_hull": 0.0},
+        {"material_id": "mp-13", "theoretical": False, "energy_above_hull": 0.0},
+        {"material_id": "mp-2", "theoretical": False, "energy_above_hull": 0.1},
+        {"material_id": "mp-1", "theoretical": True, "energy_above_hull": 0.0},
+        {"material_id": "mp-3", "theoretical": False, "energy_above_hull": None},
+    ]
+    ranked = sorted(candidates, key=material_database.rank_key)
+    assert [c["material_id"] for c in ranked] == ["mp-13", "mp-1000", "mp-2", "mp-3", "mp-1"]
+    assert material_database.select_material(candidates) == "mp-13"
+    assert material_database.select_material([]) is None
+
+
+def test_the_choice_is_remembered_in_sqlite(summary):
+    assert search_materials("Co") == "mp-54"
+    # MP gains a better entry; the formula keeps its structure and FEFF runs
+    summary.docs.append(doc("mp-1", "Co"))
+    material_database._candidate_store.delete("Co")
+    assert search_materials("Co") == "mp-54"
+    assert summary.calls == ["Co"]
+
+
+def test_batch_search_uses_one_call_for_uncached_formulas(summary):
+    assert search_materials("Ni") == "mp-23"
+    chosen = search_materials_batch(["Ni", "NiO", "Co", "Xe"])
+    assert chosen == {"Ni": "mp-23", "NiO": "mp-715434", "Co": "mp-54", "Xe": None}
+    assert summary.calls == ["Ni", ["NiO", "Co", "Xe"]]
+    # no match is not remembered, so it is asked again
+    search_materials("Xe")
+    assert summary.calls[-1] == "Xe"
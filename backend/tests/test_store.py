@@ -0,0 +1,63 @@
+import time
+
+from store import LRUCache, SQLiteConversationStore, TieredConversationStore
+
+
+def make_store(tmp_path, **kwargs):
+    return SQLiteConversationStore(str(tmp_path / "store.sqlite3"), **kwargs)
+
+
+def age(store, conversation_id, seconds):
+    with store._conn:
+        store._conn.execute(
+            "UPDATE conversations SET updated_at = ? WHERE id = ?",
+            (time.time() - seconds, conversation_id),
+        )
+
+
+def test_prune_removes_old_documents(tmp_path):
+    store = make_store(tmp_path, compress=True)
+    store.save("old", {"history": []})
+    store.save("new", {"history": []})
+    age(store, "old", 100)
+    assert store.prune(max_age=50) == 1
+    assert store.get("old") is None and store.get("new") is not None
+
+
+def test_prune_keeps_the_most_recently_saved_rows(tmp_path):
+    store = make_store(tmp_path)
+    for i in range(5):
+        store.save(f"c{i}", {"i": i})
+        age(store, f"c{i}", 10 - i)
+    assert store.prune(max_rows=2) == 3
+    assert [store.get(f"c{i}") is not None for i in range(5)] == [False, False, False, True, True]
+
+
+def test_prune_condition_limits_what_is_removed(tmp_path):
+    store = make_store(tmp_path)
+    store.save("running", {"status": "running"})
+    store.save("done", {"status": "done"})
+    age(store, "running", 100)
+    age(store, "done", 100)
+    removed = store.prune(max_age=50, condition="json_extract(state, '$.status') = 'done'")
+    assert removed == 1
+    assert store.get("running") is not None and store.get("done") is None
+
+
+def test_tiered_store_prunes_its_persistent_tier(tmp_path):
+    persistent = make_store(tmp_path)
+    store = TieredConversationStore(persistent)
+    store.save("old", {})
+    age(persistent, "old", 100)
+    assert store.prune(max_age=50) == 1
+    assert persistent.get("old") is None
+
+
+def test_lru_cache_drops_the_least_recently_used():
+    cache = LRUCache(2)
+    cache.put("a", 1)
+    cache.put("b", 2)
+    assert cache.get("a") == 1
+    cache.put("c", 3)
+    assert (cache.get("a"), cache.get("b"), cache.get("c")) == (1, None, 3)
+    assert len(cache) == 2
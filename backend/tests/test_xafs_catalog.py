@@ -0,0 +1,132 @@
+import json
+import os
+import threading
+
+import pytest
+
+import spectrum_database
+from spectrum_database import XafsCatalog, title_map
+
+FIXTURE = os.path.join(os.path.dirname(__file__), "fixtures", "mdr_catalog.json")
+
+
+class RecordedResponse:
+    def __init__(self, items, status_code=200, headers=None):
+        self._items = items
+        self.status_code = status_code
+        self.headers = headers or {}
+
+    def json(self):
+        return self._items
+
+    def raise_for_status(self):
+        pass
+
+
+@pytest.fixture
+def recorded():
+    with open(FIXTURE) as f:
+        return json.load(f)
+
+
+@pytest.fixture
+def catalog(tmp_path, monkeypatch, recorded):
+    calls = []
+
+    def get(url, headers=None, timeout=None):
+        calls.append(headers or {})
+        if headers and headers.get("If-None-Match") == '"v1"':
+            return RecordedResponse(None, status_code=304)
+        return RecordedResponse(recorded, headers={"ETag": '"v1"'})
+
+    monkeypatch.setattr(spectrum_database.requests, "get", get)
+    catalog = XafsCatalog(path=str(tmp_path / "catalog.json"), url="http://mdr.test/datasets")
+    catalog.calls = calls
+    return catalog
+
+
+def ids(entries):
+    return [e["id"][:2] for e in entries]
+
+
+def test_query_without_filters_returns_everything_in_order(catalog):
+    total, entries = catalog.query()
+    assert total == 7
+    assert ids(entries) == ["0b", "1c", "2d", "3e", "4f", "5a", "6b"]
+
+
+def test_search_matches_title_and_specimen_tokens(catalog):
+    assert ids(catalog.query(q="nickel foil")[1]) == ["0b"]
+    assert ids(catalog.query(q="NiMoO4")[1]) == ["1c"]
+    # all words must match, the last one as a prefix
+    assert ids(catalog.query(q="K-edge xan")[1]) == ["3e"]
+    assert catalog.query(q="platinum") == (0, [])
+
+
+def test_element_filter_accepts_symbols_and_names(catalog):
+    assert ids(catalog.query(element="Ni")[1]) == ["0b", "1c"]
+    assert ids(catalog.query(element="nickel")[1]) == ["0b", "1c"]
+    # elements come from specimen formulas too
+    assert ids(catalog.query(element="Mo")[1]) == ["1c"]
+    assert ids(catalog.query(element="O")[1]) == ["1c", "3e", "4f", "5a", "6b"]
+
+
+def test_search_and_element_filter_combine(catalog):
+    assert ids(catalog.query(q="xafs", element="Cu")[1]) == ["4f", "5a"]
+    assert catalog.query(q="foil", element="Fe") == (0, [])
+
+
+def test_paging_keeps_the_total(catalog):
+    total, page = catalog.query(element="O", offset=1, limit=2)
+    assert total == 5
+    assert ids(page) == ["3e", "4f"]
+    total, page = catalog.query(element="O", offset=4, limit=2)
+    assert total == 5
+    assert ids(page) == ["6b"]
+    assert catalog.query(element="O", offset=10, limit=2) == (5, [])
+
+
+def test_duplicate_titles_get_distinct_labels(catalog):
+    labels = title_map(catalog.query(q="cu")[1])
+    assert sorted(labels) == ["Cu K-edge XAFS [4f90dea2]", "Cu K-edge XAFS [5a01efb3]"]
+
+
+def test_catalog_is_saved_and_revalidated(catalog, tmp_path):
+    catalog.query()
+    assert len(catalog.calls) == 1
+
+    reloaded = XafsCatalog(path=str(tmp_path / "catalog.json"), url="http://mdr.test/datasets")
+    assert reloaded.query(element="Zn")[0] == 1
+    assert len(catalog.calls) == 1  # served from catalog.json
+
+    reloaded.refresh()
+    assert catalog.calls[-1]["If-None-Match"] == '"v1"'
+    assert reloaded.query()[0] == 7  # a 304 keeps the entries
+
+
+def test_queries_during_refresh_see_a_consistent_snapshot(catalog, recorded, monkeypatch):
+    catalog.query()
+    smaller = RecordedResponse(recorded[:3], headers={"ETag": '"v2"'})
+    full = RecordedResponse(recorded, headers={"ETag": '"v3"'})
+    responses = [smaller, full] * 50
+    monkeypatch.setattr(spectrum_database.requests, "get", lambda *a, **k: responses.pop())
+
+    errors = []
+
+    def query():
+        try:
+            for _ in range(200):
+                total, entries = catalog.query(q="k-edge", element="O")
+                # either the 3-entry or the 7-entry catalog, never a mix
+                assert (total, ids(entries)) in [(1, ["1c"]), (5, ["1c", "3e", "4f", "5a", "6b"])]
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=query) for _ in range(4)]
+    for t in threads:
+        t.start()
+    while responses:
+        catalog.refresh()
+    for t in threads:
+        t.join()
+    assert errors == []
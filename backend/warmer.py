@@ -0,0 +1,290 @@
+"""
+Background cache warmer.
+
+The API counts how often each material and dataset is asked for (chat
+turns, /material_database and /xafs/{id}). While the process pool is idle,
+the warmer takes the most requested ones and fills the local caches the way
+a chat turn would: MP lookup and CIF for a material plus its FEFF run and
+path index, download and processed spectra for a dataset. Its pool work runs
+in the "warm" scheduler class, below every user request, and is given up
+as soon as a user request has to wait for a worker.
+
+Seed a node before it takes traffic with
+
+    python warmer.py --top 20
+    python warmer.py --materials Co NiO --datasets <dataset id> ...
+"""
+
+import argparse
+import asyncio
+import os
+import sqlite3
+import threading
+import time
+from collections import Counter
+from typing import Dict, Iterable, List, Optional
+
+from agent import run_feff
+from downloads import download_manager
+from executor import (
+    run_in_pool,
+    pool_status,
+    shutdown_executor,
+    cancel_requested,
+    current_priority,
+    current_user,
+    JobCancelled,
+)
+from material_database import search_materials, get_material_by_id
+from physics.batch_fit import spectrum_files
+from physics.physic_functions import load_dat, load_paths
+
+WARM_DB_PATH = os.getenv("XAS_WARM_DB", "warm.sqlite3")
+WARM_TOP_N = int(os.getenv("XAS_WARM_TOP_N", 10))
+WARM_INTERVAL = float(os.getenv("XAS_WARM_INTERVAL", 300))  # seconds, 0 disables
+WARM_WINDOW = float(os.getenv("XAS_WARM_WINDOW", 30 * 24 * 3600))  # only count recent requests
+TRACK_FLUSH_INTERVAL = float(os.getenv("XAS_TRACK_FLUSH_INTERVAL", 10))  # seconds
+TRACK_MAX_PENDING = 10000  # distinct keys held between flushes
+PREEMPT_CHECK = 1.0  # seconds between checks for user work while warming
+
+
+class RequestStats:
+    """
+    Request counts per (kind, key) in SQLite, shared by all API processes.
+    """
+
+    def __init__(self, db_path: str = WARM_DB_PATH, timeout: float = 30.0):
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, timeout=timeout, check_same_thread=False)
+        with self._lock, self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS request_counts ("
+                "kind TEXT NOT NULL, key TEXT NOT NULL, count INTEGER NOT NULL, "
+                "last_seen REAL NOT NULL, PRIMARY KEY (kind, key))"
+            )
+
+    def record(self, counts: Dict[tuple, int], seen_at: Optional[float] = None):
+        """
+        Add ``counts`` ({ (kind, key): requests }) to the stored counts.
+        """
+        seen_at = seen_at or time.time()
+        rows = [(kind, key, n, seen_at) for (kind, key), n in counts.items()]
+        if not rows:
+            return
+        with self._lock, self._conn:
+            self._conn.executemany(
+                "INSERT INTO request_counts (kind, key, count, last_seen) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT (kind, key) DO UPDATE SET "
+                "count = count + excluded.count, last_seen = excluded.last_seen",
+                rows,
+            )
+
+    def top(self, kind: str, n: int, window: float = WARM_WINDOW) -> List[str]:
+        """
+        The ``n`` most requested keys of ``kind`` seen within ``window`` seconds.
+        """
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT key FROM request_counts WHERE kind = ? AND last_seen >= ? "
+                "ORDER BY count DESC, last_seen DESC LIMIT ?",
+                (kind, time.time() - window, n),
+            ).fetchall()
+        return [row[0] for row in rows]
+
+
+_stats = None
+_warmed = set()  # (kind, key) warmed by this process
+_pending = Counter()  # (kind, key) -> requests not yet written to the stats
+_pending_lock = threading.Lock()
+
+
+def get_stats() -> RequestStats:
+    global _stats
+    if _stats is None:
+        _stats = RequestStats()
+    return _stats
+
+
+def track(kind: str, *keys: str):
+    """
+    Count a request for ``keys`` ("material" formulas or "dataset" ids that
+    resolved). Only counts in memory, so it is safe on the event loop;
+    flush_requests writes the counts out.
+    """
+    with _pending_lock:
+        for key in dict.fromkeys(keys):
+            if key and ((kind, key) in _pending or len(_pending) < TRACK_MAX_PENDING):
+                _pending[(kind, key)] += 1
+
+
+def flush_requests():
+    """
+    Write the counts gathered by track to the stats. Blocking; run it in a thread.
+    """
+    global _pending
+    with _pending_lock:
+        counts, _pending = _pending, Counter()
+    try:
+        get_stats().record(counts)
+    except Exception as e:
+        print(f"Could not record {len(counts)} request counts: {e}")
+
+
+async def flush_forever(interval: float = TRACK_FLUSH_INTERVAL):
+    try:
+        while True:
+            await asyncio.sleep(interval)
+            await asyncio.to_thread(flush_requests)
+    finally:
+        # the last counts on shutdown
+        await asyncio.to_thread(flush_requests)
+
+
+def is_idle() -> bool:
+    return pool_status()["in_flight"] == 0
+
+
+def users_waiting() -> bool:
+    """
+    True if interactive or batch work is queued for a worker.
+    """
+    classes = pool_status()["classes"]
+    return any(classes[cls]["queued"] for cls in classes if cls != "warm")
+
+
+def process_spectra(files) -> int:
+    """
+    Pool worker: run load_dat on ``files`` so their processed spectra are cached.
+    """
+    for filename in files:
+        if cancel_requested():
+            raise JobCancelled("Warming cancelled")
+        load_dat(str(filename))
+    return len(files)
+
+
+async def warm_material(formula: str) -> Optional[str]:
+    """
+    Lookup, CIF, FEFF run and path index of ``formula``, as a chat turn
+    selecting it would need them. Returns the material id, if any.
+    """
+    material_id = await asyncio.to_thread(search_materials, formula)
+    if material_id is None:
+        return None
+    await asyncio.to_thread(get_material_by_id, material_id)
+    # chat turns run FEFF with the selected formula as absorber
+    run_dir = await run_feff(material_id, formula)
+    await asyncio.to_thread(load_paths, run_dir)
+    return material_id
+
+
+async def warm_dataset(dataset_id: str) -> int:
+    """
+    Download ``dataset_id`` and process its .dat spectra; returns how many.
+    """
+    if not await download_manager.fetch(dataset_id):
+        return 0
+    try:
+        files = await asyncio.to_thread(spectrum_files, dataset_id)
+    except FileNotFoundError:
+        # .txt only: nothing to process beyond the download
+        return 0
+    return await run_in_pool(process_spectra, files)
+
+
+async def warm(
+    materials: Iterable[str] = (),
+    datasets: Iterable[str] = (),
+    only_when_idle: bool = False,
+) -> Dict[str, Dict[str, str]]:
+    """
+    Warm ``materials`` and ``datasets`` in the "warm" scheduler class.
+    With ``only_when_idle`` it starts an item only while the pool is idle,
+    skips what this process has warmed before, and gives up the item in
+    progress as soon as user work has to wait for a worker: its FEFF run is
+    killed (unless a user request shares it) and its spectra batch stops
+    before the next file. Returns what happened to each.
+    """
+    current_priority.set("warm")
+    current_user.set("warmer")
+    report = {"materials": {}, "datasets": {}}
+    jobs = [("material", m, warm_material) for m in materials]
+    jobs += [("dataset", d, warm_dataset) for d in datasets]
+    for kind, key, fn in jobs:
+        if only_when_idle and (kind, key) in _warmed:
+            continue
+        if only_when_idle and not is_idle():
+            print("Pool busy, warming paused")
+            break
+        task = asyncio.ensure_future(fn(key))
+        preempted = False
+        try:
+            while only_when_idle and not task.done():
+                await asyncio.wait({task}, timeout=PREEMPT_CHECK)
+                if not task.done() and users_waiting():
+                    preempted = task.cancel()
+        except BaseException:
+            task.cancel()
+            raise
+        try:
+            result = await task
+            report[f"{kind}s"][key] = f"ok: {result}"
+            _warmed.add((kind, key))
+        except asyncio.CancelledError:
+            if not preempted:
+                raise
+            print(f"User work waiting, warming of {kind} {key} given up")
+            report[f"{kind}s"][key] = "preempted"
+            break
+        except Exception as e:
+            print(f"Warming {kind} {key} failed: {e}")
+            report[f"{kind}s"][key] = f"failed: {e}"
+    return report
+
+
+async def warm_top(n: int = WARM_TOP_N, only_when_idle: bool = False):
+    stats = get_stats()
+    materials, datasets = await asyncio.to_thread(
+        lambda: (stats.top("material", n), stats.top("dataset", n))
+    )
+    return await warm(materials, datasets, only_when_idle=only_when_idle)
+
+
+async def warm_forever(interval: float = WARM_INTERVAL, n: int = WARM_TOP_N):
+    """
+    Every ``interval`` seconds, warm the top ``n`` if the pool is idle.
+    """
+    while True:
+        await asyncio.sleep(interval)
+        if not is_idle():
+            continue
+        try:
+            await warm_top(n, only_when_idle=True)
+        except Exception as e:
+            print(f"Cache warming failed: {e}")
+
+
+async def main(args):
+    try:
+        if args.materials or args.datasets:
+            report = await warm(args.materials or [], args.datasets or [])
+        else:
+            report = await warm_top(args.top)
+    finally:
+        shutdown_executor()
+        download_manager.shutdown()
+    for kind, results in report.items():
+        for key, result in results.items():
+            print(f"{kind[:-1]} {key}: {result}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Fill the local caches with the most requested materials and datasets."
+    )
+    parser.add_argument("--top", type=int, default=WARM_TOP_N,
+                        help="how many of the most requested materials and datasets to warm")
+    parser.add_argument("--materials", nargs="*", help="formulas to warm instead of the top ones")
+    parser.add_argument("--datasets", nargs="*", help="dataset ids to warm instead of the top ones")
+    asyncio.run(main(parser.parse_args()))
@@ -42,6 +42,8 @@ export default function Home() {
 
   const [result, setResult] = useState<ExecutionResult>()
   const [messages, setMessages] = useState<Message[]>([])
+  // issued by the backend on the first turn; null starts a new conversation
+  const [conversationId, setConversationId] = useState<string | null>(null)
   const [isPreviewVisible, setIsPreviewVisible] = useState(true)
   //const [fragment, setFragment] = useState<DeepPartial<FragmentSchema>>()
   const [currentTab, setCurrentTab] = useState<'code' | 'viz'>('viz')
@@ -187,7 +189,7 @@ export default function Home() {
 
   // Format the request according to your API's requirements
   const requestData = {
-    conversation_id: "123", // You can make this dynamic if needed
+    conversation_id: conversationId ?? undefined,
     message: chatInput,
     materials: materials,
     xasIDs: xasIDs,
@@ -250,6 +252,7 @@ export default function Home() {
 
     const result = await response.json();
     console.log('API response:', result);
+    setConversationId(result.conversation_id ?? null);
 
 
     // Store the API response as a structured object for Preview
@@ -353,6 +356,7 @@ export default function Home() {
     setChatInput('')
     setFiles([])
     setMessages([])
+    setConversationId(null)
   //  setFragment(undefined)
     setResult(undefined)
     setCurrentTab('code')